@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""PATCH_STORAGE_DIR とログの重複排除スナップショットを作成・検証・復元する。
+
+Docker を使わずにホスト上で動作する。チャンク単位で重複排除するため、
+2 回目以降のスナップショットは変更されたチャンクだけを保存する。
+"""
+
+import argparse
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / "agent" / "src"))
+
+from agent.backup.repository import Repository, SnapshotError  # noqa: E402
+
+
+def parse_source(value: str) -> tuple[str, Path]:
+    name, sep, path = value.partition("=")
+    if not sep or not name or "/" in name:
+        raise argparse.ArgumentTypeError("source は NAME=PATH 形式で指定する")
+    return name, Path(path).expanduser().resolve()
+
+
+def default_sources() -> list[tuple[str, Path]]:
+    state = Path(os.environ.get("PATCH_STORAGE_DIR", ROOT / "agent" / "state" / "patches"))
+    logs = Path(os.environ.get("YAMADA_LOG_DIR", ROOT / "agent" / "logs"))
+    return [("patches", state.expanduser().resolve()), ("logs", logs.expanduser().resolve())]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Yamada6 state のスナップショットツール")
+    parser.add_argument("--repo", type=Path, default=ROOT / "backups" / "repo", help="リポジトリのパス")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    create = sub.add_parser("create", help="スナップショットを作成")
+    create.add_argument("--source", action="append", type=parse_source, help="NAME=PATH (複数指定可)")
+    sub.add_parser("list", help="スナップショット一覧")
+    verify = sub.add_parser("verify", help="チャンクと内容ハッシュを検証")
+    verify.add_argument("snapshot_id", nargs="?", help="省略時は全スナップショット")
+    restore = sub.add_parser("restore", help="スナップショットを復元")
+    restore.add_argument("snapshot_id")
+    restore.add_argument("--target", type=Path, required=True, help="復元先 (<target>/<NAME>/...)")
+    restore.add_argument("--lock", action="store_true", help="稼働中のランタイムと同じロックを取得して復元")
+    args = parser.parse_args()
+
+    repo = Repository(args.repo)
+    try:
+        if args.command == "create":
+            sources = dict(args.source or default_sources())
+            snapshot = repo.create(sources)
+            total = sum(entry.size for entry in snapshot.files)
+            print(
+                f"Snapshot {snapshot.snapshot_id}: {len(snapshot.files)} files, {total} bytes, "
+                f"new chunks {snapshot.new_chunks} ({snapshot.new_bytes} bytes), "
+                f"{snapshot.reused_files} unchanged files skipped"
+            )
+        elif args.command == "list":
+            for snapshot_id in repo.list():
+                print(snapshot_id)
+        elif args.command == "verify":
+            failed = False
+            for snapshot_id in [args.snapshot_id] if args.snapshot_id else repo.list():
+                report = repo.verify(snapshot_id)
+                print(f"{snapshot_id}: {'ok' if report.ok else 'FAILED'} ({report.checked_chunks} chunks)")
+                for problem in report.problems:
+                    print(f"  {problem}")
+                failed = failed or not report.ok
+            raise SystemExit(1 if failed else 0)
+        elif args.command == "restore":
+            stats = repo.restore(args.snapshot_id, args.target.expanduser().resolve(), lock=args.lock)
+            print(f"Restored {stats['restored']} files ({stats['unchanged']} unchanged, {stats['removed']} extra removed)")
+    except SnapshotError as exc:
+        print(f"error: {exc}", file=sys.stderr)
+        raise SystemExit(1) from exc
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""`/patches` 一覧のシリアライズコストを比較するベンチマーク。
+
+before: dataclass → dict → PatchResponse 検証 → JSON (従来の実装)
+after : PendingPatch にキャッシュしたエンコード済み JSON を連結
+"""
+
+import argparse
+import json
+import time
+from dataclasses import asdict
+from pathlib import Path
+import sys
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+from agent.runtime import encoding  # noqa: E402
+from agent.runtime.app import PendingPatch  # noqa: E402
+from agent.runtime.server import PatchResponse  # noqa: E402
+
+
+def build_patches(count: int) -> list[PendingPatch]:
+    return [
+        PendingPatch(
+            patch_id=f"patch-{index:05d}",
+            summary=f"Benchmark patch {index}",
+            author="bench",
+            created_at="2025-10-16T00:00:00Z",
+            artifact_uri=f"file:///tmp/patch-{index:05d}.diff",
+            notes="generated",
+            diff_preview="diff --git a b\n" * 20,
+        )
+        for index in range(count)
+    ]
+
+
+def before(patches: list[PendingPatch]) -> bytes:
+    models = [PatchResponse(**{k: v for k, v in asdict(p).items() if not k.startswith("_")}) for p in patches]
+    return json.dumps(jsonable_encoder(models), ensure_ascii=False).encode("utf-8")
+
+
+def after(patches: list[PendingPatch]) -> bytes:
+    return encoding.join_array(patch.to_response_json() for patch in patches)
+
+
+def measure(func, patches: list[PendingPatch], repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(patches)
+    return (time.perf_counter() - start) / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="patch listing serialization benchmark")
+    parser.add_argument("--count", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    patches = build_patches(args.count)
+    assert json.loads(before(patches)) == json.loads(after(patches))
+
+    before_s = measure(before, patches, args.repeat)
+    after(patches)  # キャッシュを温める
+    after_s = measure(after, patches, args.repeat)
+    print(f"patches={args.count} encoder={'orjson' if encoding.orjson else 'json'}")
+    print(f"before: {before_s * 1000:8.2f} ms/request")
+    print(f"after : {after_s * 1000:8.2f} ms/request ({before_s / after_s:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,20 +7,62 @@ import sys
 from pathlib import Path
 
 ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / "agent" / "src"))
+
+from agent.runtime.workspace_snapshot import touched_paths  # noqa: E402
+from agent.staging.gate import ImpactGate  # noqa: E402
+
 
 def run_tests() -> int:
     result = subprocess.run([sys.executable, "-m", "pytest"], cwd=ROOT / "agent")
     return result.returncode
 
 
+def diff_paths(diff: Path) -> list[Path]:
+    """unified diff が触るファイル (リポジトリルート相対) を返す。"""
+    return sorted(ROOT / path for path in touched_paths(diff))
+
+
+def run_gate(args: argparse.Namespace) -> int:
+    changed = None
+    if args.diff:
+        changed = diff_paths(args.diff)
+    elif args.changed:
+        changed = [Path(path) for path in args.changed]
+    gate = ImpactGate(ROOT / "agent", jobs=args.jobs)
+    report = gate.run(changed=changed, full=args.full, use_cache=not args.no_cache, lint=not args.no_lint)
+
+    print(f"changed files: {len(report.changed)}" + (" (full run)" if report.full_run else ""))
+    if report.fallback:
+        print(f"full run fallback: {report.fallback}")
+    for error in report.compile_errors:
+        print(f"[compile] {error}")
+    if report.lint_ok is False:
+        print("[ruff] failed")
+    for outcome in report.outcomes:
+        mark = "cached" if outcome.cached else ("ok" if outcome.ok else "FAILED")
+        print(f"  {mark:>6} {outcome.duration:6.2f}s {outcome.path}")
+        if outcome.output:
+            print(outcome.output)
+    print(f"ran {len(report.selected)} / {len(report.outcomes)} test files: {'PASS' if report.ok else 'FAIL'}")
+    return 0 if report.ok else 1
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="Yamada6 agent 管理ツール")
     sub = parser.add_subparsers(dest="command")
-    sub.add_parser("test", help="pytest を実行")
+    test = sub.add_parser("test", help="変更の影響を受けるテストだけを並列実行 (結果はキャッシュ)")
+    test.add_argument("--diff", type=Path, help="このパッチが触るファイルに依存するテストだけを対象にする")
+    test.add_argument("--changed", nargs="+", help="変更ファイルを明示する (省略時は前回の成功時との差分)")
+    test.add_argument("--full", action="store_true", help="キャッシュを無視して全テストファイルを実行")
+    test.add_argument("--no-cache", action="store_true", help="キャッシュを読まずに判定する")
+    test.add_argument("--no-lint", action="store_true", help="ruff を実行しない")
+    test.add_argument("--jobs", type=int, default=None, help="並列数 (既定: CPU コア数)")
+    test.add_argument("--serial", action="store_true", help="従来通り pytest を 1 プロセスで全件実行")
     args = parser.parse_args()
 
     if args.command == "test":
-        raise SystemExit(run_tests())
+        raise SystemExit(run_tests() if args.serial else run_gate(args))
 
     parser.print_help()
 
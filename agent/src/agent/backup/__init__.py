@@ -0,0 +1 @@
+"""Docker 不要の重複排除スナップショット (backup / restore)."""
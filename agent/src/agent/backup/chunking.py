@@ -0,0 +1,114 @@
+"""Content-defined chunking (FastCDC 方式の gear ハッシュ)。
+
+ファイルの一部が変わっても境界がずれにくく、変更箇所周辺のチャンクだけが
+新しくなる。
+
+gear ハッシュは 32bit で 1 バイトごとに左シフトするため、ある位置のハッシュは直前
+`WINDOW` バイトだけで決まる。この性質を使い、numpy が入っていれば区間全体の
+ハッシュを配列演算でまとめて求める。無ければ同じ境界を返す逐次計算にフォールバックする。
+"""
+
+from __future__ import annotations
+
+import random
+from typing import BinaryIO, Iterator
+
+try:  # pragma: no cover - optional dependency
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None  # type: ignore[assignment]
+
+MIN_SIZE = 16 * 1024
+AVG_SIZE = 64 * 1024
+MAX_SIZE = 256 * 1024
+WINDOW = 32
+_READ_SIZE = 4 * MAX_SIZE
+_NP_BLOCK = 16 * 1024
+
+# 平均サイズより前は厳しく、後は緩いマスクで境界を判定する (normalized chunking)
+_MASK_STRICT = (1 << 18) - 1
+_MASK_LOOSE = (1 << 14) - 1
+_rng = random.Random(0x59A3ADA6)
+_GEAR = tuple(_rng.getrandbits(32) for _ in range(256))
+del _rng
+_GEAR_ARRAY = None if np is None else np.array(_GEAR, dtype=np.uint32)
+
+
+def _first_match_py(data: bytes, begin: int, stop: int, mask: int) -> int:
+    """`begin <= i < stop` で窓ハッシュが `mask` に一致する最初の位置。無ければ -1。"""
+    gear = _GEAR
+    h = 0
+    # 直前 WINDOW - 1 バイトで窓を満たしてから判定を始める
+    for i in range(begin - WINDOW + 1, begin):
+        h = ((h << 1) + gear[data[i]]) & 0xFFFFFFFF
+    for i in range(begin, stop):
+        h = ((h << 1) + gear[data[i]]) & 0xFFFFFFFF
+        if not h & mask:
+            return i
+    return -1
+
+
+def _first_match_np(data: bytes, begin: int, stop: int, mask: int) -> int:
+    # 境界は多くの場合区間の前半で見つかるため、ブロックごとに計算して打ち切る
+    for block in range(begin, stop, _NP_BLOCK):
+        found = _first_match_block(data, block, min(stop, block + _NP_BLOCK), mask)
+        if found >= 0:
+            return found
+    return -1
+
+
+def _first_match_block(data: bytes, begin: int, stop: int, mask: int) -> int:
+    lo = begin - WINDOW + 1
+    hashes = _GEAR_ARRAY[np.frombuffer(data, dtype=np.uint8, count=stop - lo, offset=lo)]
+    # 位置 i のハッシュ = Σ_{k<WINDOW} gear[data[i - k]] << k (mod 2^32)。
+    # 幅 m の部分和 2 つから幅 2m の部分和を作り、log2(WINDOW) 回の配列演算で求める
+    width = 1
+    while width < WINDOW:
+        hashes = (hashes[:-width] << np.uint32(width)) + hashes[width:]
+        width *= 2
+    hits = np.flatnonzero((hashes & np.uint32(mask)) == 0)
+    return begin + int(hits[0]) if hits.size else -1
+
+
+_first_match = _first_match_py if np is None else _first_match_np
+
+
+def _cut_point(data: bytes, start: int, final: bool) -> int:
+    """`data[start:]` の最初のチャンク境界 (絶対位置) を返す。決められなければ -1。"""
+    remaining = len(data) - start
+    if remaining <= MIN_SIZE:
+        return len(data) if final else -1
+    end = start + min(remaining, MAX_SIZE)
+    normal = start + min(remaining, AVG_SIZE)
+    found = _first_match(data, start + MIN_SIZE, normal, _MASK_STRICT)
+    if found < 0:
+        found = _first_match(data, normal, end, _MASK_LOOSE)
+    if found >= 0:
+        return found + 1
+    if end - start == MAX_SIZE or final:
+        return end
+    return -1
+
+
+def iter_chunks(fp: BinaryIO, limit: int | None = None) -> Iterator[bytes]:
+    """ストリームをチャンクに分割する。`limit` を指定するとその位置までしか読まない。"""
+    buffer = b""
+    remaining = limit
+    eof = False
+    while True:
+        if not eof and len(buffer) < MAX_SIZE:
+            size = _READ_SIZE if remaining is None else min(_READ_SIZE, remaining)
+            block = fp.read(size) if size > 0 else b""
+            if remaining is not None:
+                remaining -= len(block)
+            if not block:
+                eof = True
+            buffer += block
+            continue
+        if not buffer:
+            return
+        cut = _cut_point(buffer, 0, eof)
+        if cut < 0:
+            continue
+        yield buffer[:cut]
+        buffer = buffer[cut:]
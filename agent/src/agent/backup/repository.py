@@ -0,0 +1,432 @@
+"""チャンク単位で重複排除するスナップショットリポジトリ。
+
+レイアウト::
+
+    <repo>/chunks/<sha256[:2]>/<sha256>   zlib 圧縮したチャンク
+    <repo>/snapshots/<snapshot_id>.json   ファイル一覧とチャンク列
+    <repo>/snapshots/LATEST               直前に作成したスナップショット ID
+
+スナップショット作成時は既存チャンクを再利用し、変更されたチャンクだけを書き込む。
+直前のスナップショットとサイズ・mtime (ns) が一致するファイルは読まずにチャンク列を引き継ぐ。
+稼働中に書き込まれる SQLite データベースはファイルを直接読まず、`sqlite3` のオンライン
+バックアップで得た一貫したコピーを取り込む (`-wal` / `-shm` は含めない)。
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import uuid
+import zlib
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, List, Optional, Set
+
+from agent.backup.chunking import iter_chunks
+from agent.runtime.locking import LOCK_NAME, snapshot_lock
+
+# 追記のみ (監査ログなど) または書き込み後に変更されない (アーティファクト) ファイル。
+# ロック中に確定したサイズまでをロック解放後に読み込むことで、ランタイムを長く
+# 止めずに一貫した時点を得る。
+UNLOCKED_SUFFIXES = (".log", ".jsonl", ".artifact", ".diff")
+# ログはローテーションで名前が変わるため、ロック中に開いたハンドルから読む
+LOG_SUFFIXES = (".log", ".jsonl")
+_ROTATED_LOG = re.compile(r"\.(?:log|jsonl)\.\d+$")
+DATABASE_SUFFIXES = (".sqlite3", ".sqlite", ".db")
+_DATABASE_SIDECARS = ("-wal", "-shm", "-journal")
+# mtime の粒度の範囲内で親スナップショットと競合した可能性のあるファイルは読み直す
+_RACY_SECONDS = 2.0
+
+
+class SnapshotError(RuntimeError):
+    """スナップショットの読み書き・検証に失敗した。"""
+
+
+@dataclass(slots=True)
+class FileEntry:
+    path: str
+    size: int
+    mode: int
+    mtime: float
+    sha256: str
+    chunks: List[str] = field(default_factory=list)
+    mtime_ns: int = 0
+
+
+@dataclass(slots=True)
+class Snapshot:
+    snapshot_id: str
+    created_at: str
+    sources: Dict[str, str]
+    files: List[FileEntry]
+    new_chunks: int = 0
+    new_bytes: int = 0
+    parent: Optional[str] = None
+    reused_files: int = 0
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Snapshot":
+        files = [FileEntry(**item) for item in data.pop("files")]
+        return cls(files=files, **data)
+
+
+@dataclass(slots=True)
+class VerifyReport:
+    snapshot_id: str
+    checked_chunks: int
+    problems: List[str]
+
+    @property
+    def ok(self) -> bool:
+        return not self.problems
+
+
+class Repository:
+    def __init__(self, root: Path) -> None:
+        self._root = root
+        self._chunks = root / "chunks"
+        self._snapshots = root / "snapshots"
+
+    def init(self) -> None:
+        self._chunks.mkdir(parents=True, exist_ok=True)
+        self._snapshots.mkdir(parents=True, exist_ok=True)
+
+    def _chunk_path(self, digest: str) -> Path:
+        return self._chunks / digest[:2] / digest
+
+    def _put_chunk(self, data: bytes) -> tuple[str, bool]:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._chunk_path(digest)
+        if path.exists():
+            return digest, False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_bytes(zlib.compress(data, 6))
+        tmp.replace(path)
+        return digest, True
+
+    def _get_chunk(self, digest: str) -> bytes:
+        try:
+            data = zlib.decompress(self._chunk_path(digest).read_bytes())
+        except (OSError, zlib.error) as exc:
+            raise SnapshotError(f"Unreadable chunk {digest}: {exc}") from exc
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise SnapshotError(f"Corrupted chunk {digest}")
+        return data
+
+    # --- create -------------------------------------------------------------
+
+    def create(self, sources: Dict[str, Path], snapshot_id: Optional[str] = None) -> Snapshot:
+        """`{名前: ディレクトリ}` のスナップショットを作成する。
+
+        各ソースは `.snapshot.lock` を取得している間にファイル一覧とサイズを確定し、
+        変更され得るファイルは作業領域へコピーするだけにとどめる。チャンク分割はロック
+        解放後にそのコピーから行い、`UNLOCKED_SUFFIXES` のファイルは確定したサイズまでを取り込む。
+        """
+        self.init()
+        now = dt.datetime.now(dt.timezone.utc)
+        snapshot = Snapshot(
+            snapshot_id=snapshot_id or now.strftime("%Y%m%dT%H%M%S%fZ"),
+            created_at=now.isoformat(),
+            sources={name: str(path) for name, path in sources.items()},
+            files=[],
+        )
+        parent = self._latest()
+        if parent is not None:
+            snapshot.parent = parent.snapshot_id
+        for name, root in sources.items():
+            if not root.exists():
+                continue
+            previous = _reusable_entries(parent, name, root)
+            handles: Dict[Path, BinaryIO] = {}
+            copies: List[Path] = []
+            try:
+                with snapshot_lock(root):
+                    listing = [(path, path.stat()) for path in sorted(_walk(root))]
+                    databases = [(p, st) for p, st in listing if p.name.endswith(DATABASE_SUFFIXES)]
+                    stable = [(p, st) for p, st in listing if _is_stable(p.name)]
+                    mutable = []
+                    for path, stat in listing:
+                        if _is_stable(path.name) or path.name.endswith(DATABASE_SUFFIXES):
+                            continue
+                        if _reused_entry(previous, f"{name}/{path.relative_to(root).as_posix()}", stat) is None:
+                            copy = self._scratch() / uuid.uuid4().hex
+                            try:
+                                shutil.copyfile(path, copy)
+                            except FileNotFoundError:
+                                continue
+                            copies.append(copy)
+                            handles[path] = copy.open("rb")
+                        mutable.append((path, stat))
+                    for path, _ in stable:
+                        if path.name.endswith(LOG_SUFFIXES) or _ROTATED_LOG.search(path.name):
+                            try:
+                                handles[path] = path.open("rb")
+                            except FileNotFoundError:
+                                continue
+                self._store_files(snapshot, name, root, mutable, previous, handles)
+                self._store_files(snapshot, name, root, stable, previous, handles)
+            finally:
+                for handle in handles.values():
+                    handle.close()
+                for copy in copies:
+                    copy.unlink(missing_ok=True)
+            self._store_databases(snapshot, name, root, databases)
+
+        path = self._snapshots / f"{snapshot.snapshot_id}.json"
+        if path.exists():
+            raise SnapshotError(f"Snapshot already exists: {snapshot.snapshot_id}")
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(asdict(snapshot), ensure_ascii=False), encoding="utf-8")
+        tmp.replace(path)
+        latest = self._snapshots / "LATEST"
+        latest.with_name("LATEST.tmp").write_text(snapshot.snapshot_id, encoding="utf-8")
+        latest.with_name("LATEST.tmp").replace(latest)
+        return snapshot
+
+    def _latest(self) -> Optional[Snapshot]:
+        try:
+            return self.load((self._snapshots / "LATEST").read_text(encoding="utf-8").strip())
+        except (OSError, SnapshotError, ValueError):
+            return None
+
+    def _scratch(self) -> Path:
+        scratch = self._root / "tmp"
+        scratch.mkdir(parents=True, exist_ok=True)
+        return scratch
+
+    def _store_databases(self, snapshot: Snapshot, name: str, root: Path, files: Iterable) -> None:
+        """SQLite のオンラインバックアップで一貫したコピーを作り、それを取り込む。"""
+        scratch = self._scratch()
+        for path, stat in files:
+            copy = scratch / f"{uuid.uuid4().hex}.sqlite3"
+            try:
+                source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+                try:
+                    target = sqlite3.connect(str(copy))
+                    try:
+                        source.backup(target)
+                    finally:
+                        target.close()
+                finally:
+                    source.close()
+            except sqlite3.Error:
+                # SQLite ではない同名ファイルは通常のファイルとして扱う
+                copy.unlink(missing_ok=True)
+                self._store_files(snapshot, name, root, [(path, stat)], {})
+                continue
+            try:
+                entry = self._new_entry(f"{name}/{path.relative_to(root).as_posix()}", stat)
+                with copy.open("rb") as fp:
+                    self._store_stream(snapshot, entry, fp, None)
+                snapshot.files.append(entry)
+            finally:
+                copy.unlink(missing_ok=True)
+
+    @staticmethod
+    def _new_entry(relative: str, stat: os.stat_result) -> FileEntry:
+        return FileEntry(
+            path=relative,
+            size=0,
+            mode=stat.st_mode & 0o777,
+            mtime=stat.st_mtime,
+            sha256="",
+            mtime_ns=stat.st_mtime_ns,
+        )
+
+    def _store_stream(self, snapshot: Snapshot, entry: FileEntry, fp: BinaryIO, limit: Optional[int]) -> None:
+        digest = hashlib.sha256()
+        for chunk in iter_chunks(fp, limit=limit):
+            chunk_digest, created = self._put_chunk(chunk)
+            entry.chunks.append(chunk_digest)
+            entry.size += len(chunk)
+            digest.update(chunk)
+            if created:
+                snapshot.new_chunks += 1
+                snapshot.new_bytes += len(chunk)
+        entry.sha256 = digest.hexdigest()
+
+    def _store_files(
+        self,
+        snapshot: Snapshot,
+        name: str,
+        root: Path,
+        files: Iterable,
+        previous: Dict[str, FileEntry],
+        handles: Optional[Dict[Path, BinaryIO]] = None,
+    ) -> None:
+        for path, stat in files:
+            relative = f"{name}/{path.relative_to(root).as_posix()}"
+            reused = _reused_entry(previous, relative, stat)
+            if reused is not None:
+                snapshot.files.append(
+                    FileEntry(
+                        path=relative,
+                        size=reused.size,
+                        mode=stat.st_mode & 0o777,
+                        mtime=stat.st_mtime,
+                        sha256=reused.sha256,
+                        chunks=list(reused.chunks),
+                        mtime_ns=stat.st_mtime_ns,
+                    )
+                )
+                snapshot.reused_files += 1
+                continue
+            entry = self._new_entry(relative, stat)
+            handle = (handles or {}).get(path)
+            try:
+                if handle is not None:
+                    self._store_stream(snapshot, entry, handle, stat.st_size)
+                else:
+                    with path.open("rb") as fp:
+                        self._store_stream(snapshot, entry, fp, stat.st_size)
+            except FileNotFoundError:
+                # 一覧取得後に削除されたファイルは含めない
+                continue
+            snapshot.files.append(entry)
+
+    # --- read ---------------------------------------------------------------
+
+    def list(self) -> List[str]:
+        if not self._snapshots.exists():
+            return []
+        return sorted(path.stem for path in self._snapshots.glob("*.json"))
+
+    def load(self, snapshot_id: str) -> Snapshot:
+        path = self._snapshots / f"{snapshot_id}.json"
+        if not path.exists():
+            raise SnapshotError(f"Unknown snapshot: {snapshot_id}")
+        return Snapshot.from_dict(json.loads(path.read_text(encoding="utf-8")))
+
+    def verify(self, snapshot_id: str) -> VerifyReport:
+        snapshot = self.load(snapshot_id)
+        problems: List[str] = []
+        checked: Dict[str, bool] = {}
+        for entry in snapshot.files:
+            digest = hashlib.sha256()
+            size = 0
+            for chunk_digest in entry.chunks:
+                try:
+                    data = self._get_chunk(chunk_digest)
+                except SnapshotError as exc:
+                    problems.append(f"{entry.path}: {exc}")
+                    checked[chunk_digest] = False
+                    break
+                checked[chunk_digest] = True
+                digest.update(data)
+                size += len(data)
+            else:
+                if size != entry.size or digest.hexdigest() != entry.sha256:
+                    problems.append(f"{entry.path}: content hash mismatch")
+        return VerifyReport(snapshot_id=snapshot_id, checked_chunks=len(checked), problems=problems)
+
+    # --- restore ------------------------------------------------------------
+
+    def restore(self, snapshot_id: str, target: Path, lock: bool = False) -> Dict[str, int]:
+        """`target/<source名>/...` に復元する。
+
+        既に同じ内容のファイルは書き換えない。スナップショットに無いファイル (古い
+        `-wal` など) は各ソースの下から削除し、復元後の内容をスナップショットと一致させる。
+        `lock=True` なら復元中は各ソースの `.snapshot.lock` を保持し、ランタイムの書き込みと
+        競合しないようにする。
+        """
+        snapshot = self.load(snapshot_id)
+        stats = {"restored": 0, "unchanged": 0, "removed": 0}
+        by_source: Dict[str, List[FileEntry]] = {name: [] for name in snapshot.sources}
+        for entry in snapshot.files:
+            by_source.setdefault(entry.path.split("/", 1)[0], []).append(entry)
+        for name, entries in by_source.items():
+            source_root = target / name
+            source_root.mkdir(parents=True, exist_ok=True)
+            with snapshot_lock(source_root) if lock else nullcontext():
+                for entry in entries:
+                    destination = target / entry.path
+                    if _same_content(destination, entry):
+                        stats["unchanged"] += 1
+                        continue
+                    destination.parent.mkdir(parents=True, exist_ok=True)
+                    tmp = destination.with_name(destination.name + ".restore-tmp")
+                    with tmp.open("wb") as fp:
+                        for chunk_digest in entry.chunks:
+                            fp.write(self._get_chunk(chunk_digest))
+                    os.chmod(tmp, entry.mode)
+                    tmp.replace(destination)
+                    os.utime(destination, (entry.mtime, entry.mtime))
+                    stats["restored"] += 1
+                stats["removed"] += _remove_extra_files(source_root, {target / entry.path for entry in entries})
+        return stats
+
+
+def _reusable_entries(parent: Optional[Snapshot], name: str, root: Path) -> Dict[str, FileEntry]:
+    """親スナップショットのうち、サイズ・mtime が一致すれば読み直さなくてよいエントリ。
+
+    親の作成時刻に近い mtime のファイルは、同じ mtime のまま書き換えられた可能性が
+    あるため対象外にする (racy なエントリ)。
+    """
+    if parent is None or parent.sources.get(name) != str(root):
+        return {}
+    cutoff_ns = int((dt.datetime.fromisoformat(parent.created_at).timestamp() - _RACY_SECONDS) * 1e9)
+    prefix = f"{name}/"
+    return {
+        entry.path: entry
+        for entry in parent.files
+        if entry.path.startswith(prefix) and 0 < entry.mtime_ns < cutoff_ns
+    }
+
+
+def _reused_entry(previous: Dict[str, FileEntry], relative: str, stat: os.stat_result) -> Optional[FileEntry]:
+    reused = previous.get(relative)
+    if reused is not None and reused.size == stat.st_size and reused.mtime_ns == stat.st_mtime_ns:
+        return reused
+    return None
+
+
+def _is_stable(name: str) -> bool:
+    return name.endswith(UNLOCKED_SUFFIXES) or _ROTATED_LOG.search(name) is not None
+
+
+def _walk(root: Path) -> Iterable[Path]:
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith((".tmp", ".part", ".part.meta")) or filename == LOCK_NAME:
+                continue
+            if filename.endswith(_DATABASE_SIDECARS):
+                # WAL などはオンラインバックアップ側に反映される
+                continue
+            yield Path(dirpath) / filename
+
+
+def _remove_extra_files(root: Path, keep: Set[Path]) -> int:
+    """`keep` 以外のファイルと空になったディレクトリを `root` の下から削除する。"""
+    removed = 0
+    for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+        directory = Path(dirpath)
+        for filename in filenames:
+            path = directory / filename
+            if filename == LOCK_NAME or path in keep:
+                continue
+            path.unlink(missing_ok=True)
+            removed += 1
+        if directory != root and not any(directory.iterdir()):
+            directory.rmdir()
+    return removed
+
+
+def _same_content(path: Path, entry: FileEntry) -> bool:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return False
+    if stat.st_size != entry.size:
+        return False
+    digest = hashlib.sha256()
+    with path.open("rb") as fp:
+        for block in iter(lambda: fp.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest() == entry.sha256
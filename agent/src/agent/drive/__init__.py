@@ -0,0 +1 @@
+"""Drive sidecar package."""
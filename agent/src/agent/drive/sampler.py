@@ -0,0 +1,280 @@
+"""ドライブサイドカーのリソースサンプラー。
+
+`/proc` と `/sys/class/power_supply` を一定間隔で読み、固定長の配列リングバッファに
+蓄積する。ランタイムはここから得た「安全余裕 (safety margin)」だけを参照して
+ループやパッチ適用を抑制する。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+import time
+from array import array
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+COLUMNS = (
+    "timestamp",
+    "cpu_busy",
+    "mem_available",
+    "load_per_cpu",
+    "net_bytes_per_second",
+    "battery",
+    "on_ac",
+    "sample_cost",
+)
+
+
+class RingBuffer:
+    """列ごとに `array('d')` を持つ固定長リングバッファ。"""
+
+    def __init__(self, capacity: int, columns: Tuple[str, ...] = COLUMNS) -> None:
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self._capacity = capacity
+        self._columns = {name: array("d", [math.nan]) * capacity for name in columns}
+        self._next = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def append(self, row: Dict[str, float]) -> None:
+        for name, column in self._columns.items():
+            column[self._next] = row.get(name, math.nan)
+        self._next = (self._next + 1) % self._capacity
+        self._count = min(self._count + 1, self._capacity)
+
+    def _index(self, age: int) -> int:
+        return (self._next - 1 - age) % self._capacity
+
+    def latest(self, count: int = 1) -> List[Dict[str, float]]:
+        """新しい順に最大 `count` 件を返す。"""
+        rows = []
+        for age in range(min(count, self._count)):
+            index = self._index(age)
+            rows.append({name: column[index] for name, column in self._columns.items()})
+        return rows
+
+    def column_mean(self, name: str, count: int) -> float:
+        column = self._columns[name]
+        values = [column[self._index(age)] for age in range(min(count, self._count))]
+        values = [value for value in values if not math.isnan(value)]
+        return sum(values) / len(values) if values else math.nan
+
+
+@dataclass(slots=True)
+class SamplerConfig:
+    interval_seconds: float = 1.0
+    capacity: int = 3600
+    max_overhead_ratio: float = 0.005
+    max_interval_seconds: float = 30.0
+    smoothing_samples: int = 3
+    # この件数のサンプルすべてで余裕が無いときだけ安全余裕を下げる (一瞬の負荷は無視する)
+    pressure_samples: int = 30
+
+
+class ProcReader:
+    """`/proc` と `/sys` から 1 サンプル分の値を読む。"""
+
+    def __init__(self, proc_root: Path = Path("/proc"), sys_root: Path = Path("/sys")) -> None:
+        self._proc = proc_root
+        self._power_supply = sys_root / "class" / "power_supply"
+        self._prev_cpu: Optional[Tuple[int, int]] = None
+        self._prev_net: Optional[Tuple[float, int]] = None
+        self._cpu_count = os.cpu_count() or 1
+
+    @property
+    def available(self) -> bool:
+        return (self._proc / "stat").exists()
+
+    def read(self, now: float) -> Dict[str, float]:
+        row = {"timestamp": now}
+        row["cpu_busy"] = self._cpu_busy()
+        row["mem_available"] = self._mem_available()
+        row["load_per_cpu"] = self._load_per_cpu()
+        row["net_bytes_per_second"] = self._net_rate(now)
+        row["battery"], row["on_ac"] = self._power()
+        return row
+
+    def _cpu_busy(self) -> float:
+        try:
+            fields = (self._proc / "stat").read_text().split("\n", 1)[0].split()[1:]
+        except OSError:
+            return math.nan
+        values = [int(value) for value in fields]
+        idle = values[3] + (values[4] if len(values) > 4 else 0)
+        total = sum(values[:8])
+        previous, self._prev_cpu = self._prev_cpu, (idle, total)
+        if previous is None or total <= previous[1]:
+            return math.nan
+        return 1.0 - (idle - previous[0]) / (total - previous[1])
+
+    def _mem_available(self) -> float:
+        info: Dict[str, int] = {}
+        try:
+            with (self._proc / "meminfo").open() as fp:
+                for line in fp:
+                    key, _, rest = line.partition(":")
+                    if key in ("MemTotal", "MemAvailable"):
+                        info[key] = int(rest.split()[0])
+                        if len(info) == 2:
+                            break
+        except OSError:
+            return math.nan
+        if not info.get("MemTotal") or "MemAvailable" not in info:
+            return math.nan
+        return info["MemAvailable"] / info["MemTotal"]
+
+    def _load_per_cpu(self) -> float:
+        try:
+            load1 = float((self._proc / "loadavg").read_text().split()[0])
+        except (OSError, ValueError, IndexError):
+            return math.nan
+        return load1 / self._cpu_count
+
+    def _net_rate(self, now: float) -> float:
+        total = 0
+        try:
+            with (self._proc / "net" / "dev").open() as fp:
+                for line in fp:
+                    name, sep, rest = line.partition(":")
+                    if not sep or name.strip() == "lo":
+                        continue
+                    fields = rest.split()
+                    total += int(fields[0]) + int(fields[8])
+        except (OSError, ValueError, IndexError):
+            return math.nan
+        previous, self._prev_net = self._prev_net, (now, total)
+        if previous is None or now <= previous[0]:
+            return math.nan
+        return max(0, total - previous[1]) / (now - previous[0])
+
+    def _power(self) -> Tuple[float, float]:
+        battery, on_ac = math.nan, math.nan
+        if not self._power_supply.exists():
+            return battery, on_ac
+        for supply in self._power_supply.iterdir():
+            try:
+                kind = (supply / "type").read_text().strip()
+                if kind == "Battery":
+                    battery = float((supply / "capacity").read_text()) / 100
+                elif kind == "Mains":
+                    on_ac = float((supply / "online").read_text())
+            except (OSError, ValueError):
+                continue
+        return battery, on_ac
+
+
+def safety_margin(row: Dict[str, float]) -> float:
+    """0 (余裕なし) 〜 1 (十分) の安全余裕。取得できない指標は無視する。"""
+    margins = []
+    if not math.isnan(row.get("cpu_busy", math.nan)):
+        margins.append(1.0 - row["cpu_busy"])
+    if not math.isnan(row.get("mem_available", math.nan)):
+        margins.append(row["mem_available"])
+    if not math.isnan(row.get("load_per_cpu", math.nan)):
+        margins.append(1.0 - row["load_per_cpu"])
+    battery = row.get("battery", math.nan)
+    if not math.isnan(battery) and row.get("on_ac") != 1.0:
+        margins.append(battery)
+    if not margins:
+        return 1.0
+    return max(0.0, min(1.0, min(margins)))
+
+
+class ResourceSampler:
+    """一定間隔でサンプルを取り、安全余裕と自身のオーバーヘッドを公開する。
+
+    1 サンプルあたりの処理時間が間隔の `max_overhead_ratio` を超える場合は、
+    間隔を `max_interval_seconds` まで広げて負荷を抑え、十分に下回れば設定値まで戻す。
+    """
+
+    def __init__(self, config: SamplerConfig, reader: Optional[ProcReader] = None) -> None:
+        self._config = config
+        self._reader = reader or ProcReader()
+        self._buffer = RingBuffer(config.capacity)
+        self._interval = config.interval_seconds
+        self._running = False
+
+    @property
+    def buffer(self) -> RingBuffer:
+        return self._buffer
+
+    @property
+    def interval_seconds(self) -> float:
+        return self._interval
+
+    def sample(self) -> Dict[str, float]:
+        started = time.perf_counter()
+        row = self._reader.read(time.time())
+        row["sample_cost"] = time.perf_counter() - started
+        self._buffer.append(row)
+        self._adjust_interval()
+        return row
+
+    def _adjust_interval(self) -> None:
+        ratio = self.overhead_ratio()
+        budget = self._config.max_overhead_ratio
+        if math.isnan(ratio):
+            return
+        if ratio > budget:
+            widened = min(self._config.max_interval_seconds, self._interval * 2)
+            if widened != self._interval:
+                logger.warning("Sampler overhead {:.4f} over budget, interval -> {}s", ratio, widened)
+                self._interval = widened
+        elif ratio <= budget / 4 and self._interval > self._config.interval_seconds:
+            # 半分に戻しても比率は予算の半分以下なので、広げる・戻すを繰り返さない
+            narrowed = max(self._config.interval_seconds, self._interval / 2)
+            logger.info("Sampler overhead {:.4f} back under budget, interval -> {}s", ratio, narrowed)
+            self._interval = narrowed
+
+    def overhead_ratio(self) -> float:
+        """直近サンプルの平均処理時間 / サンプル間隔。"""
+        cost = self._buffer.column_mean("sample_cost", self._config.smoothing_samples * 10)
+        return cost / self._interval if self._interval > 0 else math.nan
+
+    def margin(self) -> float:
+        """直近 `pressure_samples` 件のうち最も余裕のあった値。持続的な逼迫だけを反映する。"""
+        rows = self._buffer.latest(self._config.pressure_samples)
+        if not rows:
+            return 1.0
+        return max(safety_margin(row) for row in rows)
+
+    def status(self) -> dict:
+        latest = self._buffer.latest(1)
+        return {
+            "safety_margin": round(self.margin(), 4),
+            "interval_seconds": self._interval,
+            "overhead_ratio": _finite(self.overhead_ratio()),
+            "samples": len(self._buffer),
+            "latest": {name: _finite(value) for name, value in latest[0].items()} if latest else None,
+        }
+
+    def recent(self, count: int) -> List[Dict[str, Optional[float]]]:
+        return [{name: _finite(value) for name, value in row.items()} for row in self._buffer.latest(count)]
+
+    async def run_forever(self) -> None:
+        if not self._reader.available:
+            logger.info("Resource sampler disabled: /proc not available")
+            return
+        self._running = True
+        while self._running:
+            self.sample()
+            await asyncio.sleep(self._interval)
+
+    def stop(self) -> None:
+        self._running = False
+
+
+def _finite(value: float) -> Optional[float]:
+    return None if math.isnan(value) else value
@@ -23,6 +23,7 @@ class Executor:
     """プランに基づいてアクションを行う最小実装。"""
 
     async def execute(self, plan: Plan) -> ExecutionResult:
-        logger.info("Executing plan: {}", plan.summary)
+        # 毎イテレーション呼ばれるため出力は間引く
+        logger.bind(sample="executor.execute").info("Executing plan: {}", plan.summary)
         now = dt.datetime.utcnow()
         return ExecutionResult(completed_at=now, status="noop", detail="まだ実処理は未実装")
@@ -7,19 +7,34 @@ import datetime as dt
 import json
 import os
 import shutil
+import threading
+import time
 from contextlib import asynccontextmanager
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, field, fields
 from pathlib import Path
-from typing import AsyncIterator, Dict, List, Mapping, Optional
-from urllib.parse import urlparse
+from typing import AsyncIterator, BinaryIO, Dict, List, Mapping, Optional, Set, Tuple
 
 from loguru import logger
 
+from agent.drive.sampler import ResourceSampler, SamplerConfig
 from agent.executor import Executor
 from agent.executor import ExecutionResult
 from agent.planner import Plan, Planner
 from agent.scheduler import ScheduledTask, Scheduler
-from agent.runtime.patch_executor import ApplyResult, PatchExecutor, RollbackResult
+from agent.runtime import encoding, handoff
+from agent.runtime.handoff import ReloadInProgressError, ReloadUnavailableError
+from agent.runtime.apply_cache import ApplyCache
+from agent.runtime.artifacts import ArtifactStore, FetchedArtifact, default_artifact_store
+from agent.runtime.bundle import extract_diff
+from agent.runtime.history import HistoryConfig, HistoryStore
+from agent.runtime.locking import snapshot_lock
+from agent.runtime.patch_executor import ApplyResult, PatchExecutor, ResourcePressureError, RollbackResult
+from agent.runtime.patch_index import PatchIndex, PatchPage, PatchQuery
+from agent.runtime.state_store import StateStore
+
+# 共有ストア上のパッチ一覧 (要素ごとの行を持つ集合) の名前
+PENDING_COLLECTION = "patches"
+APPLIED_COLLECTION = "applied"
 
 
 @dataclass(slots=True)
@@ -31,17 +46,93 @@ class RuntimeConfig:
 
     loop_interval_seconds: float = 10.0
     patch_storage_dir: Path = Path("state/patches")
+    state_store_path: Optional[Path] = None
+    state_max_staleness_seconds: float = 30.0
+    artifact_fetch_retries: int = 3
+    artifact_fetch_timeout_seconds: float = 30.0
+    sampler_interval_seconds: float = 1.0
+    sampler_capacity: int = 3600
+    throttle_margin: float = 0.0
+    apply_cache_max_entries: int = 256
+    apply_cache_ttl_seconds: float = 7 * 24 * 3600
+    apply_cache_failures: bool = False
+    reload_on_apply: bool = False
+    history_dir: Optional[Path] = None
+    history_capacity: int = 8640
+    history_max_disk_bytes: int = 64 * 1024 * 1024
+    log_path: Optional[Path] = None
+    log_max_bytes: int = 10 * 1024 * 1024
+    log_backups: int = 5
+    log_sample_per_second: float = 1.0
+    log_queue_size: int = 10000
+    log_level: str = "INFO"
+    log_console: bool = True
 
     @classmethod
     def from_env(cls, env: Mapping[str, str]) -> "RuntimeConfig":
-        try:
-            interval = float(env.get("YAMADA_LOOP_INTERVAL", 10))
-        except ValueError:
-            interval = 10.0
         patch_dir = Path(env.get("PATCH_STORAGE_DIR", "state/patches")).expanduser()
         if not patch_dir.is_absolute():
             patch_dir = Path.cwd() / patch_dir
-        return cls(loop_interval_seconds=interval, patch_storage_dir=patch_dir)
+        history_dir: Optional[Path] = None
+        if env.get("YAMADA_HISTORY_DIR"):
+            history_dir = Path(env["YAMADA_HISTORY_DIR"]).expanduser()
+            if not history_dir.is_absolute():
+                history_dir = Path.cwd() / history_dir
+        # 既定は YAMADA_LOG_DIR (scripts/backup.py と共通、Docker では logs ボリューム) 配下、"-" でファイル出力なし
+        log_dir = Path(env.get("YAMADA_LOG_DIR", "logs")).expanduser()
+        if not log_dir.is_absolute():
+            log_dir = Path.cwd() / log_dir
+        log_path: Optional[Path] = log_dir / "runtime.jsonl"
+        if env.get("YAMADA_LOG_FILE") == "-":
+            log_path = None
+        elif env.get("YAMADA_LOG_FILE"):
+            log_path = Path(env["YAMADA_LOG_FILE"]).expanduser()
+            if not log_path.is_absolute():
+                log_path = Path.cwd() / log_path
+        store_path: Optional[Path] = None
+        if env.get("YAMADA_STATE_STORE"):
+            store_path = Path(env["YAMADA_STATE_STORE"]).expanduser()
+            if not store_path.is_absolute():
+                store_path = Path.cwd() / store_path
+        return cls(
+            loop_interval_seconds=_env_float(env, "YAMADA_LOOP_INTERVAL", 10.0),
+            patch_storage_dir=patch_dir,
+            state_store_path=store_path,
+            state_max_staleness_seconds=_env_float(env, "YAMADA_STATE_MAX_STALENESS", 30.0),
+            artifact_fetch_retries=_env_int(env, "ARTIFACT_FETCH_RETRIES", 3),
+            artifact_fetch_timeout_seconds=_env_float(env, "ARTIFACT_FETCH_TIMEOUT", 30.0),
+            sampler_interval_seconds=_env_float(env, "YAMADA_SAMPLER_INTERVAL", 1.0),
+            sampler_capacity=_env_int(env, "YAMADA_SAMPLER_CAPACITY", 3600),
+            throttle_margin=_env_float(env, "YAMADA_THROTTLE_MARGIN", 0.0),
+            apply_cache_max_entries=_env_int(env, "YAMADA_APPLY_CACHE_MAX_ENTRIES", 256),
+            apply_cache_ttl_seconds=_env_float(env, "YAMADA_APPLY_CACHE_TTL", 7 * 24 * 3600),
+            apply_cache_failures=env.get("YAMADA_APPLY_CACHE_FAILURES", "").lower() in ("1", "true", "yes"),
+            reload_on_apply=env.get("YAMADA_RELOAD_ON_APPLY", "").lower() in ("1", "true", "yes"),
+            history_dir=history_dir,
+            history_capacity=_env_int(env, "YAMADA_HISTORY_CAPACITY", 8640),
+            history_max_disk_bytes=_env_int(env, "YAMADA_HISTORY_MAX_BYTES", 64 * 1024 * 1024),
+            log_path=log_path,
+            log_max_bytes=_env_int(env, "YAMADA_LOG_MAX_BYTES", 10 * 1024 * 1024),
+            log_backups=_env_int(env, "YAMADA_LOG_BACKUPS", 5),
+            log_sample_per_second=_env_float(env, "YAMADA_LOG_SAMPLE_RATE", 1.0),
+            log_queue_size=_env_int(env, "YAMADA_LOG_QUEUE", 10000),
+            log_level=env.get("YAMADA_LOG_LEVEL", "INFO").upper(),
+            log_console=env.get("YAMADA_LOG_CONSOLE", "1").lower() not in ("0", "false", "no"),
+        )
+
+
+def _env_float(env: Mapping[str, str], key: str, default: float) -> float:
+    try:
+        return float(env.get(key, default))
+    except ValueError:
+        return default
+
+
+def _env_int(env: Mapping[str, str], key: str, default: int) -> int:
+    try:
+        return int(env.get(key, default))
+    except ValueError:
+        return default
 
 
 @dataclass(slots=True)
@@ -57,6 +148,115 @@ class PendingPatch:
     notes: Optional[str] = None
     artifact_local_path: Optional[str] = None
     diff_preview: Optional[str] = None
+    artifact_sha256: Optional[str] = None
+    bundle_manifest: Optional[dict] = None
+    _encoded: Optional[bytes] = field(default=None, init=False, repr=False, compare=False)
+    _encoded_response: Optional[bytes] = field(default=None, init=False, repr=False, compare=False)
+
+    def __setattr__(self, name: str, value: object) -> None:
+        object.__setattr__(self, name, value)
+        if not name.startswith("_encoded"):
+            # フィールド変更時はシリアライズ済みキャッシュを破棄する
+            object.__setattr__(self, "_encoded", None)
+            object.__setattr__(self, "_encoded_response", None)
+
+    def to_dict(self) -> dict:
+        return {f.name: getattr(self, f.name) for f in fields(self) if f.init}
+
+    def to_json(self) -> bytes:
+        """永続化用の全フィールド JSON (キャッシュ付き)。"""
+        if self._encoded is None:
+            self._encoded = encoding.dumps(self.to_dict())
+        return self._encoded
+
+    def to_response_json(self) -> bytes:
+        """API 応答用の JSON (diff_preview を除く、キャッシュ付き)。"""
+        if self._encoded_response is None:
+            payload = self.to_dict()
+            payload.pop("diff_preview")
+            self._encoded_response = encoding.dumps(payload)
+        return self._encoded_response
+
+
+def _response_dict(patch: PendingPatch) -> dict:
+    payload = patch.to_dict()
+    payload.pop("diff_preview")
+    return payload
+
+
+def read_audit_log(path: Path) -> List[dict]:
+    """JSONL 形式の監査ログを読み出す。"""
+    if not path.exists():
+        return []
+    entries: List[dict] = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        if not line.strip():
+            continue
+        try:
+            entries.append(json.loads(line))
+        except json.JSONDecodeError as exc:
+            logger.error("Invalid audit line: {}", exc)
+    return entries
+
+
+class AuditLogIndex:
+    """追記のみの監査ログについて、各行の開始位置を保持する。
+
+    ページ取得時は前回以降に追記された部分だけを走査して位置を足し、要求された
+    範囲だけを seek して読む。ファイルが置き換えられた・縮んだ場合は作り直す。
+    """
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        self._lock = threading.Lock()
+        self._offsets: List[int] = []
+        self._indexed = 0
+        self._inode: Optional[int] = None
+
+    def _refresh(self, fp: BinaryIO) -> int:
+        stat = os.fstat(fp.fileno())
+        if stat.st_ino != self._inode or stat.st_size < self._indexed:
+            self._offsets, self._indexed, self._inode = [], 0, stat.st_ino
+        fp.seek(self._indexed)
+        position = self._indexed
+        for line in fp:
+            if not line.endswith(b"\n"):
+                # 書き込み途中の行は次回に回す
+                break
+            if line.strip():
+                self._offsets.append(position)
+            position += len(line)
+        self._indexed = position
+        return position
+
+    def page(self, offset: int = 0, limit: Optional[int] = None, newest_first: bool = False) -> Tuple[List[dict], int]:
+        """監査ログの一部と総件数を返す。"""
+        try:
+            fp = self._path.open("rb")
+        except FileNotFoundError:
+            return [], 0
+        with fp, self._lock:
+            end = self._refresh(fp)
+            total = len(self._offsets)
+            count = total - offset if limit is None else min(limit, total - offset)
+            if count <= 0:
+                return [], total
+            first = total - offset - count if newest_first else offset
+            start = self._offsets[first]
+            stop = self._offsets[first + count] if first + count < total else end
+            fp.seek(start)
+            data = fp.read(stop - start)
+        entries: List[dict] = []
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError as exc:
+                logger.error("Invalid audit line: {}", exc)
+        if newest_first:
+            entries.reverse()
+        return entries, total
 
 
 class RuntimeApp:
@@ -68,49 +268,157 @@ class RuntimeApp:
         self._executor = Executor()
         self._scheduler = Scheduler()
         self._running = False
+        self._stopped = asyncio.Event()
+        # リロード依頼後は変更を受け付けず、処理中の変更が終わるのを待って状態を引き継ぐ
+        self._reloading = False
+        self._mutations = 0
+        self._mutations_idle: Optional[asyncio.Event] = None
+        self._handoff_task: Optional[asyncio.Task[None]] = None
         self._paused = False
         self._loop_count = 0
         self._last_plan: Optional[Plan] = None
         self._last_task: Optional[ScheduledTask] = None
         self._last_execution: Optional[ExecutionResult] = None
-        self._pending_patches: Dict[str, PendingPatch] = {}
+        self._pending_patches = PatchIndex()
+        self._applied_patches = PatchIndex()
         self._patch_storage_dir = self._config.patch_storage_dir
         self._patch_storage_dir.mkdir(parents=True, exist_ok=True)
         self._audit_log_path = self._patch_storage_dir / "audit.log"
+        self._audit_index = AuditLogIndex(self._audit_log_path)
+        self._history = HistoryStore(
+            self._config.history_dir or self._patch_storage_dir.parent / "history",
+            HistoryConfig(
+                capacity=max(1, self._config.history_capacity),
+                max_disk_bytes=self._config.history_max_disk_bytes,
+            ),
+        )
         workspace = Path(os.environ.get("PATCH_WORKSPACE", Path.cwd()))
-        self._patch_executor = PatchExecutor(workspace=workspace)
+        self._sampler = ResourceSampler(
+            SamplerConfig(
+                interval_seconds=self._config.sampler_interval_seconds or 1.0,
+                capacity=max(1, self._config.sampler_capacity),
+            )
+        )
+        self._throttled_iterations = 0
+        apply_cache: Optional[ApplyCache] = None
+        if self._config.apply_cache_max_entries > 0:
+            apply_cache = ApplyCache(
+                self._patch_storage_dir / "apply_cache.sqlite3",
+                max_entries=self._config.apply_cache_max_entries,
+                ttl_seconds=self._config.apply_cache_ttl_seconds,
+            )
+        self._patch_executor = PatchExecutor(
+            workspace=workspace,
+            safety_margin=self._sampler.margin,
+            min_margin=self._config.throttle_margin,
+            cache=apply_cache,
+            cache_failures=self._config.apply_cache_failures,
+        )
+        self._artifacts: ArtifactStore = default_artifact_store(
+            self._patch_storage_dir,
+            max_retries=self._config.artifact_fetch_retries,
+            timeout_seconds=self._config.artifact_fetch_timeout_seconds,
+        )
+        self._state_store: Optional[StateStore] = None
+        # 前回の publish 以降に変わったパッチ ID (挿入順)。pending / applied のどちらに
+        # 居るかは publish 時に判定する
+        self._dirty_patches: Dict[str, None] = {}
+        # 共有ストアに載せた集合ごとの ID -> 並び順。None は前の世代の残りを消す前
+        self._published_members: Optional[Dict[str, Dict[str, int]]] = None
+        self._publish_seq = 0
+        # 完了まで参照を保持するバックグラウンド書き込み
+        self._background: Set["asyncio.Task[None]"] = set()
+        if self._config.state_store_path is not None:
+            self._state_store = StateStore(self._config.state_store_path)
         self._reload_patches()
+        self._restore_handoff_state(handoff.read_handoff_state())
+        for patch in (*self._pending_patches, *self._applied_patches):
+            self._mark_dirty(patch.patch_id)
+        self._publish_state()
 
     @asynccontextmanager
     async def lifecycle(self) -> AsyncIterator[None]:
         logger.info("RuntimeApp lifecycle start")
         self._running = True
+        self._stopped.clear()
+        sampler_task: Optional[asyncio.Task[None]] = None
+        if self._config.sampler_interval_seconds > 0:
+            sampler_task = asyncio.create_task(self._sampler.run_forever())
+        loop = asyncio.get_running_loop()
+        abort_handler = False
+        if handoff.reload_available():
+            try:
+                loop.add_signal_handler(handoff.RELOAD_ABORTED_SIGNAL, self.reload_aborted)
+                abort_handler = True
+            except (RuntimeError, ValueError) as exc:
+                # メインスレッド以外のループではシグナルを受けられない
+                logger.warning("Cannot watch reload abort signal: {}", exc)
         try:
             yield
         finally:
             self._running = False
+            if abort_handler:
+                loop.remove_signal_handler(handoff.RELOAD_ABORTED_SIGNAL)
+            if sampler_task is not None:
+                self._sampler.stop()
+                sampler_task.cancel()
+            await self._artifacts.aclose()
+            self._history.flush()
             logger.info("RuntimeApp lifecycle end")
 
     async def run_forever(self) -> None:
-        logger.info("Runtime loop start (interval=%ss)", self._config.loop_interval_seconds)
+        logger.info("Runtime loop start (interval={}s)", self._config.loop_interval_seconds)
         while self._running:
-            if self._paused:
-                await asyncio.sleep(self._config.loop_interval_seconds)
+            if self._paused or self._reloading:
+                self._publish_state()
+                await self._sleep(self._config.loop_interval_seconds)
                 continue
-            plan = await self._planner.plan()
-            self._last_plan = plan
-
-            task = await self._scheduler.schedule(plan)
-            self._last_task = task
-
-            execution = await self._executor.execute(task.plan)
-            self._last_execution = execution
-
+            margin = self._sampler.margin()
+            if margin < self._config.throttle_margin:
+                # 安全余裕が無い間は重い処理を見送り、間隔を広げて待つ
+                self._throttled_iterations += 1
+                logger.bind(sample="runtime.throttled").warning("Runtime loop throttled (safety_margin={:.2f})", margin)
+                self._history.append(time.time(), "throttled")
+                self._publish_state()
+                await self._sleep(self._config.loop_interval_seconds * 2)
+                continue
+            # このイテレーション中のログには iteration を付ける
+            with logger.contextualize(iteration=self._loop_count + 1):
+                started = time.perf_counter()
+                plan = await self._planner.plan()
+                self._last_plan = plan
+                planned = time.perf_counter()
+
+                task = await self._scheduler.schedule(plan)
+                self._last_task = task
+                scheduled = time.perf_counter()
+
+                execution = await self._executor.execute(task.plan)
+                self._last_execution = execution
+                executed = time.perf_counter()
+
+                self._history.append(
+                    time.time(),
+                    execution.status,
+                    plan_ms=(planned - started) * 1000,
+                    schedule_ms=(scheduled - planned) * 1000,
+                    execute_ms=(executed - scheduled) * 1000,
+                    total_ms=(executed - started) * 1000,
+                    priority=task.priority,
+                )
             self._loop_count += 1
-            await asyncio.sleep(self._config.loop_interval_seconds)
+            self._publish_state()
+            await self._sleep(self._config.loop_interval_seconds)
 
         logger.info("Runtime loop stop")
 
+    async def _sleep(self, seconds: float) -> None:
+        """`stop()` が呼ばれたら待機を打ち切る sleep。drain 時に素早く終了するため。"""
+        try:
+            await asyncio.wait_for(self._stopped.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
     @property
     def planner(self) -> Planner:
         return self._planner
@@ -123,19 +431,38 @@ class RuntimeApp:
     def scheduler(self) -> Scheduler:
         return self._scheduler
 
+    @property
+    def artifacts(self) -> ArtifactStore:
+        return self._artifacts
+
+    @property
+    def sampler(self) -> ResourceSampler:
+        return self._sampler
+
+    @property
+    def history(self) -> HistoryStore:
+        return self._history
+
     def stop(self) -> None:
         self._running = False
+        self._stopped.set()
 
     def pause(self) -> None:
         self._paused = True
+        self._publish_state()
 
     def resume(self) -> None:
         self._paused = False
+        self._publish_state()
 
     def is_paused(self) -> bool:
         return self._paused
 
-    def snapshot(self) -> dict:
+    @property
+    def state_store(self) -> Optional[StateStore]:
+        return self._state_store
+
+    def snapshot(self, include_patches: bool = True) -> dict:
         def plan_payload(plan: Optional[Plan]) -> Optional[dict]:
             if plan is None:
                 return None
@@ -146,10 +473,12 @@ class RuntimeApp:
 
         task = self._last_task
         execution = self._last_execution
-        return {
+        payload = {
             "loop_interval_seconds": self._config.loop_interval_seconds,
             "loop_count": self._loop_count,
             "paused": self._paused,
+            "reloading": self._reloading,
+            "generation": handoff.generation(),
             "last_plan": plan_payload(self._last_plan),
             "last_scheduled": None
             if task is None
@@ -163,10 +492,17 @@ class RuntimeApp:
                 "detail": execution.detail,
                 "completed_at": execution.completed_at.isoformat(),
             },
-            "pending_patches": [asdict(patch) for patch in self._pending_patches.values()],
-            "applied_patches": [asdict(patch) for patch in self._applied_patches],
+            "drive": {**self._sampler.status(), "throttled_iterations": self._throttled_iterations},
+            "apply_cache": None if self._patch_executor.cache is None else self._patch_executor.cache.stats(),
+            "pending_count": len(self._pending_patches),
+            "applied_count": len(self._applied_patches),
             "patch_storage_dir": str(self._patch_storage_dir),
         }
+        if include_patches:
+            # diff プレビューは `/patches/{id}/diff` で個別に返す
+            payload["pending_patches"] = [_response_dict(patch) for patch in self._pending_patches.values()]
+            payload["applied_patches"] = [_response_dict(patch) for patch in self._applied_patches]
+        return payload
 
     def enqueue_patch(self, patch: PendingPatch) -> None:
         if patch.diff_preview is None:
@@ -174,59 +510,148 @@ class RuntimeApp:
                 patch.diff_preview = Path(patch.artifact_uri.removeprefix("file://")).read_text(encoding="utf-8")
             except Exception:  # noqa: BLE001
                 patch.diff_preview = None
-        self._pending_patches[patch.patch_id] = patch
+        self._pending_patches.add(patch)
+        self._mark_dirty(patch.patch_id)
         self._write_patch_file(patch)
         self._write_audit_log(patch, status="queued", extra={"artifact_uri": patch.artifact_uri})
+        self._start_prefetch(patch)
+        self._publish_state()
 
     def has_patch(self, patch_id: str) -> bool:
         return patch_id in self._pending_patches
 
     def pop_patch(self, patch_id: str) -> Optional[PendingPatch]:
-        patch = self._pending_patches.pop(patch_id, None)
+        patch = self._pending_patches.pop(patch_id)
+        self._artifacts.cancel(patch_id)
         if patch is not None:
+            self._mark_dirty(patch_id)
             self._delete_patch_file(patch.patch_id)
+            self._publish_state()
         return patch
 
     def get_patch(self, patch_id: str) -> Optional[PendingPatch]:
         return self._pending_patches.get(patch_id)
 
+    def get_applied_patch(self, patch_id: str) -> Optional[PendingPatch]:
+        return self._applied_patches.get(patch_id)
+
     def list_patches(self) -> List[PendingPatch]:
-        return list(self._pending_patches.values())
+        return self._pending_patches.values()
 
-    def fetch_patch_artifact(self, patch: PendingPatch) -> Path:
-        if patch.artifact_local_path:
-            cached = Path(patch.artifact_local_path)
-            if cached.exists():
-                return cached
-
-        parsed = urlparse(patch.artifact_uri)
-        if parsed.scheme == "file":
-            source = Path(parsed.path)
-            if not source.exists():
-                raise FileNotFoundError(source)
-            destination = self._patch_storage_dir / f"{patch.patch_id}.artifact"
-            shutil.copy2(source, destination)
-            patch.artifact_local_path = str(destination)
-            self._write_audit_log(
+    async def fetch_patch_artifact(self, patch: PendingPatch) -> Path:
+        """取得済みのアーティファクトを返し、無ければ取得する。
+
+        先読みや並行する apply が取得中なら、書き込み途中のファイルを使わないよう
+        その完了を待つ。新たに取得する場合も同じパッチのタスクを共有する。
+        """
+        fetched: Optional[FetchedArtifact] = None
+        in_flight = self._artifacts.pending_task(patch.patch_id)
+        if in_flight is not None:
+            try:
+                fetched = await asyncio.shield(in_flight)
+            except Exception as exc:  # noqa: BLE001
+                logger.warning("Prefetch for {} failed, fetching again: {}", patch.patch_id, exc)
+        if fetched is None:
+            if patch.artifact_local_path:
+                cached = Path(patch.artifact_local_path)
+                if cached.exists():
+                    return cached
+            fetched = await self._artifacts.fetch_shared(patch.patch_id, patch.artifact_uri, patch.artifact_sha256)
+        if self._record_artifact(patch, fetched):
+            await asyncio.to_thread(self._persist_artifact, patch, fetched)
+            self._publish_state()
+        return fetched.path
+
+    def _start_prefetch(self, patch: PendingPatch) -> None:
+        """enqueue 直後にアーティファクトの取得をバックグラウンドで開始する。"""
+        try:
+            started = self._artifacts.prefetch(patch.patch_id, patch.artifact_uri, patch.artifact_sha256)
+        except ValueError as exc:
+            logger.warning("Skip prefetch for {}: {}", patch.patch_id, exc)
+            return
+        if started:
+            task = self._artifacts.pending_task(patch.patch_id)
+            if task is not None:
+                task.add_done_callback(lambda done: self._on_prefetched(patch, done))
+
+    def _on_prefetched(self, patch: PendingPatch, task: "asyncio.Task[FetchedArtifact]") -> None:
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc is not None:
+            logger.warning("Artifact prefetch failed for {}: {}", patch.patch_id, exc)
+            return
+        fetched = task.result()
+        if self._pending_patches.get(patch.patch_id) is patch and self._record_artifact(patch, fetched):
+            # ファイルロックを待つ書き込みはループの外で行う
+            persist = asyncio.get_running_loop().create_task(asyncio.to_thread(self._persist_artifact, patch, fetched))
+            self._background.add(persist)
+            persist.add_done_callback(self._background.discard)
+            self._publish_state()
+
+    def _record_artifact(self, patch: PendingPatch, fetched: FetchedArtifact) -> bool:
+        """取得結果をパッチに反映する。変更が無ければ False。"""
+        if patch.artifact_local_path == str(fetched.path) and patch.artifact_sha256 == fetched.sha256:
+            return False
+        patch.artifact_local_path = str(fetched.path)
+        patch.artifact_sha256 = fetched.sha256
+        if fetched.manifest is not None:
+            patch.bundle_manifest = fetched.manifest.to_dict()
+            patch.diff_preview = fetched.preview
+        elif patch.diff_preview is None:
+            patch.diff_preview = fetched.preview
+        self._mark_dirty(patch.patch_id)
+        return True
+
+    def _persist_artifact(self, patch: PendingPatch, fetched: FetchedArtifact) -> None:
+        """`_record_artifact` の結果を書き出す (スレッドで実行する)。
+
+        確認と書き込みを同じロック内で行い、その間に pop されたパッチのファイルを書き戻さない。
+        """
+        with snapshot_lock(self._patch_storage_dir):
+            if self._pending_patches.get(patch.patch_id) is not patch:
+                return
+            self._append_audit_record(
                 patch,
                 status="artifact_copied",
-                extra={"source": patch.artifact_uri, "destination": str(destination)},
+                extra={
+                    "source": patch.artifact_uri,
+                    "destination": str(fetched.path),
+                    "sha256": fetched.sha256,
+                    "size": fetched.size,
+                },
             )
-            self._write_patch_file(patch)
-            return destination
-        raise ValueError(f"Unsupported artifact URI scheme: {parsed.scheme or 'missing'}")
+            self._patch_file(patch.patch_id).write_bytes(patch.to_json())
 
-    def apply_patch(self, patch_id: str) -> ApplyResult:
+    async def apply_patch(self, patch_id: str, use_cache: bool = True) -> ApplyResult:
         patch = self.get_patch(patch_id)
         if patch is None:
             raise KeyError(patch_id)
 
-        artifact_path = self.fetch_patch_artifact(patch)
-        result = self._patch_executor.apply(patch_id, artifact_path)
+        artifact_path = await self.fetch_patch_artifact(patch)
+        if patch.bundle_manifest is not None:
+            # hook には展開済みの diff だけを渡す
+            artifact_path = await asyncio.to_thread(
+                extract_diff, artifact_path, self._patch_storage_dir / f"{patch_id}.diff"
+            )
+        try:
+            # hook の実行とスナップショットのロック待ちはループの外で行う
+            result = await asyncio.to_thread(
+                self._patch_executor.apply,
+                patch_id,
+                artifact_path,
+                use_cache=use_cache,
+                snapshot_dir=self._snapshot_dir(patch_id),
+            )
+        except ResourcePressureError as exc:
+            await asyncio.to_thread(self._write_audit_log, patch, status="apply_deferred", extra={"detail": str(exc)})
+            raise
         if result.ok:
             self.pop_patch(patch_id)
-            self._applied_patches.append(patch)
-            self._write_audit_log(
+            self._applied_patches.add(patch)
+            self._mark_dirty(patch_id)
+            await asyncio.to_thread(
+                self._write_audit_log,
                 patch,
                 status="apply_success",
                 extra={
@@ -235,11 +660,15 @@ class RuntimeApp:
                     "command": result.command,
                     "stdout": result.stdout,
                     "stderr": result.stderr,
+                    "cached": result.cached,
+                    "snapshot": str(result.snapshot_path) if result.snapshot_path else None,
                 },
             )
         else:
-            patch.diff_preview = (artifact_path.read_text(encoding="utf-8") if artifact_path.exists() else patch.diff_preview)
-            self._write_audit_log(
+            if patch.bundle_manifest is None:
+                patch.diff_preview = (artifact_path.read_text(encoding="utf-8") if artifact_path.exists() else patch.diff_preview)
+            await asyncio.to_thread(
+                self._write_audit_log,
                 patch,
                 status="apply_failed",
                 extra={
@@ -247,16 +676,98 @@ class RuntimeApp:
                     "command": result.command,
                     "stdout": result.stdout,
                     "stderr": result.stderr,
+                    "cached": result.cached,
                 },
             )
+        self._publish_state()
+        if result.ok and self._config.reload_on_apply and handoff.reload_available():
+            # 適用済みのコードで動く新しい世代へ切り替える
+            self.request_reload()
         return result
 
+    @asynccontextmanager
+    async def mutation(self) -> AsyncIterator[None]:
+        """変更系リクエストを囲む。リロード中は `ReloadInProgressError` を送出する。"""
+        if self._reloading:
+            raise ReloadInProgressError("Reload in progress; retry shortly")
+        self._mutations += 1
+        try:
+            yield
+        finally:
+            self._mutations -= 1
+            if not self._mutations and self._mutations_idle is not None:
+                self._mutations_idle.set()
+
+    def request_reload(self) -> None:
+        """supervisor に新しい worker への無停止切り替えを依頼する。
+
+        以降の変更は受け付けず (ループも止める)、処理中の変更 (このリクエスト自身を含む) が
+        終わってから状態を書き出して supervisor に通知する。
+        """
+        if not handoff.reload_available():
+            raise ReloadUnavailableError("Hot reload requires RUNTIME_HOT_RELOAD=1")
+        if self._reloading:
+            return
+        self._reloading = True
+        self._mutations_idle = asyncio.Event()
+        if not self._mutations:
+            self._mutations_idle.set()
+        self._handoff_task = asyncio.get_running_loop().create_task(self._hand_off(self._mutations_idle))
+
+    async def _hand_off(self, idle: asyncio.Event) -> None:
+        await idle.wait()
+        self._mutations_idle = None
+        try:
+            handoff.request_reload(self.handoff_state())
+        except Exception as exc:  # noqa: BLE001
+            logger.error("Reload request failed: {}", exc)
+            self._reloading = False
+            return
+        logger.info("Reload requested (loop_count={})", self._loop_count)
+
+    def reload_aborted(self) -> None:
+        """新しい世代が起動できなかったので、この世代で変更の受け付けを再開する。"""
+        if self._reloading:
+            logger.warning("Reload aborted by supervisor; accepting mutations again")
+        self._reloading = False
+
+    def handoff_state(self) -> dict:
+        """次の世代へ引き継ぐメモリ上の状態。pending パッチはファイルから再読込される。"""
+        return {
+            "paused": self._paused,
+            "loop_count": self._loop_count,
+            "applied_patches": [patch.to_dict() for patch in self._applied_patches],
+        }
+
+    def _restore_handoff_state(self, state: Optional[dict]) -> None:
+        if not state:
+            return
+        self._paused = bool(state.get("paused", False))
+        self._loop_count = int(state.get("loop_count", 0))
+        for data in state.get("applied_patches", []):
+            try:
+                self._applied_patches.add(PendingPatch(**data))
+            except TypeError as exc:
+                logger.error("Failed to restore applied patch: {}", exc)
+        logger.info("Restored handoff state (paused={}, applied={})", self._paused, len(self._applied_patches))
+
+    def _snapshot_dir(self, patch_id: str) -> Path:
+        return self._patch_storage_dir / f"{patch_id}.snapshot"
+
     def rollback_patch(self, patch_id: str) -> RollbackResult:
         patch = self.get_patch(patch_id)
+        applied = patch is None
+        if applied:
+            patch = self._applied_patches.get(patch_id)
         if patch is None:
             raise KeyError(patch_id)
 
-        result = self._patch_executor.rollback(patch_id)
+        snapshot_dir = self._snapshot_dir(patch_id)
+        # hook に渡したのは bundle なら展開済み diff、それ以外は取得済みアーティファクト
+        artifact_path = self._patch_storage_dir / f"{patch_id}.diff"
+        if not artifact_path.exists() and patch.artifact_local_path:
+            artifact_path = Path(patch.artifact_local_path)
+        result = self._patch_executor.rollback(patch_id, snapshot_dir, artifact_path)
         status = "rollback_success" if result.ok else "rollback_failed"
         extra = {
             "detail": result.detail,
@@ -270,37 +781,55 @@ class RuntimeApp:
             cached = Path(patch.artifact_local_path)
             if cached.exists():
                 cached.unlink()
+            (self._patch_storage_dir / f"{patch_id}.diff").unlink(missing_ok=True)
             patch.artifact_local_path = None
+            self._mark_dirty(patch_id)
             self._write_patch_file(patch)
-
+        if result.ok:
+            with snapshot_lock(self._patch_storage_dir):
+                shutil.rmtree(snapshot_dir, ignore_errors=True)
+            if applied:
+                # 書き戻した適用済みパッチは再適用できるよう pending に戻す
+                self._applied_patches.pop(patch_id)
+                self._pending_patches.add(patch)
+                self._mark_dirty(patch_id)
+                self._write_patch_file(patch)
+
+        self._publish_state()
         return result
 
     def list_applied_patches(self) -> List[PendingPatch]:
-        return list(self._applied_patches)
+        return self._applied_patches.values()
+
+    def query_patches(self, query: PatchQuery) -> PatchPage:
+        return self._pending_patches.query(query)
+
+    def query_applied_patches(self, query: PatchQuery) -> PatchPage:
+        return self._applied_patches.query(query)
 
     def iter_audit_log(self) -> List[dict]:
-        if not self._audit_log_path.exists():
-            return []
-        entries: List[dict] = []
-        for line in self._audit_log_path.read_text(encoding="utf-8").splitlines():
-            if not line.strip():
-                continue
-            try:
-                entries.append(json.loads(line))
-            except json.JSONDecodeError as exc:
-                logger.error("Invalid audit line: %s", exc)
-        return entries
+        return read_audit_log(self._audit_log_path)
+
+    def audit_page(self, offset: int = 0, limit: Optional[int] = None, newest_first: bool = False) -> Tuple[List[dict], int]:
+        return self._audit_index.page(offset, limit, newest_first)
+
+    def _patch_file(self, patch_id: str) -> Path:
+        return self._patch_storage_dir / f"{patch_id}.json"
 
     def _write_patch_file(self, patch: PendingPatch) -> None:
-        path = self._patch_storage_dir / f"{patch.patch_id}.json"
-        path.write_text(json.dumps(asdict(patch), ensure_ascii=False, indent=2), encoding="utf-8")
+        with snapshot_lock(self._patch_storage_dir):
+            self._patch_file(patch.patch_id).write_bytes(patch.to_json())
 
     def _delete_patch_file(self, patch_id: str) -> None:
-        path = self._patch_storage_dir / f"{patch_id}.json"
-        if path.exists():
-            path.unlink()
+        with snapshot_lock(self._patch_storage_dir):
+            self._patch_file(patch_id).unlink(missing_ok=True)
 
     def _write_audit_log(self, patch: PendingPatch, status: str, extra: Optional[dict] = None) -> None:
+        with snapshot_lock(self._patch_storage_dir):
+            self._append_audit_record(patch, status, extra)
+
+    def _append_audit_record(self, patch: PendingPatch, status: str, extra: Optional[dict] = None) -> None:
+        """呼び出し側が snapshot_lock を保持していること。"""
         record = {
             "patch_id": patch.patch_id,
             "status": status,
@@ -312,14 +841,60 @@ class RuntimeApp:
         with self._audit_log_path.open("a", encoding="utf-8") as fp:
             fp.write(json.dumps(record, ensure_ascii=False) + "\n")
 
+    def _mark_dirty(self, patch_id: str) -> None:
+        self._dirty_patches[patch_id] = None
+
+    def _publish_state(self) -> None:
+        """read worker 向けに現在の状態を共有ストアへ書き出す。
+
+        毎回書くのは件数などを含む小さな `status_compact` だけで、read worker はその更新時刻で
+        writer の生存を判断する。パッチは `_mark_dirty` された ID の行だけを `patches` /
+        `applied` の集合へ書き出す (または削除する) ので、件数によらず変更分の書き込みで済む。
+        """
+        if self._state_store is None:
+            return
+        reset = self._published_members is None
+        published = {PENDING_COLLECTION: {}, APPLIED_COLLECTION: {}} if reset else self._published_members
+        members: List[Tuple[str, str, int, bytes]] = []
+        remove_members: List[Tuple[str, str]] = []
+        seq = self._publish_seq
+        for patch_id in self._dirty_patches:
+            for collection, index in ((PENDING_COLLECTION, self._pending_patches), (APPLIED_COLLECTION, self._applied_patches)):
+                patch = index.get(patch_id)
+                if patch is not None:
+                    position = published[collection].get(patch_id)
+                    if position is None:
+                        seq += 1
+                        position = seq
+                    members.append((collection, patch_id, position, patch.to_response_json()))
+                elif patch_id in published[collection]:
+                    remove_members.append((collection, patch_id))
+        try:
+            self._state_store.publish_many(
+                {"status_compact": self.snapshot(include_patches=False)},
+                members=members,
+                remove_members=remove_members,
+                # 前の世代が残した行は最初の publish で消す
+                reset=(PENDING_COLLECTION, APPLIED_COLLECTION) if reset else (),
+            )
+        except Exception as exc:  # noqa: BLE001
+            logger.error("Failed to publish runtime state: {}", exc)
+            return
+        for collection, patch_id, position, _ in members:
+            published[collection][patch_id] = position
+        for collection, patch_id in remove_members:
+            del published[collection][patch_id]
+        self._published_members = published
+        self._publish_seq = seq
+        self._dirty_patches.clear()
+
     def _reload_patches(self) -> None:
-        self._applied_patches: List[PendingPatch] = []
         for file in self._patch_storage_dir.glob("*.json"):
             try:
                 data = json.loads(file.read_text(encoding="utf-8"))
                 patch = PendingPatch(**data)
             except Exception as exc:  # noqa: BLE001
-                logger.error("Failed to load patch metadata %s: %s", file, exc)
+                logger.error("Failed to load patch metadata {}: {}", file, exc)
             else:
-                self._pending_patches[patch.patch_id] = patch
+                self._pending_patches.add(patch)
         # 過去に適用済みのレコードは audit log から再構築可能だが、ここでは起動時に空とする
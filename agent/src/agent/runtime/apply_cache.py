@@ -0,0 +1,205 @@
+"""パッチ適用 hook の結果キャッシュ。
+
+`(アーティファクトの SHA-256, ワークスペースのリビジョン, hook の同一性)` が同じなら
+hook の検証結果も同じとみなし、再実行せずに前回の結果を返す。
+結果は SQLite に保存するため、ランタイム再起動後も有効。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+
+@dataclass(slots=True, frozen=True)
+class ApplyCacheKey:
+    artifact_sha256: str
+    revision: str
+    hook: str
+
+    @property
+    def digest(self) -> str:
+        return hashlib.sha256(f"{self.artifact_sha256}\0{self.revision}\0{self.hook}".encode()).hexdigest()
+
+
+@dataclass(slots=True)
+class CachedOutcome:
+    ok: bool
+    detail: str
+    command: str
+    stdout: str
+    stderr: str
+    created_at: float
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as fp:
+        for block in iter(lambda: fp.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hook_identity(hook: str) -> str:
+    """hook のパスと内容から同一性を表す文字列を作る。
+
+    スクリプトが書き換えられた場合は別の hook として扱う。
+    """
+    path = Path(hook)
+    try:
+        return f"{path.resolve()}:{file_sha256(path)}"
+    except OSError:
+        return hook
+
+
+def workspace_revision(workspace: Path) -> Optional[str]:
+    """ワークスペースの HEAD。git 管理外や未コミットの変更がある場合は None。"""
+    try:
+        head = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=workspace, capture_output=True, text=True, timeout=10
+        )
+        if head.returncode != 0:
+            return None
+        # touch されただけ (内容は同じ) のファイルを変更扱いしないよう stat 情報を更新する
+        subprocess.run(["git", "update-index", "-q", "--refresh"], cwd=workspace, capture_output=True, timeout=10)
+        dirty = subprocess.run(
+            ["git", "diff-index", "--quiet", "HEAD", "--"], cwd=workspace, capture_output=True, timeout=10
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if dirty.returncode != 0:
+        return None
+    return head.stdout.strip()
+
+
+class ApplyCache:
+    """適用結果を保持する LRU キャッシュ。
+
+    `max_entries` を超えると最後に参照された時刻が古いものから、`ttl_seconds`
+    (0 なら無期限) を過ぎたものは参照時に削除する。件数は毎ループの status に載るため
+    メモリ上で数え、`stats()` では SQLite を読まない。
+    """
+
+    def __init__(self, path: Path, max_entries: int = 256, ttl_seconds: float = 0.0) -> None:
+        self._path = path
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS apply_cache ("
+            " key TEXT PRIMARY KEY,"
+            " artifact_sha256 TEXT NOT NULL,"
+            " revision TEXT NOT NULL,"
+            " hook TEXT NOT NULL,"
+            " ok INTEGER NOT NULL,"
+            " detail TEXT NOT NULL,"
+            " command TEXT NOT NULL,"
+            " stdout TEXT NOT NULL,"
+            " stderr TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS apply_cache_lru ON apply_cache (last_used_at)")
+        (self._entries,) = self._conn.execute("SELECT COUNT(*) FROM apply_cache").fetchone()
+
+    def get(self, key: ApplyCacheKey) -> Optional[CachedOutcome]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT ok, detail, command, stdout, stderr, created_at FROM apply_cache WHERE key = ?",
+                (key.digest,),
+            ).fetchone()
+            if row is not None and self._ttl_seconds > 0 and now - row[5] > self._ttl_seconds:
+                self._conn.execute("DELETE FROM apply_cache WHERE key = ?", (key.digest,))
+                self._evictions += 1
+                self._entries -= 1
+                row = None
+            if row is None:
+                self._misses += 1
+                return None
+            self._conn.execute("UPDATE apply_cache SET last_used_at = ? WHERE key = ?", (now, key.digest))
+            self._hits += 1
+        return CachedOutcome(
+            ok=bool(row[0]), detail=row[1], command=row[2], stdout=row[3], stderr=row[4], created_at=row[5]
+        )
+
+    def put(self, key: ApplyCacheKey, outcome: CachedOutcome) -> None:
+        if self._max_entries <= 0:
+            return
+        with self._lock:
+            exists = self._conn.execute("SELECT 1 FROM apply_cache WHERE key = ?", (key.digest,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO apply_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key.digest,
+                    key.artifact_sha256,
+                    key.revision,
+                    key.hook,
+                    int(outcome.ok),
+                    outcome.detail,
+                    outcome.command,
+                    outcome.stdout,
+                    outcome.stderr,
+                    outcome.created_at,
+                    outcome.created_at,
+                ),
+            )
+            if exists is None:
+                self._entries += 1
+            self._evict_locked()
+
+    def _evict_locked(self) -> None:
+        if self._ttl_seconds > 0:
+            cursor = self._conn.execute(
+                "DELETE FROM apply_cache WHERE created_at < ?", (time.time() - self._ttl_seconds,)
+            )
+            self._evictions += max(0, cursor.rowcount)
+            self._entries -= max(0, cursor.rowcount)
+        overflow = self._entries - self._max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM apply_cache WHERE key IN"
+                " (SELECT key FROM apply_cache ORDER BY last_used_at LIMIT ?)",
+                (overflow,),
+            )
+            self._evictions += overflow
+            self._entries -= overflow
+
+    def invalidate_artifact(self, artifact_sha256: str) -> int:
+        """アーティファクトに紐づく結果を全リビジョン・hook 分削除し、件数を返す。"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM apply_cache WHERE artifact_sha256 = ?", (artifact_sha256,))
+            self._entries -= max(0, cursor.rowcount)
+        return max(0, cursor.rowcount)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM apply_cache")
+            self._entries = 0
+
+    def stats(self) -> dict:
+        lookups = self._hits + self._misses
+        return {
+            "entries": self._entries,
+            "max_entries": self._max_entries,
+            "ttl_seconds": self._ttl_seconds,
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+            "hit_ratio": round(self._hits / lookups, 4) if lookups else None,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,339 @@
+"""パッチアーティファクトの取得レイヤ。
+
+URI スキームごとに `ArtifactFetcher` を登録し、`ArtifactStore` が
+ローカル (`PATCH_STORAGE_DIR`) への取得・チェックサム検証・先読みを担当する。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional, Protocol, Tuple
+from urllib.parse import urlparse
+
+import httpx
+from loguru import logger
+
+from agent.runtime.bundle import BundleManifest, ingest_bundle, is_bundle
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+class ArtifactFetchError(RuntimeError):
+    """リモートアーティファクトの取得・検証に失敗した。"""
+
+
+@dataclass(slots=True)
+class FetchedArtifact:
+    path: Path
+    sha256: str
+    size: int
+    manifest: Optional[BundleManifest] = None
+    preview: Optional[str] = None
+
+
+class ArtifactFetcher(Protocol):
+    async def fetch(self, uri: str, destination: Path) -> FetchedArtifact:
+        ...
+
+    async def aclose(self) -> None:
+        ...
+
+
+def sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as fp:
+        for chunk in iter(lambda: fp.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileArtifactFetcher:
+    """`file://` をコピーする。"""
+
+    async def fetch(self, uri: str, destination: Path) -> FetchedArtifact:
+        source = Path(urlparse(uri).path)
+        if not source.exists():
+            raise FileNotFoundError(source)
+        return await asyncio.to_thread(self._copy, source, destination)
+
+    @staticmethod
+    def _copy(source: Path, destination: Path) -> FetchedArtifact:
+        # backup はロック外で `.artifact` を読むため、書き終えたものだけを rename で置く
+        tmp = destination.with_name(destination.name + ".tmp")
+        try:
+            shutil.copy2(source, tmp)
+            digest = sha256_file(tmp)
+            tmp.replace(destination)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        return FetchedArtifact(destination, digest, destination.stat().st_size)
+
+    async def aclose(self) -> None:
+        return None
+
+
+def _resume_info_path(partial: Path) -> Path:
+    return partial.with_name(partial.name + ".meta")
+
+
+def _resume_state(uri: str, partial: Path) -> Tuple[int, Optional[str]]:
+    """続きから取得できる `.part` のサイズと `If-Range` 用の値。使えなければ捨てて 0 を返す。"""
+    info_path = _resume_info_path(partial)
+    try:
+        info = json.loads(info_path.read_text(encoding="utf-8"))
+        size = partial.stat().st_size
+    except (OSError, ValueError):
+        _discard_partial(partial)
+        return 0, None
+    if info.get("uri") != uri:
+        _discard_partial(partial)
+        return 0, None
+    return size, info.get("validator")
+
+
+def _write_resume_info(partial: Path, uri: str, validator: Optional[str]) -> None:
+    _resume_info_path(partial).write_text(json.dumps({"uri": uri, "validator": validator}), encoding="utf-8")
+
+
+def _discard_partial(partial: Path) -> None:
+    partial.unlink(missing_ok=True)
+    _resume_info_path(partial).unlink(missing_ok=True)
+
+
+def _validator(headers: httpx.Headers) -> Optional[str]:
+    etag = headers.get("etag")
+    # 弱い ETag は If-Range に使えない
+    if etag and not etag.startswith("W/"):
+        return etag
+    return headers.get("last-modified")
+
+
+def _content_range(value: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+    """`bytes <start>-<end>/<total>` / `bytes */<total>` から (start, total) を取り出す。"""
+    if not value or not value.startswith("bytes "):
+        return None, None
+    span, _, total = value[len("bytes ") :].partition("/")
+    start = int(span.split("-")[0]) if span != "*" and span.split("-")[0].isdigit() else None
+    return start, int(total) if total.isdigit() else None
+
+
+def _finish_partial(fp: BinaryIO, tail: bytes) -> None:
+    try:
+        fp.write(tail)
+        fp.truncate()
+    finally:
+        fp.close()
+
+
+def _sha256_prefix(path: Path, size: int) -> "hashlib._Hash":
+    digest = hashlib.sha256()
+    with path.open("rb") as fp:
+        while size > 0:
+            chunk = fp.read(min(_CHUNK_SIZE, size))
+            if not chunk:
+                break
+            digest.update(chunk)
+            size -= len(chunk)
+    return digest
+
+
+class HttpArtifactFetcher:
+    """`http(s)://` を共有 `httpx.AsyncClient` でストリーミング取得する。
+
+    途中で切断された場合は `.part` ファイルを残し、`Range` ヘッダで続きから再試行する。
+    `.part.meta` に取得元 URI と ETag (無ければ Last-Modified) を残し、別の URI の `.part` は
+    捨て、同じ URI でも `If-Range` で対象が変わっていないことを確かめてから続きを使う。
+    """
+
+    def __init__(
+        self,
+        client: Optional[httpx.AsyncClient] = None,
+        max_retries: int = 3,
+        backoff_seconds: float = 0.5,
+        timeout_seconds: float = 30.0,
+    ) -> None:
+        self._client = client
+        self._owns_client = client is None
+        self._max_retries = max_retries
+        self._backoff_seconds = backoff_seconds
+        self._timeout_seconds = timeout_seconds
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self._timeout_seconds,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=16, max_keepalive_connections=8),
+            )
+        return self._client
+
+    async def fetch(self, uri: str, destination: Path) -> FetchedArtifact:
+        partial = destination.with_name(destination.name + ".part")
+        last_error: Optional[Exception] = None
+        for attempt in range(self._max_retries + 1):
+            if attempt:
+                await asyncio.sleep(self._backoff_seconds * 2 ** (attempt - 1))
+            try:
+                sha256, size = await self._download(uri, partial)
+            except (httpx.TransportError, httpx.HTTPStatusError) as exc:
+                last_error = exc
+                status = exc.response.status_code if isinstance(exc, httpx.HTTPStatusError) else None
+                if status is not None and status < 500:
+                    # 再試行しないので、途中まで取得した内容も残さない
+                    await asyncio.to_thread(_discard_partial, partial)
+                    break
+                logger.warning("Artifact fetch attempt {} failed for {}: {}", attempt + 1, uri, exc)
+                continue
+            partial.replace(destination)
+            _resume_info_path(partial).unlink(missing_ok=True)
+            return FetchedArtifact(destination, sha256, size)
+        raise ArtifactFetchError(f"Failed to fetch {uri}: {last_error}")
+
+    async def _download(self, uri: str, partial: Path) -> Tuple[str, int]:
+        """`.part` へ取得し、SHA-256 と合計サイズを返す。ハッシュは受信しながら計算する。"""
+        while True:
+            offset, validator = await asyncio.to_thread(_resume_state, uri, partial)
+            headers = {}
+            if offset:
+                headers["Range"] = f"bytes={offset}-"
+                if validator:
+                    # 対象が変わっていればサーバは 206 ではなく全体 (200) を返す
+                    headers["If-Range"] = validator
+            async with self._get_client().stream("GET", uri, headers=headers) as response:
+                if offset and response.status_code == 416:
+                    if _content_range(response.headers.get("content-range")) == (None, offset):
+                        # 既に全体を取得済み
+                        digest = await asyncio.to_thread(_sha256_prefix, partial, offset)
+                        return digest.hexdigest(), offset
+                    await asyncio.to_thread(_discard_partial, partial)
+                    continue
+                response.raise_for_status()
+                if offset and response.status_code == 206:
+                    start, _ = _content_range(response.headers.get("content-range"))
+                    if start != offset:
+                        logger.warning("Unexpected Content-Range for {}, restarting download", uri)
+                        await asyncio.to_thread(_discard_partial, partial)
+                        continue
+                    digest = await asyncio.to_thread(_sha256_prefix, partial, offset)
+                    fp = await asyncio.to_thread(partial.open, "r+b")
+                    await asyncio.to_thread(fp.seek, offset)
+                else:
+                    offset = 0
+                    digest = hashlib.sha256()
+                    await asyncio.to_thread(_write_resume_info, partial, uri, _validator(response.headers))
+                    fp = await asyncio.to_thread(partial.open, "wb")
+                size = offset
+                buffer = bytearray()
+                try:
+                    async for chunk in response.aiter_bytes():
+                        digest.update(chunk)
+                        buffer += chunk
+                        if len(buffer) >= _CHUNK_SIZE:
+                            await asyncio.to_thread(fp.write, bytes(buffer))
+                            size += len(buffer)
+                            buffer.clear()
+                finally:
+                    # 切断時も受信済みの分は書き出し、次の試行で続きから取得する
+                    await asyncio.to_thread(_finish_partial, fp, bytes(buffer))
+                return digest.hexdigest(), size + len(buffer)
+
+    async def aclose(self) -> None:
+        if self._owns_client and self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class ArtifactStore:
+    """スキーム別 fetcher の登録と、パッチごとの取得・先読みタスク管理。"""
+
+    def __init__(self, storage_dir: Path, fetchers: Optional[Dict[str, ArtifactFetcher]] = None) -> None:
+        self._storage_dir = storage_dir
+        self._fetchers: Dict[str, ArtifactFetcher] = dict(fetchers or {})
+        self._tasks: Dict[str, asyncio.Task[FetchedArtifact]] = {}
+
+    def register(self, scheme: str, fetcher: ArtifactFetcher) -> None:
+        self._fetchers[scheme] = fetcher
+
+    def destination_for(self, patch_id: str) -> Path:
+        return self._storage_dir / f"{patch_id}.artifact"
+
+    def _fetcher_for(self, uri: str) -> ArtifactFetcher:
+        scheme = urlparse(uri).scheme
+        fetcher = self._fetchers.get(scheme)
+        if fetcher is None:
+            raise ValueError(f"Unsupported artifact URI scheme: {scheme or 'missing'}")
+        return fetcher
+
+    async def fetch(self, patch_id: str, uri: str, expected_sha256: Optional[str] = None) -> FetchedArtifact:
+        fetched = await self._fetcher_for(uri).fetch(uri, self.destination_for(patch_id))
+        if expected_sha256 and fetched.sha256 != expected_sha256.lower():
+            fetched.path.unlink(missing_ok=True)
+            raise ArtifactFetchError(
+                f"Checksum mismatch for {uri}: expected {expected_sha256}, got {fetched.sha256}"
+            )
+        if await asyncio.to_thread(is_bundle, fetched.path):
+            fetched.manifest, fetched.preview = await asyncio.to_thread(ingest_bundle, fetched.path)
+        else:
+            fetched.preview = await asyncio.to_thread(fetched.path.read_text, encoding="utf-8", errors="replace")
+        return fetched
+
+    def prefetch(self, patch_id: str, uri: str, expected_sha256: Optional[str] = None) -> bool:
+        """イベントループ上でバックグラウンド取得を開始する。ループが無ければ何もしない。"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        self._fetcher_for(uri)
+        self.cancel(patch_id)
+        self._start(patch_id, uri, expected_sha256)
+        return True
+
+    async def fetch_shared(self, patch_id: str, uri: str, expected_sha256: Optional[str] = None) -> FetchedArtifact:
+        """取得中のタスクがあればその結果を待ち、無ければ取得を始める。
+
+        同じパッチの `.part` / `.part.meta` へ複数の取得が並行して書き込まないよう、
+        パッチごとに取得タスクを 1 つだけにする。呼び出し側がキャンセルされてもタスクは続ける。
+        """
+        task = self._tasks.get(patch_id)
+        if task is None or task.done():
+            task = self._start(patch_id, uri, expected_sha256)
+        return await asyncio.shield(task)
+
+    def _start(self, patch_id: str, uri: str, expected_sha256: Optional[str]) -> asyncio.Task[FetchedArtifact]:
+        task = asyncio.get_running_loop().create_task(self.fetch(patch_id, uri, expected_sha256))
+        self._tasks[patch_id] = task
+
+        def forget(done: asyncio.Task[FetchedArtifact]) -> None:
+            if self._tasks.get(patch_id) is done:
+                del self._tasks[patch_id]
+
+        task.add_done_callback(forget)
+        return task
+
+    def pending_task(self, patch_id: str) -> Optional[asyncio.Task[FetchedArtifact]]:
+        return self._tasks.get(patch_id)
+
+    def cancel(self, patch_id: str) -> None:
+        task = self._tasks.pop(patch_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+
+    async def aclose(self) -> None:
+        for patch_id in list(self._tasks):
+            self.cancel(patch_id)
+        for fetcher in self._fetchers.values():
+            await fetcher.aclose()
+
+
+def default_artifact_store(storage_dir: Path, max_retries: int = 3, timeout_seconds: float = 30.0) -> ArtifactStore:
+    http = HttpArtifactFetcher(max_retries=max_retries, timeout_seconds=timeout_seconds)
+    return ArtifactStore(
+        storage_dir,
+        fetchers={"file": FileArtifactFetcher(), "http": http, "https": http},
+    )
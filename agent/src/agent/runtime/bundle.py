@@ -0,0 +1,226 @@
+"""複数ファイルのパッチをまとめた圧縮バンドル形式。
+
+バンドルは tar.gz で、先頭メンバーに `manifest.json`、続いて `patch.diff` と
+任意の `test_report.*` を格納する。manifest を先頭に置くことで、ストリーミング
+展開しながら manifest だけを読み出せる。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import tarfile
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import IO, Iterator, List, Optional, Tuple
+
+FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+DIFF_NAME = "patch.diff"
+_GZIP_MAGIC = b"\x1f\x8b"
+_CHUNK_SIZE = 1024 * 1024
+
+
+class BundleError(ValueError):
+    """バンドルの構造や整合性が不正。"""
+
+
+@dataclass(slots=True)
+class BundleFileStat:
+    path: str
+    sha256: str
+    added: int
+    removed: int
+
+
+@dataclass(slots=True)
+class BundleManifest:
+    diff_sha256: str
+    diff_size: int
+    files: List[BundleFileStat] = field(default_factory=list)
+    test_report: Optional[str] = None
+    format_version: int = FORMAT_VERSION
+
+    @property
+    def added(self) -> int:
+        return sum(stat.added for stat in self.files)
+
+    @property
+    def removed(self) -> int:
+        return sum(stat.removed for stat in self.files)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BundleManifest":
+        try:
+            files = [BundleFileStat(**item) for item in data.get("files", [])]
+            return cls(
+                diff_sha256=data["diff_sha256"],
+                diff_size=int(data["diff_size"]),
+                files=files,
+                test_report=data.get("test_report"),
+                format_version=int(data.get("format_version", FORMAT_VERSION)),
+            )
+        except (KeyError, TypeError, ValueError) as exc:
+            raise BundleError(f"Invalid bundle manifest: {exc}") from exc
+
+
+def diff_file_stats(diff: bytes) -> List[BundleFileStat]:
+    """unified diff をファイル単位に分割し、ハッシュと追加/削除行数を求める。"""
+    sections: List[Tuple[List[bytes], dict]] = []
+    current: Optional[Tuple[List[bytes], dict]] = None
+    lines = diff.splitlines(keepends=True)
+    for index, line in enumerate(lines):
+        starts_git = line.startswith(b"diff --git ")
+        starts_plain = (
+            line.startswith(b"--- ")
+            and index + 1 < len(lines)
+            and lines[index + 1].startswith(b"+++ ")
+            and (current is None or current[1]["in_hunk"])
+        )
+        if starts_git or starts_plain or current is None:
+            current = ([], {"path": None, "old": None, "added": 0, "removed": 0, "in_hunk": False})
+            sections.append(current)
+        body, meta = current
+        body.append(line)
+        if line.startswith(b"@@"):
+            meta["in_hunk"] = True
+        elif meta["in_hunk"]:
+            if line.startswith(b"+"):
+                meta["added"] += 1
+            elif line.startswith(b"-"):
+                meta["removed"] += 1
+        elif line.startswith(b"--- "):
+            meta["old"] = _strip_prefix(line[4:])
+        elif line.startswith(b"+++ "):
+            meta["path"] = _strip_prefix(line[4:])
+
+    stats = []
+    for body, meta in sections:
+        path = meta["path"] if meta["path"] not in (None, "/dev/null") else meta["old"]
+        if path is None:
+            continue
+        stats.append(
+            BundleFileStat(
+                path=path,
+                sha256=hashlib.sha256(b"".join(body)).hexdigest(),
+                added=meta["added"],
+                removed=meta["removed"],
+            )
+        )
+    return stats
+
+
+def _strip_prefix(raw: bytes) -> str:
+    name = raw.decode("utf-8", errors="replace").rstrip("\r\n").split("\t")[0]
+    if name.startswith(("a/", "b/")):
+        return name[2:]
+    return name
+
+
+def build_bundle(diff_path: Path, destination: Path, test_report: Optional[Path] = None) -> BundleManifest:
+    """diff (とテストレポート) からバンドルを作成する。"""
+    diff = diff_path.read_bytes()
+    manifest = BundleManifest(
+        diff_sha256=hashlib.sha256(diff).hexdigest(),
+        diff_size=len(diff),
+        files=diff_file_stats(diff),
+        test_report=f"test_report{test_report.suffix}" if test_report is not None else None,
+    )
+    with tarfile.open(destination, "w:gz") as archive:
+        _add_bytes(archive, MANIFEST_NAME, json.dumps(manifest.to_dict(), ensure_ascii=False, indent=2).encode("utf-8"))
+        _add_bytes(archive, DIFF_NAME, diff)
+        if test_report is not None and manifest.test_report is not None:
+            archive.add(str(test_report), arcname=manifest.test_report)
+    return manifest
+
+
+def _add_bytes(archive: tarfile.TarFile, name: str, data: bytes) -> None:
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = 0o644
+    archive.addfile(info, io.BytesIO(data))
+
+
+def is_bundle(path: Path) -> bool:
+    with path.open("rb") as fp:
+        return fp.read(2) == _GZIP_MAGIC
+
+
+def _iter_members(path: Path) -> Iterator[Tuple[tarfile.TarInfo, IO[bytes]]]:
+    try:
+        with tarfile.open(path, "r|gz") as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                stream = archive.extractfile(member)
+                if stream is not None:
+                    yield member, stream
+    except (tarfile.TarError, OSError, EOFError) as exc:
+        raise BundleError(f"Corrupted bundle {path.name}: {exc}") from exc
+
+
+def _load_manifest(member: tarfile.TarInfo, stream: IO[bytes]) -> BundleManifest:
+    if member.name != MANIFEST_NAME:
+        raise BundleError(f"Bundle must start with {MANIFEST_NAME}, found {member.name}")
+    try:
+        data = json.loads(stream.read())
+    except json.JSONDecodeError as exc:
+        raise BundleError(f"Invalid bundle manifest: {exc}") from exc
+    return BundleManifest.from_dict(data)
+
+
+def read_manifest(path: Path) -> BundleManifest:
+    """先頭メンバーの manifest だけを展開して返す。"""
+    for member, stream in _iter_members(path):
+        return _load_manifest(member, stream)
+    raise BundleError("Empty bundle")
+
+
+def ingest_bundle(path: Path, preview_bytes: int = 64 * 1024) -> Tuple[BundleManifest, str]:
+    """ストリーミング展開で diff のハッシュを検証し、manifest とプレビューを返す。
+
+    diff 全体はメモリにもディスクにも展開しない。
+    """
+    manifest: Optional[BundleManifest] = None
+    preview = b""
+    for member, stream in _iter_members(path):
+        if manifest is None:
+            manifest = _load_manifest(member, stream)
+            continue
+        if member.name != DIFF_NAME:
+            continue
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in iter(lambda: stream.read(_CHUNK_SIZE), b""):
+            if len(preview) < preview_bytes:
+                preview += chunk[: preview_bytes - len(preview)]
+            digest.update(chunk)
+            size += len(chunk)
+        if digest.hexdigest() != manifest.diff_sha256 or size != manifest.diff_size:
+            raise BundleError("Bundle diff does not match manifest checksum")
+        return manifest, preview.decode("utf-8", errors="ignore")
+    if manifest is None:
+        raise BundleError("Empty bundle")
+    raise BundleError(f"Bundle does not contain {DIFF_NAME}")
+
+
+def extract_member(path: Path, name: str, destination: Path) -> Path:
+    """指定メンバーだけをストリーミング展開する。"""
+    for member, stream in _iter_members(path):
+        if member.name != name:
+            continue
+        tmp = destination.with_name(destination.name + ".tmp")
+        with tmp.open("wb") as fp:
+            for chunk in iter(lambda: stream.read(_CHUNK_SIZE), b""):
+                fp.write(chunk)
+        tmp.replace(destination)
+        return destination
+    raise BundleError(f"Bundle does not contain {name}")
+
+
+def extract_diff(path: Path, destination: Path) -> Path:
+    return extract_member(path, DIFF_NAME, destination)
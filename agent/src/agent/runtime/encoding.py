@@ -0,0 +1,26 @@
+"""JSON エンコードのヘルパー。
+
+orjson が入っていればそれを使い、無ければ標準の json にフォールバックする。
+どちらの場合も UTF-8 の bytes を返す。
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any, Iterable
+
+try:  # pragma: no cover - 環境依存
+    import orjson
+except ImportError:  # pragma: no cover - 環境依存
+    orjson = None
+
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def join_array(items: Iterable[bytes]) -> bytes:
+    """エンコード済みの要素を JSON 配列として連結する。"""
+    return b"[" + b",".join(items) + b"]"
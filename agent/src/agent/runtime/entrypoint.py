@@ -1,20 +1,274 @@
 """Runtime エージェントのエントリーポイント。
-現時点では最小ループのみを提供し、将来的に PDCA / ドライブ連携を組み込む。"""
+現時点では最小ループのみを提供し、将来的に PDCA / ドライブ連携を組み込む。
+
+`RUNTIME_READ_WORKERS` を 1 以上にすると、ループとパッチ変更を担う writer を
+子プロセスとして `RUNTIME_WRITER_PORT` で起動し、公開ポートでは共有ストアから
+GET を返す read worker を N 個起動する。writer が異常終了した場合はバックオフを挟んで
+再起動する。
+
+`RUNTIME_HOT_RELOAD=1` では待ち受けソケットを保持する supervisor が writer を子プロセス
+として起動し、`/control/reload` (または `YAMADA_RELOAD_ON_APPLY=1` でのパッチ適用成功)
+をきっかけに新しいコードの writer へ無停止で切り替える。
+
+writer のログは `agent.runtime.structured_log` の非同期シンクで JSON 行として
+`YAMADA_LOG_FILE` に書き出す。"""
 
 from __future__ import annotations
 
+import asyncio
 import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
 
+import httpx
 import uvicorn
+from fastapi import FastAPI
+from loguru import logger
+from starlette.types import ASGIApp
 
+from agent.runtime import handoff
 from agent.runtime.app import RuntimeApp, RuntimeConfig
 from agent.runtime.server import create_app
+from agent.runtime.structured_log import LogConfig, configure_logging
 
 
-if __name__ == "__main__":
+def run_writer(host: str, port: int) -> None:
+    if os.environ.get("RUNTIME_HOT_RELOAD") == "1" and not handoff.is_worker():
+        ready_timeout = float(os.environ.get("YAMADA_RELOAD_READY_TIMEOUT", "30"))
+        sys.exit(handoff.Supervisor(host, port, ready_timeout=ready_timeout).run())
+
     config = RuntimeConfig.from_env(os.environ)
+    configure_logging(
+        LogConfig(
+            path=config.log_path,
+            max_bytes=config.log_max_bytes,
+            backups=config.log_backups,
+            sample_per_second=config.log_sample_per_second,
+            queue_size=config.log_queue_size,
+            level=config.log_level,
+            console=config.log_console,
+        )
+    )
     runtime_app = RuntimeApp(config=config)
     app = create_app(runtime_app)
+    sock = handoff.inherited_socket()
+    if sock is None:
+        uvicorn.run(app, host=host, port=port, log_config=None)
+        return
+    if not asyncio.run(serve_inherited(app, sock)):
+        sys.exit(1)
+
+
+DRAIN_GRACE_SECONDS = 1.0
+
+
+class DrainingServer(uvicorn.Server):
+    """SIGTERM を受けると新しい接続の受け付けを止め、`grace` 秒の間は既存の keep-alive 接続に
+    `Connection: close` を返して閉じさせてから終了する。
+
+    旧世代がすぐに終了処理へ入ると、keep-alive 接続へ送られた直後のリクエストが応答なしで
+    切断されるため、クライアントが新しい接続 (新世代) へ移るまで待つ。
+
+    `ready_check` を渡すと、lifespan の起動後・ソケットでの受け付け開始前に実行し、
+    失敗した場合は一度も接続を受け付けずに終了する。
+    """
+
+    def __init__(
+        self,
+        config: uvicorn.Config,
+        grace: float = DRAIN_GRACE_SECONDS,
+        ready_check: Optional[Callable[[], Awaitable[bool]]] = None,
+    ) -> None:
+        super().__init__(config)
+        self.draining = False
+        self._grace = grace
+        self._ready_check = ready_check
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def startup(self, sockets=None) -> None:
+        self._loop = asyncio.get_running_loop()
+        if self._ready_check is not None:
+            await self.lifespan.startup()
+            if self.lifespan.should_exit:
+                self.should_exit = True
+                return
+            if not await self._ready_check():
+                # 共有ソケットの backlog には触れずに終了する
+                self.should_exit = True
+                await self.lifespan.shutdown()
+                return
+            # lifespan は起動済みなので、以降は待ち受けの開始だけを行う
+            self.lifespan.startup = _lifespan_started
+        await super().startup(sockets)
+
+    def handle_exit(self, sig: int, frame) -> None:
+        if sig != signal.SIGTERM or self.draining or self._loop is None or not self.started:
+            super().handle_exit(sig, frame)
+            return
+        self.draining = True
+        self._loop.call_soon_threadsafe(self._begin_drain)
+
+    def _begin_drain(self) -> None:
+        for listener in self.servers:
+            listener.close()
+        self._loop.call_later(self._grace, setattr, self, "should_exit", True)
+
+
+async def _lifespan_started() -> None:
+    return None
+
+
+def close_connections_while_draining(app: ASGIApp, server: DrainingServer) -> ASGIApp:
+    async def wrapped(scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await app(scope, receive, send)
+            return
+
+        async def send_closing(message) -> None:
+            if message["type"] == "http.response.start" and server.draining:
+                message = {**message, "headers": [*message.get("headers", []), (b"connection", b"close")]}
+            await send(message)
+
+        await app(scope, receive, send_closing)
 
+    return wrapped
+
+
+async def serve_inherited(app: FastAPI, sock) -> bool:
+    """supervisor から継承したソケットで起動し、自己診断に通れば ready を通知する。
+
+    自己診断はソケットで受け付けを始める前にプロセス内で行うため、診断に失敗した世代が
+    共有 backlog の接続を受け取って落とすことはない。
+    """
+    config = uvicorn.Config(app, log_config=None)
+    server = DrainingServer(config, ready_check=lambda: readiness_check(app))
+    config.app = close_connections_while_draining(app, server)
+    serving = asyncio.create_task(server.serve(sockets=[sock]))
+    while not server.started:
+        if serving.done():
+            return False
+        await asyncio.sleep(0.05)
+    handoff.notify_ready()
+    await serving
+    return True
+
+
+async def readiness_check(app: FastAPI) -> bool:
+    # ソケットは旧世代と共有しているため、自分自身の app をプロセス内で叩いて確認する
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://self") as client:
+        try:
+            health = await client.get("/healthz")
+            status = await client.get("/status", params={"compact": "true"})
+        except Exception as exc:  # noqa: BLE001
+            logger.error("Readiness check failed: {}", exc)
+            return False
+    if health.status_code != 200 or status.status_code != 200:
+        logger.error("Readiness check failed: healthz={} status={}", health.status_code, status.status_code)
+        return False
+    return True
+
+
+class WriterProcess:
+    """read worker 構成の writer 子プロセスを監視し、終了したら再起動する。
+
+    再起動の間隔は `min_backoff` から倍々に `max_backoff` まで延ばし、`stable_seconds`
+    以上動き続けた後の終了では `min_backoff` に戻す。
+    """
+
+    def __init__(
+        self,
+        command: List[str],
+        env: Dict[str, str],
+        min_backoff: float = 1.0,
+        max_backoff: float = 30.0,
+        stable_seconds: float = 60.0,
+    ) -> None:
+        self._command = command
+        self._env = env
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._stable_seconds = stable_seconds
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._process: Optional[subprocess.Popen] = None
+        self._started_at = 0.0
+        self._thread = threading.Thread(target=self._watch, name="writer-supervisor", daemon=True)
+        self.restarts = 0
+
+    def start(self) -> None:
+        self._spawn()
+        self._thread.start()
+
+    def _spawn(self) -> None:
+        with self._lock:
+            if self._stopping.is_set():
+                return
+            self._process = subprocess.Popen(self._command, env=self._env)
+            self._started_at = time.monotonic()
+
+    def _watch(self) -> None:
+        backoff = self._min_backoff
+        while not self._stopping.wait(0.5):
+            code = self._process.poll()
+            if code is None:
+                continue
+            if time.monotonic() - self._started_at >= self._stable_seconds:
+                backoff = self._min_backoff
+            logger.error("Runtime writer exited (code={}); restarting in {:.1f}s", code, backoff)
+            if self._stopping.wait(backoff):
+                return
+            self._spawn()
+            self.restarts += 1
+            backoff = min(backoff * 2, self._max_backoff)
+
+    def stop(self) -> None:
+        with self._lock:
+            self._stopping.set()
+            process = self._process
+        if process is not None and process.poll() is None:
+            process.terminate()
+            process.wait()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+def run_with_read_workers(port: int, workers: int) -> None:
+    writer_port = int(os.environ.get("RUNTIME_WRITER_PORT", "8081"))
+    env = dict(os.environ)
+    env.setdefault("YAMADA_STATE_STORE", "state/runtime_state.sqlite3")
+    env["YAMADA_RUNTIME_ROLE"] = "writer"
+    env["RUNTIME_PORT"] = str(writer_port)
+    env["RUNTIME_WRITER_URL"] = f"http://127.0.0.1:{writer_port}"
+    os.environ.update({key: env[key] for key in ("YAMADA_STATE_STORE", "RUNTIME_WRITER_URL")})
+
+    writer = WriterProcess([sys.executable, "-m", "agent.runtime.entrypoint"], env)
+    writer.start()
+    try:
+        uvicorn.run(
+            "agent.runtime.reader:create_reader_app_from_env",
+            factory=True,
+            host="0.0.0.0",
+            port=port,
+            workers=workers,
+            log_config=None,
+        )
+    finally:
+        writer.stop()
+
+
+if __name__ == "__main__":
     port = int(os.environ.get("RUNTIME_PORT", "8080"))
-    uvicorn.run(app, host="0.0.0.0", port=port, log_config=None)
+    role = os.environ.get("YAMADA_RUNTIME_ROLE", "")
+    read_workers = int(os.environ.get("RUNTIME_READ_WORKERS", "0"))
+
+    if role == "writer":
+        run_writer("127.0.0.1", port)
+    elif read_workers > 0:
+        run_with_read_workers(port, read_workers)
+    else:
+        run_writer("0.0.0.0", port)
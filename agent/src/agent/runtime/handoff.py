@@ -0,0 +1,269 @@
+"""無停止リロード (ソケット引き継ぎ) のための supervisor と worker 側ヘルパー。
+
+supervisor は待ち受けソケットだけを保持し、ランタイム本体 (worker) を子プロセスとして
+起動する。リロード要求 (SIGHUP) を受けると、パッチ適用後のワークスペースから新しい
+worker を同じソケットを継承させて起動し、新 worker の readiness 通知を待ってから
+旧 worker に SIGTERM を送って処理中のリクエストを捌き切らせる。新 worker が期限内に
+ready にならなければ新 worker を止め、旧 worker のまま動作を続ける。
+
+ソケットはカーネル上で共有されるため、切り替え中に届いた接続は backlog に積まれ、
+どちらかの worker が受け付ける。
+
+旧 worker はリロードを依頼した時点で変更系リクエストの受け付けを止め (503)、処理中の
+変更が終わってから引き継ぐ状態を書き出す。新 worker が起動できなかった場合、supervisor は
+旧 worker に `RELOAD_ABORTED_SIGNAL` を送って受け付けを再開させる。
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import select
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from loguru import logger
+
+LISTEN_FD_ENV = "YAMADA_LISTEN_FD"
+READY_FD_ENV = "YAMADA_READY_FD"
+SUPERVISOR_PID_ENV = "YAMADA_SUPERVISOR_PID"
+HANDOFF_STATE_ENV = "YAMADA_HANDOFF_STATE"
+GENERATION_ENV = "YAMADA_RUNTIME_GENERATION"
+RELOAD_ABORTED_SIGNAL = signal.SIGUSR1
+
+
+class ReloadUnavailableError(RuntimeError):
+    """supervisor 配下で動作していないためリロードできない。"""
+
+
+class ReloadInProgressError(RuntimeError):
+    """リロード中のため変更を受け付けない。"""
+
+
+# --- worker 側 ----------------------------------------------------------------
+
+
+def reload_available() -> bool:
+    return bool(os.environ.get(SUPERVISOR_PID_ENV))
+
+
+def is_worker() -> bool:
+    """supervisor からソケットを継承して起動された worker か。"""
+    return bool(os.environ.get(LISTEN_FD_ENV))
+
+
+def generation() -> int:
+    """supervisor 配下での世代番号 (単独起動時は 0)。"""
+    return int(os.environ.get(GENERATION_ENV, "0"))
+
+
+def inherited_socket() -> Optional[socket.socket]:
+    fd = os.environ.get(LISTEN_FD_ENV)
+    if not fd:
+        return None
+    return socket.socket(fileno=int(fd))
+
+
+def handoff_state_path() -> Optional[Path]:
+    path = os.environ.get(HANDOFF_STATE_ENV)
+    return Path(path) if path else None
+
+
+def write_handoff_state(state: dict) -> None:
+    path = handoff_state_path()
+    if path is None:
+        return
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(state, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(path)
+
+
+def read_handoff_state() -> Optional[dict]:
+    path = handoff_state_path()
+    if path is None or not path.exists():
+        return None
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError) as exc:
+        logger.error("Failed to read handoff state {}: {}", path, exc)
+        return None
+
+
+def request_reload(state: dict) -> None:
+    """現在の状態を書き出し、supervisor に新 worker の起動を依頼する。"""
+    pid = os.environ.get(SUPERVISOR_PID_ENV)
+    if not pid:
+        raise ReloadUnavailableError("Hot reload requires RUNTIME_HOT_RELOAD=1")
+    write_handoff_state(state)
+    os.kill(int(pid), signal.SIGHUP)
+
+
+def notify_ready() -> None:
+    fd = os.environ.pop(READY_FD_ENV, None)
+    if not fd:
+        return
+    try:
+        os.write(int(fd), b"ready\n")
+    finally:
+        os.close(int(fd))
+
+
+# --- supervisor 側 ------------------------------------------------------------
+
+
+class Supervisor:
+    """待ち受けソケットを保持し、worker の世代交代を管理する。"""
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        command: Optional[List[str]] = None,
+        ready_timeout: float = 30.0,
+        drain_timeout: float = 30.0,
+    ) -> None:
+        self._host = host
+        self._port = port
+        self._command = command or [sys.executable, "-m", "agent.runtime.entrypoint"]
+        self._ready_timeout = ready_timeout
+        self._drain_timeout = drain_timeout
+        self._reload_requested = False
+        self._stop_requested = False
+        self._generation = 0
+        self._draining: List[tuple[subprocess.Popen, float]] = []
+        self._state_dir = Path(tempfile.mkdtemp(prefix="yamada6-handoff-"))
+
+    def bind(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self._host, self._port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        return sock
+
+    def spawn(self, sock: socket.socket) -> Optional[subprocess.Popen]:
+        """新しい worker を起動し、ready になれば返す。失敗時は None。"""
+        self._generation += 1
+        ready_r, ready_w = os.pipe()
+        env = dict(os.environ)
+        env.update(
+            {
+                LISTEN_FD_ENV: str(sock.fileno()),
+                READY_FD_ENV: str(ready_w),
+                SUPERVISOR_PID_ENV: str(os.getpid()),
+                HANDOFF_STATE_ENV: str(self._state_dir / "state.json"),
+                GENERATION_ENV: str(self._generation),
+            }
+        )
+        try:
+            process = subprocess.Popen(self._command, env=env, pass_fds=(sock.fileno(), ready_w))
+        finally:
+            os.close(ready_w)
+        try:
+            ready = self._wait_ready(process, ready_r)
+        finally:
+            os.close(ready_r)
+        if ready:
+            logger.info("Runtime generation {} ready (pid={})", self._generation, process.pid)
+            return process
+        logger.error("Runtime generation {} failed readiness check", self._generation)
+        _terminate(process, self._drain_timeout)
+        return None
+
+    def drain(self, process: subprocess.Popen) -> None:
+        """旧 worker に SIGTERM を送り、処理中のリクエストを捌き切らせる (待たない)。"""
+        if process.poll() is None:
+            process.send_signal(signal.SIGTERM)
+            self._draining.append((process, time.monotonic() + self._drain_timeout))
+
+    def _reap(self) -> None:
+        remaining = []
+        for process, deadline in self._draining:
+            if process.poll() is not None:
+                logger.info("Previous runtime worker exited (pid={}, code={})", process.pid, process.returncode)
+                continue
+            if time.monotonic() > deadline:
+                logger.warning("Previous runtime worker did not drain in time; killing pid={}", process.pid)
+                process.kill()
+                process.wait()
+                continue
+            remaining.append((process, deadline))
+        self._draining = remaining
+
+    def _wait_ready(self, process: subprocess.Popen, ready_r: int) -> bool:
+        deadline = time.monotonic() + self._ready_timeout
+        buffer = b""
+        while time.monotonic() < deadline:
+            readable, _, _ = select.select([ready_r], [], [], 0.2)
+            if readable:
+                data = os.read(ready_r, 64)
+                if not data:
+                    # worker が通知せずに書き込み側を閉じた (起動失敗)
+                    return False
+                buffer += data
+                if b"ready" in buffer:
+                    return True
+            if process.poll() is not None:
+                return False
+        return False
+
+    def _on_reload(self, *_: object) -> None:
+        self._reload_requested = True
+
+    def _on_stop(self, *_: object) -> None:
+        self._stop_requested = True
+
+    def run(self) -> int:
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        sock = self.bind()
+        logger.info("Supervisor listening on {}:{}", self._host, self._port)
+        try:
+            current = self.spawn(sock)
+            if current is None:
+                return 1
+            while not self._stop_requested:
+                if self._reload_requested:
+                    self._reload_requested = False
+                    replacement = self.spawn(sock)
+                    if replacement is None:
+                        logger.warning("Reload aborted; keeping pid={}", current.pid)
+                        # 旧 worker は引き継ぎのため変更を止めているので再開させる
+                        if current.poll() is None:
+                            current.send_signal(RELOAD_ABORTED_SIGNAL)
+                    else:
+                        # 新 worker が受け付けを始めてから旧 worker を drain させる
+                        self.drain(current)
+                        current = replacement
+                self._reap()
+                code = current.poll()
+                if code is not None:
+                    logger.error("Runtime worker exited unexpectedly (code={})", code)
+                    return code
+                time.sleep(0.2)
+            _terminate(current, self._drain_timeout)
+            return 0
+        finally:
+            for process, _ in self._draining:
+                _terminate(process, self._drain_timeout)
+            sock.close()
+            shutil.rmtree(self._state_dir, ignore_errors=True)
+
+
+def _terminate(process: subprocess.Popen, timeout: float) -> None:
+    if process.poll() is not None:
+        return
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
@@ -0,0 +1,301 @@
+"""ループ実行履歴の列指向ストア。
+
+直近の行は列ごとの `array` に固定件数だけ保持し、満杯になったらまとめてディスクの
+セグメントファイルへ書き出す。セグメントは時刻範囲をファイル名に持つため、範囲クエリ
+では重なるものだけを読み込む。ディスク使用量が上限を超えたら古いセグメントから削除する。
+
+セグメント形式::
+
+    <JSON ヘッダ 1 行>\\n<列 0 の生バイト><列 1 の生バイト>...
+"""
+
+from __future__ import annotations
+
+import bisect
+import json
+import math
+import threading
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+# (列名, array の型コード)。status はヘッダの status 表へのインデックス。
+COLUMNS: Tuple[Tuple[str, str], ...] = (
+    ("timestamp", "d"),
+    ("plan_ms", "f"),
+    ("schedule_ms", "f"),
+    ("execute_ms", "f"),
+    ("total_ms", "f"),
+    ("priority", "i"),
+    ("status", "B"),
+)
+NUMERIC_COLUMNS = ("plan_ms", "schedule_ms", "execute_ms", "total_ms", "priority")
+SEGMENT_SUFFIX = ".seg"
+_VERSION = 1
+
+
+@dataclass(slots=True)
+class HistoryConfig:
+    capacity: int = 8640
+    max_disk_bytes: int = 64 * 1024 * 1024
+
+
+class _Columns:
+    """同じ長さの列の集合。メモリ上のバッファとセグメント読み込みの両方で使う。"""
+
+    __slots__ = ("data", "statuses")
+
+    def __init__(self, statuses: Optional[List[str]] = None) -> None:
+        self.data: Dict[str, array] = {name: array(code) for name, code in COLUMNS}
+        self.statuses: List[str] = statuses if statuses is not None else []
+
+    def __len__(self) -> int:
+        return len(self.data["timestamp"])
+
+    def slice_range(self, start: float, end: float) -> Tuple[int, int]:
+        timestamps = self.data["timestamp"]
+        return bisect.bisect_left(timestamps, start), bisect.bisect_right(timestamps, end)
+
+    def row(self, index: int) -> dict:
+        row = {name: column[index] for name, column in self.data.items()}
+        row["status"] = self.statuses[row["status"]]
+        return row
+
+
+def _empty_bucket() -> dict:
+    return {"count": 0, "status": {}, **{name: [math.inf, -math.inf, 0.0] for name in NUMERIC_COLUMNS}}
+
+
+def _accumulate(entry: dict, block: _Columns, begin: int, stop: int) -> None:
+    """`block` の `[begin, stop)` 行をバケットの集計 `entry` に加える。"""
+    entry["count"] += stop - begin
+    for index, count in Counter(block.data["status"][begin:stop]).items():
+        status = block.statuses[index]
+        entry["status"][status] = entry["status"].get(status, 0) + count
+    for name in NUMERIC_COLUMNS:
+        values = block.data[name][begin:stop]
+        acc = entry[name]
+        acc[0] = min(acc[0], min(values))
+        acc[1] = max(acc[1], max(values))
+        acc[2] += sum(values)
+
+
+class HistoryStore:
+    """固定メモリの実行履歴。`append` は時刻の昇順で呼ぶこと。"""
+
+    def __init__(self, directory: Path, config: Optional[HistoryConfig] = None) -> None:
+        self._directory = directory
+        self._config = config or HistoryConfig()
+        self._lock = threading.Lock()
+        self._buffer = _Columns()
+        self._status_index: Dict[str, int] = {}
+        self._segments: List[Tuple[float, float, Path]] = []
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._scan_locked()
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def _scan_locked(self) -> None:
+        # リロード中は旧世代が終了時に書き出したセグメントが後から現れるため、クエリ毎に取り直す
+        segments = []
+        for path in self._directory.glob(f"*{SEGMENT_SUFFIX}"):
+            span = _parse_segment_name(path)
+            if span is not None:
+                segments.append((*span, path))
+        self._segments = sorted(segments)
+
+    def append(
+        self,
+        timestamp: float,
+        status: str,
+        plan_ms: float = 0.0,
+        schedule_ms: float = 0.0,
+        execute_ms: float = 0.0,
+        total_ms: float = 0.0,
+        priority: int = 0,
+    ) -> None:
+        with self._lock:
+            index = self._status_index.get(status)
+            if index is None:
+                if len(self._buffer.statuses) >= 255:
+                    # status 表は 1 バイトで参照するため、溢れる前に書き出す
+                    self._spill_locked()
+                index = self._status_index[status] = len(self._buffer.statuses)
+                self._buffer.statuses.append(status)
+            values = {
+                "timestamp": timestamp,
+                "plan_ms": plan_ms,
+                "schedule_ms": schedule_ms,
+                "execute_ms": execute_ms,
+                "total_ms": total_ms,
+                "priority": priority,
+                "status": index,
+            }
+            for name, column in self._buffer.data.items():
+                column.append(values[name])
+            if len(self._buffer) >= self._config.capacity:
+                self._spill_locked()
+
+    def flush(self) -> None:
+        """メモリ上の行をセグメントへ書き出す (シャットダウン時など)。"""
+        with self._lock:
+            self._spill_locked()
+
+    def _spill_locked(self) -> None:
+        if not len(self._buffer):
+            return
+        timestamps = self._buffer.data["timestamp"]
+        start, end = timestamps[0], timestamps[-1]
+        path = self._directory / f"{start:.3f}-{end:.3f}{SEGMENT_SUFFIX}"
+        header = {
+            "version": _VERSION,
+            "rows": len(self._buffer),
+            "columns": [[name, code] for name, code in COLUMNS],
+            "statuses": self._buffer.statuses,
+        }
+        tmp = path.with_name(path.name + ".tmp")
+        with tmp.open("wb") as fp:
+            fp.write(json.dumps(header).encode() + b"\n")
+            for name, _ in COLUMNS:
+                self._buffer.data[name].tofile(fp)
+        tmp.replace(path)
+        self._segments.append((start, end, path))
+        self._segments.sort()
+        self._buffer = _Columns()
+        self._status_index = {}
+        self._enforce_budget_locked()
+
+    def _enforce_budget_locked(self) -> None:
+        sizes = []
+        for _, _, path in self._segments:
+            try:
+                sizes.append(path.stat().st_size)
+            except FileNotFoundError:
+                sizes.append(0)
+        total = sum(sizes)
+        while self._segments and total > self._config.max_disk_bytes:
+            _, _, path = self._segments.pop(0)
+            total -= sizes.pop(0)
+            path.unlink(missing_ok=True)
+            logger.info("History segment dropped (disk budget): {}", path.name)
+
+    # --- query ----------------------------------------------------------------
+
+    def _iter_blocks(self, start: float, end: float) -> Iterator[_Columns]:
+        with self._lock:
+            self._scan_locked()
+            segments = [path for seg_start, seg_end, path in self._segments if seg_end >= start and seg_start <= end]
+            buffer = self._buffer
+            buffer_len = len(buffer)
+            snapshot = _Columns(list(buffer.statuses))
+            for name, column in buffer.data.items():
+                snapshot.data[name] = column[:buffer_len]
+        for path in segments:
+            block = _read_segment(path)
+            if block is not None:
+                yield block
+        yield snapshot
+
+    def rows(self, start: float, end: float, limit: int = 1000) -> List[dict]:
+        """範囲内の行を古い順に最大 `limit` 件返す。"""
+        result: List[dict] = []
+        for block in self._iter_blocks(start, end):
+            lo, hi = block.slice_range(start, end)
+            for index in range(lo, hi):
+                if len(result) >= limit:
+                    return result
+                result.append(block.row(index))
+        return result
+
+    def downsample(self, start: float, end: float, buckets: int) -> List[dict]:
+        """範囲を `buckets` 等分し、バケットごとに数値列の min/max/avg と status 件数を返す。
+
+        行の無いバケットは含めない。各ブロックの timestamp は昇順なので、バケット境界の
+        位置を二分探索で求め、境界間の列スライスを min/max/sum でまとめて集計する。
+        """
+        if buckets <= 0 or end <= start:
+            return []
+        width = (end - start) / buckets
+
+        def bucket_of(timestamp: float) -> int:
+            return min(buckets - 1, int((timestamp - start) / width))
+
+        stats: Dict[int, dict] = {}
+        for block in self._iter_blocks(start, end):
+            lo, hi = block.slice_range(start, end)
+            if lo >= hi:
+                continue
+            timestamps = block.data["timestamp"]
+            last = bucket_of(timestamps[hi - 1])
+            begin = lo
+            for bucket in range(bucket_of(timestamps[lo]), last + 1):
+                stop = hi if bucket == last else bisect.bisect_left(timestamps, bucket + 1, begin, hi, key=bucket_of)
+                if stop > begin:
+                    _accumulate(stats.setdefault(bucket, _empty_bucket()), block, begin, stop)
+                begin = stop
+        result = []
+        for bucket in sorted(stats):
+            entry = stats[bucket]
+            count = entry["count"]
+            item = {
+                "start": start + bucket * width,
+                "end": start + (bucket + 1) * width,
+                "count": count,
+                "status": entry["status"],
+            }
+            for name in NUMERIC_COLUMNS:
+                low, high, total = entry[name]
+                item[name] = {"min": low, "max": high, "avg": total / count}
+            result.append(item)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            segments = list(self._segments)
+            buffered = len(self._buffer)
+        disk_bytes = 0
+        for _, _, path in segments:
+            try:
+                disk_bytes += path.stat().st_size
+            except FileNotFoundError:
+                continue
+        return {
+            "buffered_rows": buffered,
+            "capacity": self._config.capacity,
+            "segments": len(segments),
+            "disk_bytes": disk_bytes,
+            "max_disk_bytes": self._config.max_disk_bytes,
+            "oldest": segments[0][0] if segments else None,
+        }
+
+
+def _parse_segment_name(path: Path) -> Optional[Tuple[float, float]]:
+    start, sep, end = path.name[: -len(SEGMENT_SUFFIX)].partition("-")
+    try:
+        return float(start), float(end)
+    except ValueError:
+        return None
+
+
+def _read_segment(path: Path) -> Optional[_Columns]:
+    try:
+        with path.open("rb") as fp:
+            header = json.loads(fp.readline())
+            if header.get("version") != _VERSION:
+                raise ValueError(f"unsupported version {header.get('version')}")
+            rows = header["rows"]
+            block = _Columns(header["statuses"])
+            for name, code in header["columns"]:
+                column = array(code)
+                column.fromfile(fp, rows)
+                block.data[name] = column
+    except (OSError, ValueError, EOFError, KeyError) as exc:
+        # 古い形式や途中で切れたセグメントはクエリ対象から外す
+        logger.error("Failed to read history segment {}: {}", path.name, exc)
+        return None
+    return block
@@ -0,0 +1,24 @@
+"""状態ディレクトリのスナップショット用ロック。
+
+ランタイムは patch メタデータや監査ログを書き込む間、backup は一覧を確定する間だけ
+`<dir>/.snapshot.lock` を flock で排他取得する。
+"""
+
+from __future__ import annotations
+
+import fcntl
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+LOCK_NAME = ".snapshot.lock"
+
+
+@contextmanager
+def snapshot_lock(directory: Path) -> Iterator[None]:
+    with (directory / LOCK_NAME).open("a") as fp:
+        fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
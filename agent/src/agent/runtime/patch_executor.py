@@ -3,9 +3,41 @@
 from __future__ import annotations
 
 import os
+import shutil
 import subprocess
+import threading
+import time
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Callable, Optional
+
+from agent.runtime.apply_cache import (
+    ApplyCache,
+    ApplyCacheKey,
+    CachedOutcome,
+    file_sha256,
+    hook_identity,
+    workspace_revision,
+)
+from agent.runtime.locking import snapshot_lock
+from agent.runtime.workspace_snapshot import (
+    SnapshotConflictError,
+    SnapshotManifest,
+    SnapshotRestoreError,
+    record_applied_state,
+    restore_snapshot,
+    take_snapshot,
+    touched_paths,
+)
+
+
+class ResourcePressureError(RuntimeError):
+    """安全余裕が閾値を下回っているため適用を見送った。"""
+
+    def __init__(self, margin: float, min_margin: float) -> None:
+        super().__init__(f"Deferred: safety margin {margin:.2f} below {min_margin:.2f}")
+        self.margin = margin
+        self.min_margin = min_margin
 
 
 @dataclass(slots=True)
@@ -16,6 +48,8 @@ class ApplyResult:
     command: str
     stdout: str
     stderr: str
+    cached: bool = False
+    snapshot_path: Optional[Path] = None
 
 
 @dataclass(slots=True)
@@ -30,27 +64,64 @@ class RollbackResult:
 class PatchExecutor:
     """Execute patch application logic (placeholder for future git worktree)."""
 
-    def __init__(self, workspace: Path) -> None:
+    def __init__(
+        self,
+        workspace: Path,
+        safety_margin: Optional[Callable[[], float]] = None,
+        min_margin: float = 0.0,
+        cache: Optional[ApplyCache] = None,
+        cache_failures: bool = False,
+    ) -> None:
         self._workspace = workspace
+        self._safety_margin = safety_margin
+        self._min_margin = min_margin
+        self._cache = cache
+        self._cache_failures = cache_failures
+        # apply はスレッドから呼ばれるため、同じワークスペースでの hook・書き戻しを直列化する
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self) -> Optional[ApplyCache]:
+        return self._cache
 
-    def apply(self, patch_id: str, artifact_path: Path) -> ApplyResult:
+    def apply(
+        self,
+        patch_id: str,
+        artifact_path: Path,
+        use_cache: bool = True,
+        snapshot_dir: Optional[Path] = None,
+    ) -> ApplyResult:
+        """hook を実行して適用結果を返す。
+
+        同じアーティファクト・ワークスペース HEAD・hook の組み合わせで成功済み
+        (`cache_failures=True` なら失敗も) の場合は hook を実行せずキャッシュを返す。
+        キャッシュするのはワークスペースを変更しなかった (検証だけを行った) hook の
+        結果だけで、ワークスペースへ適用する hook は毎回実行する。
+        `use_cache=False` はキャッシュを参照せずに実行し、結果で上書きする。
+        `snapshot_dir` を渡すと hook 実行前に diff が触るファイルをそこへ退避し、成功後に
+        適用直後のハッシュを記録する。hook が失敗・例外で終わった場合、その退避は削除する。
+        """
+        if self._safety_margin is not None:
+            margin = self._safety_margin()
+            if margin < self._min_margin:
+                raise ResourcePressureError(margin, self._min_margin)
         hook = os.environ.get("PATCH_APPLY_HOOK")
         if hook:
-            completed = subprocess.run(
-                [hook, patch_id, str(artifact_path)],
-                cwd=self._workspace,
-                capture_output=True,
-                text=True,
-            )
-            detail = completed.stdout.strip() or completed.stderr.strip() or "hook executed"
-            return ApplyResult(
-                completed.returncode == 0,
-                detail,
-                artifact_path,
-                command=hook,
-                stdout=completed.stdout,
-                stderr=completed.stderr,
-            )
+            with self._lock:
+                try:
+                    result = self._apply_hook(hook, patch_id, artifact_path, use_cache, snapshot_dir)
+                except BaseException:
+                    self._discard_snapshot(snapshot_dir)
+                    raise
+                if not result.ok:
+                    # 適用されなかったので書き戻す対象も無い。残すと次の backup に不要な退避が載る
+                    self._discard_snapshot(snapshot_dir)
+                    result.snapshot_path = None
+                elif snapshot_dir is not None:
+                    # rollback 時に適用後の変更を上書きしないよう、適用直後の内容を記録しておく
+                    with snapshot_lock(snapshot_dir.parent):
+                        record_applied_state(snapshot_dir, self._workspace)
+            return result
 
         mode = os.environ.get("PATCH_APPLY_MODE", "noop").lower().strip()
         if mode == "fail":
@@ -71,8 +142,130 @@ class PatchExecutor:
             stderr="",
         )
 
-    def rollback(self, patch_id: str) -> RollbackResult:
+    def _apply_hook(
+        self,
+        hook: str,
+        patch_id: str,
+        artifact_path: Path,
+        use_cache: bool,
+        snapshot_dir: Optional[Path],
+    ) -> ApplyResult:
+        key = self._cache_key(hook, artifact_path)
+        if snapshot_dir is not None:
+            # backup が書き込み途中の退避を読まないよう、保存先ディレクトリのロックを取る
+            snapshot_dir.parent.mkdir(parents=True, exist_ok=True)
+            with snapshot_lock(snapshot_dir.parent):
+                take_snapshot(patch_id, self._workspace, touched_paths(artifact_path), snapshot_dir)
+        if key is not None and use_cache:
+            cached = self._cache.get(key)
+            if cached is not None:
+                return ApplyResult(
+                    cached.ok,
+                    cached.detail,
+                    artifact_path,
+                    command=cached.command,
+                    stdout=cached.stdout,
+                    stderr=cached.stderr,
+                    cached=True,
+                    snapshot_path=snapshot_dir,
+                )
+        completed = subprocess.run(
+            [hook, patch_id, str(artifact_path)],
+            cwd=self._workspace,
+            capture_output=True,
+            text=True,
+        )
+        detail = completed.stdout.strip() or completed.stderr.strip() or "hook executed"
+        result = ApplyResult(
+            completed.returncode == 0,
+            detail,
+            artifact_path,
+            command=hook,
+            stdout=completed.stdout,
+            stderr=completed.stderr,
+            snapshot_path=snapshot_dir,
+        )
+        if (
+            key is not None
+            and (result.ok or self._cache_failures)
+            # hook がコミットや未コミットの変更を残した場合、キャッシュで省略すると適用自体が抜ける
+            and workspace_revision(self._workspace) == key.revision
+        ):
+            self._cache.put(
+                key,
+                CachedOutcome(
+                    ok=result.ok,
+                    detail=result.detail,
+                    command=result.command,
+                    stdout=result.stdout,
+                    stderr=result.stderr,
+                    created_at=time.time(),
+                ),
+            )
+        return result
+
+    @staticmethod
+    def _discard_snapshot(snapshot_dir: Optional[Path]) -> None:
+        if snapshot_dir is None or not snapshot_dir.exists():
+            return
+        with snapshot_lock(snapshot_dir.parent):
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+    def _cache_key(self, hook: str, artifact_path: Path) -> Optional[ApplyCacheKey]:
+        if self._cache is None:
+            return None
+        revision = workspace_revision(self._workspace)
+        if revision is None:
+            # HEAD が特定できない (git 管理外・未コミットの変更あり) 場合は毎回実行する
+            return None
+        return ApplyCacheKey(file_sha256(artifact_path), revision, hook_identity(hook))
+
+    def rollback(
+        self,
+        patch_id: str,
+        snapshot_dir: Optional[Path] = None,
+        artifact_path: Optional[Path] = None,
+    ) -> RollbackResult:
+        """適用前スナップショットがあればプロセス内で書き戻し、無ければ rollback hook を使う。
+
+        適用後に対象ファイルが変更されていた場合は書き戻さず、`PATCH_ROLLBACK_HOOK` があれば
+        それに任せて競合を detail に添え、無ければ失敗として返す。
+
+        成功時は `artifact_path` の適用結果キャッシュも破棄し、再適用で hook が必ず実行されるようにする。
+        """
+        with self._lock:
+            result = self._rollback(patch_id, snapshot_dir)
+        if result.ok and self._cache is not None and artifact_path is not None and artifact_path.exists():
+            self._cache.invalidate_artifact(file_sha256(artifact_path))
+        return result
+
+    def _rollback(self, patch_id: str, snapshot_dir: Optional[Path]) -> RollbackResult:
+        conflict: Optional[SnapshotConflictError] = None
+        if snapshot_dir is not None and SnapshotManifest.load(snapshot_dir) is not None:
+            try:
+                with snapshot_lock(snapshot_dir.parent):
+                    manifest = restore_snapshot(snapshot_dir, self._workspace)
+            except SnapshotConflictError as exc:
+                conflict = exc
+            except (SnapshotRestoreError, OSError) as exc:
+                return RollbackResult(False, f"Snapshot restore failed: {exc}", command="snapshot", stdout="", stderr="")
+            else:
+                return RollbackResult(
+                    True,
+                    f"Restored {len(manifest.entries)} files from pre-apply snapshot",
+                    command="snapshot",
+                    stdout="\n".join(entry.path for entry in manifest.entries),
+                    stderr="",
+                )
         hook = os.environ.get("PATCH_ROLLBACK_HOOK")
+        if conflict is not None and not hook:
+            return RollbackResult(
+                False,
+                f"Rollback refused: {conflict}",
+                command="snapshot",
+                stdout="\n".join(conflict.paths),
+                stderr="",
+            )
         if hook:
             completed = subprocess.run(
                 [hook, patch_id],
@@ -81,6 +274,8 @@ class PatchExecutor:
                 text=True,
             )
             detail = completed.stdout.strip() or completed.stderr.strip() or "rollback executed"
+            if conflict is not None:
+                detail = f"Snapshot conflict ({conflict}); used rollback hook: {detail}"
             return RollbackResult(
                 completed.returncode == 0,
                 detail,
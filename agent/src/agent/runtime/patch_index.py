@@ -0,0 +1,176 @@
+"""パッチ一覧のソート済みインデックスとページング。
+
+`PatchIndex` は patch_id → PendingPatch の辞書に加えて、ソート可能な列ごとに
+`(sort_value, patch_id)` のソート済みリストを保持する。一覧 API はこのリストを
+bisect で辿るため、件数が増えても全件ソートは発生しない。
+"""
+
+from __future__ import annotations
+
+import base64
+import bisect
+import datetime as dt
+import json
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from agent.runtime.app import PendingPatch
+
+SORT_FIELDS = ("created_at", "author", "patch_id")
+
+
+def normalize_timestamp(value: str) -> str:
+    """ISO8601 文字列を UTC に正規化し、辞書順で時系列比較できる形にする。
+
+    解釈できない値はそのまま返す。
+    """
+    try:
+        parsed = dt.datetime.fromisoformat(value)
+    except ValueError:
+        return value
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=dt.timezone.utc)
+    return parsed.astimezone(dt.timezone.utc).isoformat()
+
+
+_SORT_KEYS: Dict[str, Callable[["PendingPatch"], str]] = {
+    "created_at": lambda patch: normalize_timestamp(patch.created_at),
+    "author": lambda patch: patch.author,
+    "patch_id": lambda patch: patch.patch_id,
+}
+
+
+@dataclass(slots=True)
+class PatchQuery:
+    """一覧 API のクエリ条件。"""
+
+    sort: str = "created_at"
+    descending: bool = False
+    limit: Optional[int] = None
+    cursor: Optional[str] = None
+    author: Optional[str] = None
+    created_after: Optional[str] = None
+    created_before: Optional[str] = None
+
+    def validate(self) -> None:
+        if self.sort not in SORT_FIELDS:
+            raise ValueError(f"Unsupported sort field: {self.sort}")
+        if self.limit is not None and self.limit <= 0:
+            raise ValueError("limit must be positive")
+
+
+@dataclass(slots=True)
+class PatchPage:
+    items: List["PendingPatch"]
+    next_cursor: Optional[str]
+
+
+def encode_cursor(sort: str, value: str, patch_id: str) -> str:
+    raw = json.dumps([sort, value, patch_id], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[str, str]:
+    try:
+        cursor_sort, value, patch_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+    # 不正な cursor で比較時に TypeError にならないよう、ここで型と列名を確かめる
+    if cursor_sort not in SORT_FIELDS or not isinstance(value, str) or not isinstance(patch_id, str):
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort:
+        raise ValueError("Cursor was issued for a different sort field")
+    return value, patch_id
+
+
+class PatchIndex:
+    """挿入順の辞書と列ごとのソート済みインデックスを持つパッチ集合。"""
+
+    def __init__(self) -> None:
+        self._patches: Dict[str, "PendingPatch"] = {}
+        self._sorted: Dict[str, List[Tuple[str, str]]] = {name: [] for name in SORT_FIELDS}
+
+    def __len__(self) -> int:
+        return len(self._patches)
+
+    def __contains__(self, patch_id: object) -> bool:
+        return patch_id in self._patches
+
+    def __iter__(self) -> Iterator["PendingPatch"]:
+        return iter(self._patches.values())
+
+    def values(self) -> List["PendingPatch"]:
+        return list(self._patches.values())
+
+    def get(self, patch_id: str) -> Optional["PendingPatch"]:
+        return self._patches.get(patch_id)
+
+    def add(self, patch: "PendingPatch") -> None:
+        if patch.patch_id in self._patches:
+            self.pop(patch.patch_id)
+        self._patches[patch.patch_id] = patch
+        for name, key in _SORT_KEYS.items():
+            bisect.insort(self._sorted[name], (key(patch), patch.patch_id))
+
+    def pop(self, patch_id: str) -> Optional["PendingPatch"]:
+        patch = self._patches.pop(patch_id, None)
+        if patch is None:
+            return None
+        for name, key in _SORT_KEYS.items():
+            column = self._sorted[name]
+            position = bisect.bisect_left(column, (key(patch), patch_id))
+            if position < len(column) and column[position] == (key(patch), patch_id):
+                del column[position]
+        return patch
+
+    def query(self, query: PatchQuery) -> PatchPage:
+        query.validate()
+        column = self._sorted[query.sort]
+
+        # ソート列と同じ条件はインデックス上の範囲に絞り込む
+        low, high = 0, len(column)
+        if query.sort == "author" and query.author is not None:
+            low = bisect.bisect_left(column, (query.author, ""))
+            high = bisect.bisect_left(column, (query.author + "\0", ""))
+        elif query.sort == "created_at":
+            if query.created_after is not None:
+                low = bisect.bisect_left(column, (normalize_timestamp(query.created_after), ""))
+            if query.created_before is not None:
+                high = bisect.bisect_left(column, (normalize_timestamp(query.created_before), ""))
+
+        if query.cursor is not None:
+            position = decode_cursor(query.cursor, query.sort)
+            if query.descending:
+                high = min(high, bisect.bisect_left(column, position))
+            else:
+                low = max(low, bisect.bisect_right(column, position))
+
+        indices = range(high - 1, low - 1, -1) if query.descending else range(low, high)
+        items: List["PendingPatch"] = []
+        last: Optional[Tuple[str, str]] = None
+        has_more = False
+        for index in indices:
+            patch = self._patches[column[index][1]]
+            if not self._matches(patch, query):
+                continue
+            if query.limit is not None and len(items) >= query.limit:
+                has_more = True
+                break
+            items.append(patch)
+            last = column[index]
+
+        next_cursor = encode_cursor(query.sort, *last) if has_more and last is not None else None
+        return PatchPage(items=items, next_cursor=next_cursor)
+
+    @staticmethod
+    def _matches(patch: "PendingPatch", query: PatchQuery) -> bool:
+        if query.author is not None and patch.author != query.author:
+            return False
+        if query.created_after is not None or query.created_before is not None:
+            created = normalize_timestamp(patch.created_at)
+            if query.created_after is not None and created < normalize_timestamp(query.created_after):
+                return False
+            if query.created_before is not None and created >= normalize_timestamp(query.created_before):
+                return False
+        return True
@@ -0,0 +1,178 @@
+"""共有ストアから GET を返す read worker 用 API。
+
+writer プロセスが `StateStore` に publish した状態を返し、状態が古すぎる場合や
+変更系リクエストは writer へ転送する。uvicorn の `workers=N` で複数起動する想定。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Callable, Literal, Optional
+
+import httpx
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import Response
+from loguru import logger
+
+from agent.runtime.app import APPLIED_COLLECTION, PENDING_COLLECTION, AuditLogIndex, RuntimeConfig
+from agent.runtime.server import audit_response, mount_ui
+from agent.runtime.state_store import StateStore
+
+_FORWARDED_HEADERS = ("content-type", "accept")
+# 転送した変更系リクエストは apply の hook (テスト実行) を待つため読み取りの上限を設けない
+_MUTATION_TIMEOUT = httpx.Timeout(30.0, read=None)
+_HEARTBEAT_KEY = "status_compact"
+
+
+def _with_patch_lists(status: bytes, pending: bytes, applied: bytes) -> bytes:
+    """`status_compact` の JSON オブジェクトにパッチ一覧を連結して `/status` の形にする。"""
+    return status[:-1] + b',"pending_patches":' + pending + b',"applied_patches":' + applied + b"}"
+
+
+def create_reader_app(
+    config: RuntimeConfig,
+    writer_url: str,
+    client: Optional[httpx.AsyncClient] = None,
+) -> FastAPI:
+    if config.state_store_path is None:
+        raise ValueError("YAMADA_STATE_STORE must be set for read workers")
+
+    store = StateStore(config.state_store_path)
+    audit_index = AuditLogIndex(config.patch_storage_dir / "audit.log")
+    owns_client = client is None
+    writer = client or httpx.AsyncClient(base_url=writer_url, timeout=30)
+
+    @asynccontextmanager
+    async def lifespan(_: FastAPI):
+        try:
+            yield
+        finally:
+            if owns_client:
+                await writer.aclose()
+            store.close()
+
+    app = FastAPI(lifespan=lifespan)
+
+    async def forward(request: Request) -> Response:
+        timeout = writer.timeout if request.method in ("GET", "HEAD") else _MUTATION_TIMEOUT
+        try:
+            upstream = await writer.request(
+                request.method,
+                request.url.path,
+                params=request.query_params,
+                content=await request.body(),
+                headers={name: request.headers[name] for name in _FORWARDED_HEADERS if name in request.headers},
+                timeout=timeout,
+            )
+        except httpx.HTTPError as exc:
+            logger.error("Writer request failed: {}", exc)
+            raise HTTPException(status_code=503, detail="Runtime writer unavailable") from exc
+        headers = {"X-Next-Cursor": upstream.headers["x-next-cursor"]} if "x-next-cursor" in upstream.headers else None
+        return Response(
+            content=upstream.content,
+            status_code=upstream.status_code,
+            media_type=upstream.headers.get("content-type"),
+            headers=headers,
+        )
+
+    async def read_fresh(*collections: str) -> tuple[dict, bool]:
+        """集合と一緒に writer の heartbeat を読み、writer が最近 publish しているかを返す。
+
+        パッチ一覧は変わったときにしか書かれないため、鮮度は毎イテレーション書かれる
+        `status_compact` の更新時刻で判断する。heartbeat は最初の publish で集合と同時に
+        書かれるので、heartbeat があれば集合も揃っている。SQLite の読み出しは writer の
+        書き込みやパッチ数に応じて待つことがあるため、ループの外で行う。
+        """
+        stored = await asyncio.to_thread(store.read_many, (_HEARTBEAT_KEY,), collections)
+        heartbeat = stored.get(_HEARTBEAT_KEY)
+        fresh = heartbeat is not None and heartbeat.age() <= config.state_max_staleness_seconds
+        return stored, fresh
+
+    async def serve_or_forward(request: Request, payload: Callable[[dict], bytes], *collections: str) -> Response:
+        stored, fresh = await read_fresh(*collections)
+        if fresh:
+            return Response(content=payload(stored), media_type="application/json")
+        try:
+            return await forward(request)
+        except HTTPException:
+            if _HEARTBEAT_KEY not in stored:
+                raise
+            # writer が落ちている間は古い状態でも返す
+            return Response(content=payload(stored), media_type="application/json")
+
+    async def read_or_forward(collection: str, request: Request) -> Response:
+        if request.query_params:
+            # ページング・射影付きの一覧はインデックスを持つ writer が処理する
+            return await forward(request)
+        return await serve_or_forward(request, lambda stored: stored[collection].payload, collection)
+
+    @app.get("/healthz")
+    async def health() -> dict[str, str]:
+        return {"status": "ok"}
+
+    @app.get("/status")
+    async def status(request: Request, compact: bool = Query(False)) -> Response:
+        if compact:
+            return await serve_or_forward(request, lambda stored: stored[_HEARTBEAT_KEY].payload)
+        return await serve_or_forward(
+            request,
+            lambda stored: _with_patch_lists(
+                stored[_HEARTBEAT_KEY].payload, stored[PENDING_COLLECTION].payload, stored[APPLIED_COLLECTION].payload
+            ),
+            PENDING_COLLECTION,
+            APPLIED_COLLECTION,
+        )
+
+    @app.get("/patches/applied")
+    async def list_applied(request: Request) -> Response:
+        return await read_or_forward(APPLIED_COLLECTION, request)
+
+    @app.get("/patches/audit")
+    async def audit_log(
+        offset: int = Query(0, ge=0),
+        limit: Optional[int] = Query(None, ge=1, le=1000),
+        order: Literal["asc", "desc"] = Query("asc"),
+    ) -> Response:
+        entries, total = await asyncio.to_thread(audit_index.page, offset, limit, order == "desc")
+        return audit_response(entries, total)
+
+    @app.get("/patches")
+    async def list_patches(request: Request) -> Response:
+        return await read_or_forward(PENDING_COLLECTION, request)
+
+    @app.get("/history")
+    async def history(request: Request) -> Response:
+        # 履歴は writer プロセスのメモリ上にあるため転送する
+        return await forward(request)
+
+    @app.get("/patches/{patch_id}/diff")
+    async def get_patch_diff(patch_id: str, request: Request) -> Response:
+        # diff プレビューは共有ストアに載せていないので writer から取得する
+        return await forward(request)
+
+    @app.get("/patches/{patch_id}")
+    async def get_patch(patch_id: str, request: Request) -> Response:
+        _, fresh = await read_fresh()
+        if not fresh:
+            return await forward(request)
+        patch = await asyncio.to_thread(store.read_member, PENDING_COLLECTION, patch_id)
+        if patch is None:
+            raise HTTPException(status_code=404, detail="Patch not found")
+        return Response(content=patch.payload, media_type="application/json")
+
+    mount_ui(app)
+
+    @app.api_route("/{path:path}", methods=["POST", "PUT", "PATCH", "DELETE"])
+    async def mutate(path: str, request: Request) -> Response:
+        return await forward(request)
+
+    return app
+
+
+def create_reader_app_from_env() -> FastAPI:
+    """uvicorn の factory として使うエントリ。"""
+    config = RuntimeConfig.from_env(os.environ)
+    writer_url = os.environ.get("RUNTIME_WRITER_URL", "http://127.0.0.1:8081")
+    return create_reader_app(config, writer_url)
@@ -3,18 +3,24 @@
 from __future__ import annotations
 
 import asyncio
+import time
 from contextlib import asynccontextmanager
-from dataclasses import asdict
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List
+from typing import List, Literal, Optional
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response
 from fastapi.staticfiles import StaticFiles
 from loguru import logger
 from pydantic import BaseModel, Field
 
+from agent.runtime import encoding
 from agent.runtime.app import PendingPatch, RuntimeApp
+from agent.runtime.artifacts import ArtifactFetchError
+from agent.runtime.handoff import ReloadInProgressError, ReloadUnavailableError
+from agent.runtime.patch_executor import ResourcePressureError
+from agent.runtime.patch_index import PatchPage, PatchQuery
 
 
 class PatchPayload(BaseModel):
@@ -25,6 +31,7 @@ class PatchPayload(BaseModel):
     artifact_uri: str = Field(..., description="パッチファイルの URI (volume/S3 など)")
     test_report_uri: str | None = Field(None, description="テストレポートへのリンク")
     notes: str | None = Field(None, description="補足メモ")
+    artifact_sha256: str | None = Field(None, description="アーティファクトの SHA-256 (指定時は取得後に検証)")
 
 
 class PatchResponse(BaseModel):
@@ -36,6 +43,75 @@ class PatchResponse(BaseModel):
     test_report_uri: str | None = None
     notes: str | None = None
     artifact_local_path: str | None = None
+    artifact_sha256: str | None = None
+    bundle_manifest: dict | None = None
+
+
+PROJECTABLE_FIELDS = frozenset(PatchResponse.model_fields) | {"diff_preview"}
+
+
+@dataclass(slots=True)
+class PatchListParams:
+    """`/patches` と `/patches/applied` 共通のページング・ソート・射影パラメータ。"""
+
+    query: PatchQuery
+    fields: Optional[List[str]] = None
+
+
+def patch_list_params(
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="1 ページの件数 (省略時は全件)"),
+    cursor: Optional[str] = Query(None, description="前ページの X-Next-Cursor"),
+    sort: Literal["created_at", "author", "patch_id"] = Query("created_at"),
+    order: Literal["asc", "desc"] = Query("asc"),
+    author: Optional[str] = Query(None),
+    created_after: Optional[str] = Query(None, description="この時刻以降 (含む)"),
+    created_before: Optional[str] = Query(None, description="この時刻より前"),
+    fields: Optional[str] = Query(None, description="返すフィールドをカンマ区切りで指定"),
+) -> PatchListParams:
+    query = PatchQuery(
+        sort=sort,
+        descending=order == "desc",
+        limit=limit,
+        cursor=cursor,
+        author=author,
+        created_after=created_after,
+        created_before=created_before,
+    )
+    if not fields:
+        return PatchListParams(query=query)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = sorted(set(names) - PROJECTABLE_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return PatchListParams(query=query, fields=names)
+
+
+def _patch_list_response(page: PatchPage, fields: Optional[List[str]] = None) -> Response:
+    # 射影なしの場合は PendingPatch がキャッシュしたエンコード済み JSON を連結して返す (pydantic 検証は通さない)
+    if fields is None:
+        content = encoding.join_array(patch.to_response_json() for patch in page.items)
+    else:
+        content = encoding.dumps([{name: getattr(patch, name) for name in fields} for patch in page.items])
+    headers = {"X-Next-Cursor": page.next_cursor} if page.next_cursor else None
+    return Response(content=content, media_type="application/json", headers=headers)
+
+
+def audit_response(entries: List[dict], total: int) -> Response:
+    return Response(
+        content=encoding.dumps(entries),
+        media_type="application/json",
+        headers={"X-Total-Count": str(total)},
+    )
+
+
+def mount_ui(app: FastAPI) -> None:
+    static_dir = Path(__file__).resolve().parents[4] / "webui" / "static"
+    if static_dir.exists():
+        app.mount("/ui/static", StaticFiles(directory=static_dir), name="ui-static")
+
+        @app.get("/ui", response_class=HTMLResponse)
+        async def ui_index() -> str:
+            return static_dir.joinpath("index.html").read_text(encoding="utf-8")
 
 
 def create_app(runtime: RuntimeApp) -> FastAPI:
@@ -51,32 +127,88 @@ def create_app(runtime: RuntimeApp) -> FastAPI:
 
     app = FastAPI(lifespan=lifespan)
 
+    @app.middleware("http")
+    async def guard_mutations(request: Request, call_next) -> Response:
+        # リロード中の変更は次の世代へ引き継がれないため、受け付けずに再試行させる
+        if request.method in ("GET", "HEAD", "OPTIONS"):
+            return await call_next(request)
+        try:
+            async with runtime.mutation():
+                return await call_next(request)
+        except ReloadInProgressError as exc:
+            return JSONResponse({"detail": str(exc)}, status_code=503, headers={"Retry-After": "1"})
+
     @app.get("/healthz")
     async def health() -> dict[str, str]:
         return {"status": "ok"}
 
     @app.get("/status")
-    async def status() -> dict:
-        return runtime.snapshot()
+    async def status(compact: bool = Query(False, description="パッチ一覧を省き件数のみ返す")) -> dict:
+        return runtime.snapshot(include_patches=not compact)
+
+    @app.get("/drive")
+    async def drive(samples: int = Query(0, ge=0, le=3600, description="直近サンプルを新しい順に返す件数")) -> dict:
+        payload = runtime.sampler.status()
+        if samples:
+            payload["recent"] = runtime.sampler.recent(samples)
+        return payload
+
+    @app.get("/history")
+    async def history(
+        start: Optional[float] = Query(None, description="UNIX 秒。省略時は end の 1 時間前"),
+        end: Optional[float] = Query(None, description="UNIX 秒。省略時は現在"),
+        buckets: int = Query(120, ge=0, le=2000, description="集約するバケット数。0 なら生の行を返す"),
+        limit: int = Query(1000, ge=1, le=10000, description="buckets=0 のときの最大行数"),
+    ) -> dict:
+        end = time.time() if end is None else end
+        start = end - 3600 if start is None else start
+        if start > end:
+            raise HTTPException(status_code=400, detail="start must not be after end")
+        store = runtime.history
+        if buckets == 0:
+            rows = await asyncio.to_thread(store.rows, start, end, limit)
+            return {"start": start, "end": end, "rows": rows}
+        series = await asyncio.to_thread(store.downsample, start, end, buckets)
+        return {"start": start, "end": end, "buckets": series, "store": store.stats()}
 
     @app.get("/patches/applied", response_model=List[PatchResponse])
-    async def list_applied() -> List[PatchResponse]:
-        return [PatchResponse(**asdict(patch)) for patch in runtime.list_applied_patches()]
+    async def list_applied(params: PatchListParams = Depends(patch_list_params)) -> Response:
+        try:
+            page = runtime.query_applied_patches(params.query)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc)) from exc
+        return _patch_list_response(page, params.fields)
 
     @app.get("/patches/audit", response_model=List[dict])
-    async def audit_log() -> List[dict]:
-        return runtime.iter_audit_log()
+    async def audit_log(
+        offset: int = Query(0, ge=0),
+        limit: Optional[int] = Query(None, ge=1, le=1000),
+        order: Literal["asc", "desc"] = Query("asc"),
+    ) -> Response:
+        entries, total = await asyncio.to_thread(runtime.audit_page, offset, limit, order == "desc")
+        return audit_response(entries, total)
 
     @app.get("/patches", response_model=List[PatchResponse])
-    async def list_patches() -> List[PatchResponse]:
-        return [PatchResponse(**asdict(patch)) for patch in runtime.list_patches()]
+    async def list_patches(params: PatchListParams = Depends(patch_list_params)) -> Response:
+        try:
+            page = runtime.query_patches(params.query)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc)) from exc
+        return _patch_list_response(page, params.fields)
+
+    @app.get("/patches/{patch_id}/diff", response_class=PlainTextResponse)
+    async def get_patch_diff(patch_id: str) -> str:
+        patch = runtime.get_patch(patch_id) or runtime.get_applied_patch(patch_id)
+        if patch is None:
+            raise HTTPException(status_code=404, detail="Patch not found")
+        return patch.diff_preview or ""
 
     @app.get("/patches/{patch_id}", response_model=PatchResponse)
-    async def get_patch(patch_id: str) -> PatchResponse:
+    async def get_patch(patch_id: str) -> Response:
         patch = runtime.get_patch(patch_id)
         if patch is None:
             raise HTTPException(status_code=404, detail="Patch not found")
-        return PatchResponse(**asdict(patch))
+        return Response(content=patch.to_response_json(), media_type="application/json")
 
     @app.post("/control/pause", status_code=202)
     async def pause() -> dict[str, str]:
@@ -88,13 +220,15 @@ def create_app(runtime: RuntimeApp) -> FastAPI:
         runtime.resume()
         return {"status": "running"}
 
-    static_dir = Path(__file__).resolve().parents[4] / "webui" / "static"
-    if static_dir.exists():
-        app.mount("/ui/static", StaticFiles(directory=static_dir), name="ui-static")
+    @app.post("/control/reload", status_code=202)
+    async def reload() -> dict[str, str]:
+        try:
+            runtime.request_reload()
+        except ReloadUnavailableError as exc:
+            raise HTTPException(status_code=409, detail=str(exc)) from exc
+        return {"status": "reloading"}
 
-        @app.get("/ui", response_class=HTMLResponse)
-        async def ui_index() -> str:
-            return static_dir.joinpath("index.html").read_text(encoding="utf-8")
+    mount_ui(app)
 
     @app.post("/patches", status_code=202)
     async def receive_patch(payload: PatchPayload) -> dict[str, str]:
@@ -103,49 +237,62 @@ def create_app(runtime: RuntimeApp) -> FastAPI:
         if runtime.has_patch(payload.patch_id):
             raise HTTPException(status_code=409, detail="Patch already queued")
 
-        runtime.enqueue_patch(
-            PendingPatch(
-                patch_id=payload.patch_id,
-                summary=payload.summary,
-                author=payload.author,
-                created_at=payload.created_at,
-                artifact_uri=payload.artifact_uri,
-                test_report_uri=payload.test_report_uri,
-                notes=payload.notes,
+        # prefetch タスクもこのコンテキストを引き継ぐため、以降のログに patch_id が付く
+        with logger.contextualize(patch_id=payload.patch_id):
+            runtime.enqueue_patch(
+                PendingPatch(
+                    patch_id=payload.patch_id,
+                    summary=payload.summary,
+                    author=payload.author,
+                    created_at=payload.created_at,
+                    artifact_uri=payload.artifact_uri,
+                    test_report_uri=payload.test_report_uri,
+                    notes=payload.notes,
+                    artifact_sha256=payload.artifact_sha256,
+                )
             )
-        )
         return {"status": "queued"}
 
     @app.post("/patches/{patch_id}/apply", status_code=202)
-    async def apply_patch(patch_id: str) -> dict[str, str]:
+    async def apply_patch(
+        patch_id: str,
+        refresh: bool = Query(False, description="適用結果キャッシュを使わず hook を再実行する"),
+    ) -> dict:
         if not runtime.is_paused():
             raise HTTPException(status_code=409, detail="Pause runtime before applying patches")
 
         try:
-            result = runtime.apply_patch(patch_id)
+            with logger.contextualize(patch_id=patch_id):
+                result = await runtime.apply_patch(patch_id, use_cache=not refresh)
         except KeyError as exc:
             raise HTTPException(status_code=404, detail="Patch not found") from exc
         except FileNotFoundError as exc:
             raise HTTPException(status_code=404, detail=f"Artifact not found: {exc}") from exc
         except ValueError as exc:
             raise HTTPException(status_code=400, detail=str(exc)) from exc
+        except ArtifactFetchError as exc:
+            raise HTTPException(status_code=502, detail=str(exc)) from exc
+        except ResourcePressureError as exc:
+            raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": "30"}) from exc
 
-        logger.info("Apply patch requested: %s", patch_id)
+        logger.bind(patch_id=patch_id).info("Apply patch requested: {}", patch_id)
         return {
             "status": "apply_success" if result.ok else "apply_failed",
             "patch_id": patch_id,
             "detail": result.detail,
             "artifact_path": str(result.artifact_path),
+            "cached": result.cached,
         }
 
     @app.post("/patches/{patch_id}/rollback", status_code=202)
     async def rollback_patch(patch_id: str) -> dict[str, str]:
         try:
-            result = runtime.rollback_patch(patch_id)
+            with logger.contextualize(patch_id=patch_id):
+                result = runtime.rollback_patch(patch_id)
         except KeyError as exc:
             raise HTTPException(status_code=404, detail="Patch not found") from exc
 
-        logger.info("Rollback requested: %s", patch_id)
+        logger.bind(patch_id=patch_id).info("Rollback requested: {}", patch_id)
         return {
             "status": "rollback_success" if result.ok else "rollback_failed",
             "patch_id": patch_id,
@@ -0,0 +1,169 @@
+"""プロセス間でランタイム状態を共有する SQLite (WAL) ストア。
+
+writer プロセス (RuntimeApp を保持しループとパッチ変更を担当) が状態を publish し、
+複数の read worker が GET エンドポイントをこのストアから返す。
+
+単一の値はキーごとの `state` に、パッチ一覧のような集合は要素ごとの行を持つ
+`members` に保存する。集合は変わった要素の行だけを書き換え、読み出し時に `seq` 順に
+連結して JSON 配列にする。
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Iterable, Optional, Tuple
+
+from agent.runtime import encoding
+
+
+@dataclass(slots=True)
+class StoredState:
+    """ストアから読み出した 1 キー分の状態。"""
+
+    key: str
+    payload: bytes
+    updated_at: float
+
+    def age(self, now: Optional[float] = None) -> float:
+        return (time.time() if now is None else now) - self.updated_at
+
+    def json(self) -> Any:
+        return json.loads(self.payload)
+
+
+class StateStore:
+    """キーごとに JSON エンコード済みの状態を保持する単純な KV ストア。"""
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            " key TEXT PRIMARY KEY,"
+            " payload BLOB NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS members ("
+            " collection TEXT NOT NULL,"
+            " id TEXT NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " payload BLOB NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (collection, id))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS members_order ON members (collection, seq)")
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def publish(self, key: str, payload: Any) -> None:
+        """payload が bytes の場合はエンコード済み JSON としてそのまま保存する。"""
+        self.publish_many({key: payload})
+
+    def publish_many(
+        self,
+        items: dict[str, Any],
+        remove: Iterable[str] = (),
+        members: Iterable[Tuple[str, str, int, bytes]] = (),
+        remove_members: Iterable[Tuple[str, str]] = (),
+        reset: Iterable[str] = (),
+    ) -> None:
+        """複数キーの書き込みと `remove` の削除を 1 トランザクションで行う。
+
+        `members` は `(collection, id, seq, payload)` の upsert、`remove_members` は
+        `(collection, id)` の削除。`reset` に挙げた集合は先に空にする。
+        """
+        now = time.time()
+        rows = [
+            (key, value if isinstance(value, bytes) else encoding.dumps(value), now)
+            for key, value in items.items()
+        ]
+        member_rows = [(collection, member_id, seq, payload, now) for collection, member_id, seq, payload in members]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany("DELETE FROM members WHERE collection = ?", [(name,) for name in reset])
+                self._conn.executemany(
+                    "INSERT INTO state (key, payload, updated_at) VALUES (?, ?, ?)"
+                    " ON CONFLICT(key) DO UPDATE SET payload=excluded.payload, updated_at=excluded.updated_at",
+                    rows,
+                )
+                self._conn.executemany("DELETE FROM state WHERE key = ?", [(key,) for key in remove])
+                self._conn.executemany(
+                    "INSERT INTO members (collection, id, seq, payload, updated_at) VALUES (?, ?, ?, ?, ?)"
+                    " ON CONFLICT(collection, id) DO UPDATE SET"
+                    " seq=excluded.seq, payload=excluded.payload, updated_at=excluded.updated_at",
+                    member_rows,
+                )
+                self._conn.executemany("DELETE FROM members WHERE collection = ? AND id = ?", list(remove_members))
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def read(self, key: str) -> Optional[StoredState]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, updated_at FROM state WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return StoredState(key=key, payload=bytes(row[0]), updated_at=float(row[1]))
+
+    def read_many(self, keys: Iterable[str], collections: Iterable[str] = ()) -> dict[str, StoredState]:
+        """同じ時点の複数キーと集合を読む。存在しないキーは含めない。
+
+        集合は `seq` 順の JSON 配列として集合名のキーに入る (要素が無ければ `[]`)。
+        """
+        keys = list(keys)
+        placeholders = ",".join("?" for _ in keys)
+        with self._lock:
+            # 複数の SELECT が同じスナップショットを読むよう 1 つの読み取りトランザクションにする
+            self._conn.execute("BEGIN")
+            try:
+                rows = self._conn.execute(
+                    f"SELECT key, payload, updated_at FROM state WHERE key IN ({placeholders})", keys
+                ).fetchall()
+                member_rows = {
+                    name: self._conn.execute(
+                        "SELECT payload, updated_at FROM members WHERE collection = ? ORDER BY seq", (name,)
+                    ).fetchall()
+                    for name in collections
+                }
+            finally:
+                self._conn.execute("COMMIT")
+        stored = {
+            key: StoredState(key=key, payload=bytes(payload), updated_at=float(updated_at))
+            for key, payload, updated_at in rows
+        }
+        for name, members in member_rows.items():
+            stored[name] = StoredState(
+                key=name,
+                payload=encoding.join_array(bytes(payload) for payload, _ in members),
+                updated_at=max((float(updated_at) for _, updated_at in members), default=0.0),
+            )
+        return stored
+
+    def read_member(self, collection: str, member_id: str) -> Optional[StoredState]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, updated_at FROM members WHERE collection = ? AND id = ?", (collection, member_id)
+            ).fetchone()
+        if row is None:
+            return None
+        return StoredState(key=member_id, payload=bytes(row[0]), updated_at=float(row[1]))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,259 @@
+"""loguru 用の非同期 JSON ログシンク。
+
+呼び出し側 (ランタイムループ・リクエストハンドラ) はレコードを上限付きキューに積むだけで、
+JSON 化・ファイル書き込み・ローテーションは専用スレッドで行う。キューが満杯のときは
+待たずに捨て、捨てた件数を後から 1 行で記録する。
+
+`logger.bind(sample="<key>")` を付けたメッセージはキーごとに毎秒 `sample_per_second` 件まで
+に間引き、次に出力される行の `suppressed` に間引いた件数を載せる。`logger.contextualize`
+で設定した `iteration` / `patch_id` などの extra はそのまま JSON のフィールドになる。
+"""
+
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, TextIO
+
+from loguru import logger
+
+from agent.runtime import handoff
+from agent.runtime.locking import snapshot_lock
+
+MAX_MESSAGE_CHARS = 8192
+_BATCH = 512
+_STOP = object()
+
+
+@dataclass(slots=True)
+class LogConfig:
+    path: Optional[Path] = None
+    max_bytes: int = 10 * 1024 * 1024
+    backups: int = 5
+    sample_per_second: float = 1.0
+    queue_size: int = 10000
+    level: str = "INFO"
+    console: bool = True
+
+
+class SampleFilter:
+    """`sample` extra を持つレコードをキーごとのトークンバケットで間引く。"""
+
+    def __init__(self, per_second: float) -> None:
+        self._rate = per_second
+        self._burst = max(1.0, per_second)
+        self._lock = threading.Lock()
+        # key -> [残りトークン, 最終更新時刻, 間引いた件数]
+        self._buckets: Dict[str, List[float]] = {}
+
+    def __call__(self, record: dict) -> bool:
+        key = record["extra"].get("sample")
+        if key is None or self._rate <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self._burst, now, 0]
+            bucket[0] = min(self._burst, bucket[0] + (now - bucket[1]) * self._rate)
+            bucket[1] = now
+            if bucket[0] < 1.0:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1.0
+            suppressed, bucket[2] = int(bucket[2]), 0
+        if suppressed:
+            record["extra"]["suppressed"] = suppressed
+        return True
+
+
+class _RotatingFile:
+    """サイズ上限を超えたら `<path>.1` … `<path>.<backups>` へ回すファイル。"""
+
+    def __init__(self, path: Path, max_bytes: int, backups: int) -> None:
+        self._path = path
+        self._max_bytes = max_bytes
+        self._backups = backups
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._fp = path.open("ab")
+        self._size = self._fp.tell()
+
+    def write(self, data: bytes) -> None:
+        if self._max_bytes > 0 and self._size and self._size + len(data) > self._max_bytes:
+            self._rotate()
+        self._fp.write(data)
+        self._size += len(data)
+
+    def _rotate(self) -> None:
+        # backup が一覧を確定する間に世代の名前を変えない
+        with snapshot_lock(self._path.parent):
+            self._rotate_locked()
+
+    def _rotate_locked(self) -> None:
+        self._fp.close()
+        if self._backups > 0:
+            for index in range(self._backups - 1, 0, -1):
+                source = self._path.with_name(f"{self._path.name}.{index}")
+                if source.exists():
+                    source.replace(self._path.with_name(f"{self._path.name}.{index + 1}"))
+            self._path.replace(self._path.with_name(f"{self._path.name}.1"))
+            self._fp = self._path.open("ab")
+        else:
+            self._fp = self._path.open("wb")
+        self._size = 0
+
+    def flush(self) -> None:
+        self._fp.flush()
+
+    def close(self) -> None:
+        self._fp.close()
+
+
+class JsonLogSink:
+    """loguru の sink として登録する。書き込みはバックグラウンドスレッドで行う。"""
+
+    def __init__(self, config: LogConfig, console: Optional[TextIO] = None) -> None:
+        self._config = config
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, config.queue_size))
+        self._console = console if console is not None else (sys.stderr if config.console else None)
+        self._file: Optional[_RotatingFile] = None
+        if config.path is not None:
+            self._file = _RotatingFile(config.path, config.max_bytes, config.backups)
+        self._static = {"pid": os.getpid(), "generation": handoff.generation()}
+        self._written = 0
+        self._dropped = 0
+        self._reported_dropped = 0
+        self._drop_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def __call__(self, message) -> None:
+        try:
+            self._queue.put_nowait(message.record)
+        except queue.Full:
+            with self._drop_lock:
+                self._dropped += 1
+
+    def stats(self) -> dict:
+        return {"written": self._written, "dropped": self._dropped, "queued": self._queue.qsize()}
+
+    def close(self, timeout: float = 5.0) -> None:
+        """キューに残ったレコードを書き出してスレッドを止める。"""
+        if not self._thread.is_alive():
+            return
+        deadline = time.monotonic() + timeout
+        # 満杯でも書き込みスレッドが消化するので、期限までは空きを待って終了を伝える
+        while True:
+            try:
+                self._queue.put(_STOP, timeout=0.1)
+                break
+            except queue.Full:
+                if time.monotonic() >= deadline or not self._thread.is_alive():
+                    print("log writer did not drain before shutdown", file=sys.__stderr__)
+                    return
+        self._thread.join(max(0.0, deadline - time.monotonic()))
+        if self._file is not None and not self._thread.is_alive():
+            self._file.close()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < _BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(item is _STOP for item in batch)
+            self._write([item for item in batch if item is not _STOP])
+            if stop:
+                return
+
+    def _write(self, records: list) -> None:
+        lines = []
+        if self._file is not None:
+            for record in records:
+                try:
+                    lines.append(self._to_json(record))
+                except Exception as exc:  # noqa: BLE001
+                    lines.append(json.dumps({"level": "ERROR", "message": f"Unserializable log record: {exc}"}))
+        dropped = self._dropped
+        if dropped > self._reported_dropped:
+            lines.append(
+                json.dumps(
+                    {
+                        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                        "level": "WARNING",
+                        "message": f"Dropped {dropped - self._reported_dropped} log records (queue full)",
+                        **self._static,
+                    }
+                )
+            )
+            self._reported_dropped = dropped
+        try:
+            if self._file is not None and lines:
+                # 上限判定とローテーションは 1 行ごとに行う (バッチ単位だと上限を大きく超える)
+                for line in lines:
+                    self._file.write((line + "\n").encode("utf-8"))
+                self._file.flush()
+            if self._console is not None:
+                for record in records:
+                    self._console.write(_console_line(record))
+                self._console.flush()
+        except Exception as exc:  # noqa: BLE001
+            # ログの失敗で書き込みスレッドを止めない
+            print(f"log writer failed: {exc}", file=sys.__stderr__)
+        self._written += len(records)
+
+    def _to_json(self, record: dict) -> str:
+        payload = {
+            "time": record["time"].isoformat(),
+            "level": record["level"].name,
+            "message": _truncate(record["message"]),
+            "logger": record["name"],
+            "function": record["function"],
+            "line": record["line"],
+            **self._static,
+        }
+        for key, value in record["extra"].items():
+            if key != "sample":
+                payload[key] = value
+        if record["exception"] is not None:
+            kind, value, tb = record["exception"]
+            payload["exception"] = _truncate("".join(traceback.format_exception(kind, value, tb)))
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def _truncate(text: str) -> str:
+    if len(text) <= MAX_MESSAGE_CHARS:
+        return text
+    return f"{text[:MAX_MESSAGE_CHARS]}…(+{len(text) - MAX_MESSAGE_CHARS} chars)"
+
+
+def _console_line(record: dict) -> str:
+    context = " ".join(f"{key}={value}" for key, value in record["extra"].items() if key != "sample")
+    return "{} | {:<8} | {}:{}:{} - {}{}\n".format(
+        record["time"].strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+        record["level"].name,
+        record["name"],
+        record["function"],
+        record["line"],
+        _truncate(record["message"]),
+        f" [{context}]" if context else "",
+    )
+
+
+def configure_logging(config: LogConfig) -> JsonLogSink:
+    """既定の同期 stderr ハンドラを外し、非同期 JSON シンクに置き換える。"""
+    sink = JsonLogSink(config)
+    logger.remove()
+    logger.add(sink, level=config.level, format="{message}", filter=SampleFilter(config.sample_per_second))
+    atexit.register(sink.close)
+    return sink
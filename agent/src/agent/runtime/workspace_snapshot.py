@@ -0,0 +1,247 @@
+"""パッチ適用前のワークスペーススナップショット。
+
+diff が触るファイルだけを `<patch_storage_dir>/<patch_id>.snapshot/` に退避し、
+ロールバック時はそれらを書き戻す。所要時間はリポジトリ全体ではなくパッチの大きさに比例する。
+
+退避は reflink (FICLONE) が使えればデータを複製せずに行い、使えなければ通常のコピーになる。
+hardlink は hook がファイルをその場で書き換えると退避側も変わってしまうため使わない。
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import json
+import os
+import re
+import shutil
+from dataclasses import asdict, dataclass, field
+from pathlib import Path, PurePosixPath
+from typing import List, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None  # type: ignore[assignment]
+
+from agent.runtime.apply_cache import file_sha256
+
+MANIFEST_NAME = "manifest.json"
+_FICLONE = 0x40049409
+_HUNK = re.compile(r"^@@ -\d+(?:,(\d+))? \+\d+(?:,(\d+))? @@")
+
+
+class SnapshotRestoreError(RuntimeError):
+    """退避したファイルが壊れている、または書き戻せない。"""
+
+
+class SnapshotConflictError(SnapshotRestoreError):
+    """適用後にワークスペースのファイルが変更されており、書き戻すとその変更を失う。"""
+
+    def __init__(self, paths: List[str]) -> None:
+        super().__init__(f"Changed after apply: {', '.join(paths)}")
+        self.paths = paths
+
+
+@dataclass(slots=True)
+class SnapshotEntry:
+    path: str
+    existed: bool
+    mode: int = 0
+    sha256: Optional[str] = None
+    # 適用直後の内容。None は適用後に存在しなかったことを表す
+    applied_sha256: Optional[str] = None
+
+
+@dataclass(slots=True)
+class SnapshotManifest:
+    patch_id: str
+    workspace: str
+    created_at: str
+    entries: List[SnapshotEntry] = field(default_factory=list)
+    cloned: int = 0
+    copied: int = 0
+    applied_recorded: bool = False
+
+    @classmethod
+    def load(cls, directory: Path) -> Optional["SnapshotManifest"]:
+        path = directory / MANIFEST_NAME
+        if not path.exists():
+            return None
+        data = json.loads(path.read_text(encoding="utf-8"))
+        entries = [SnapshotEntry(**entry) for entry in data.pop("entries")]
+        return cls(entries=entries, **data)
+
+
+def touched_paths(diff_path: Path) -> List[str]:
+    """unified diff / git diff が作成・変更・削除・リネームするパスを返す。"""
+    paths: List[str] = []
+    # hunk 内の "--- " で始まる削除行をヘッダと誤認しないよう残り行数を追う
+    old_left = new_left = 0
+    with diff_path.open("r", encoding="utf-8", errors="replace") as fp:
+        for line in fp:
+            if old_left > 0 or new_left > 0:
+                if line.startswith("-"):
+                    old_left -= 1
+                elif line.startswith("+"):
+                    new_left -= 1
+                elif not line.startswith("\\"):
+                    old_left -= 1
+                    new_left -= 1
+                continue
+            match = _HUNK.match(line)
+            if match:
+                old_left = int(match.group(1) or 1)
+                new_left = int(match.group(2) or 1)
+                continue
+            if line.startswith(("--- ", "+++ ")):
+                candidate = line[4:].rstrip("\n").split("\t", 1)[0]
+                if candidate == "/dev/null":
+                    continue
+                candidates = [candidate[2:] if candidate.startswith(("a/", "b/")) else candidate]
+            elif line.startswith("diff --git "):
+                # バイナリやモード変更のみの場合は ---/+++ 行が無い
+                parts = line.split()
+                if len(parts) != 4:
+                    continue
+                candidates = [part[2:] for part in parts[2:] if part.startswith(("a/", "b/"))]
+            elif line.startswith(("rename from ", "rename to ", "copy to ")):
+                candidates = [line.split(" ", 2)[2].rstrip("\n")]
+            else:
+                continue
+            for candidate in candidates:
+                normalized = _safe_relative(candidate)
+                if normalized is not None and normalized not in paths:
+                    paths.append(normalized)
+    return paths
+
+
+def _safe_relative(candidate: str) -> Optional[str]:
+    path = PurePosixPath(candidate.strip())
+    if not path.parts or path.is_absolute() or ".." in path.parts:
+        # ワークスペース外を指すパスは退避・復元の対象にしない
+        return None
+    return path.as_posix()
+
+
+def take_snapshot(patch_id: str, workspace: Path, paths: List[str], directory: Path) -> SnapshotManifest:
+    """`paths` の現在の内容を `directory` に退避し、manifest を書き出す。"""
+    if directory.exists():
+        shutil.rmtree(directory)
+    files_dir = directory / "files"
+    files_dir.mkdir(parents=True)
+    manifest = SnapshotManifest(
+        patch_id=patch_id,
+        workspace=str(workspace),
+        created_at=dt.datetime.utcnow().isoformat() + "Z",
+    )
+    for relative in paths:
+        source = workspace / relative
+        if not source.is_file():
+            manifest.entries.append(SnapshotEntry(path=relative, existed=False))
+            continue
+        destination = files_dir / relative
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        if _clone(source, destination):
+            manifest.cloned += 1
+        else:
+            shutil.copyfile(source, destination)
+            manifest.copied += 1
+        manifest.entries.append(
+            SnapshotEntry(
+                path=relative,
+                existed=True,
+                mode=source.stat().st_mode & 0o7777,
+                sha256=file_sha256(destination),
+            )
+        )
+    _write_manifest(directory, manifest)
+    return manifest
+
+
+def record_applied_state(directory: Path, workspace: Optional[Path] = None) -> SnapshotManifest:
+    """適用直後の各ファイルのハッシュを manifest に記録する。"""
+    manifest = SnapshotManifest.load(directory)
+    if manifest is None:
+        raise SnapshotRestoreError(f"No snapshot manifest in {directory}")
+    root = workspace or Path(manifest.workspace)
+    for entry in manifest.entries:
+        entry.applied_sha256 = _current_sha256(root / entry.path)
+    manifest.applied_recorded = True
+    _write_manifest(directory, manifest)
+    return manifest
+
+
+def changed_since_apply(manifest: SnapshotManifest, workspace: Path) -> List[str]:
+    """適用直後から内容が変わったパスを返す。適用後の状態が未記録なら空。"""
+    if not manifest.applied_recorded:
+        return []
+    return [
+        entry.path
+        for entry in manifest.entries
+        if _current_sha256(workspace / entry.path) != entry.applied_sha256
+    ]
+
+
+def restore_snapshot(directory: Path, workspace: Optional[Path] = None) -> SnapshotManifest:
+    """退避したファイルを書き戻し、適用時に新規作成されたファイルを削除する。
+
+    適用後に変更されたファイルがあれば、その変更を上書きしないよう何もせず
+    `SnapshotConflictError` を送出する。
+    まず全ファイルを検証して書き戻し先と同じディレクトリに一時ファイルとして用意し、
+    その後 rename でまとめて差し替えるため、途中で失敗してもワークスペースは変更されない。
+    """
+    manifest = SnapshotManifest.load(directory)
+    if manifest is None:
+        raise SnapshotRestoreError(f"No snapshot manifest in {directory}")
+    root = workspace or Path(manifest.workspace)
+    changed = changed_since_apply(manifest, root)
+    if changed:
+        raise SnapshotConflictError(changed)
+    staged: List[tuple[Path, Path]] = []
+    try:
+        for entry in manifest.entries:
+            if not entry.existed:
+                continue
+            stored = directory / "files" / entry.path
+            if not stored.exists() or file_sha256(stored) != entry.sha256:
+                raise SnapshotRestoreError(f"Snapshot copy of {entry.path} is missing or corrupted")
+            target = root / entry.path
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = target.with_name(f".{target.name}.rollback-tmp")
+            if not _clone(stored, tmp):
+                shutil.copyfile(stored, tmp)
+            os.chmod(tmp, entry.mode)
+            staged.append((tmp, target))
+    except BaseException:
+        for tmp, _ in staged:
+            tmp.unlink(missing_ok=True)
+        raise
+    for tmp, target in staged:
+        tmp.replace(target)
+    for entry in manifest.entries:
+        if not entry.existed:
+            (root / entry.path).unlink(missing_ok=True)
+    return manifest
+
+
+def _write_manifest(directory: Path, manifest: SnapshotManifest) -> None:
+    tmp = directory / (MANIFEST_NAME + ".tmp")
+    tmp.write_text(json.dumps(asdict(manifest), ensure_ascii=False), encoding="utf-8")
+    tmp.replace(directory / MANIFEST_NAME)
+
+
+def _current_sha256(path: Path) -> Optional[str]:
+    return file_sha256(path) if path.is_file() else None
+
+
+def _clone(source: Path, destination: Path) -> bool:
+    """reflink でコピーする。ファイルシステムが対応していなければ False。"""
+    if fcntl is None:
+        return False
+    try:
+        with source.open("rb") as src, destination.open("wb") as dst:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+    except OSError:
+        destination.unlink(missing_ok=True)
+        return False
+    return True
@@ -0,0 +1,311 @@
+"""パッチ昇格前のテストゲート。
+
+`src/` と `tests/` の import グラフから各テストファイルが依存するモジュールを求め、
+依存ファイルの内容ハッシュをキーに前回の成功結果をキャッシュする。キーが変わった
+(= 依存先のどこかが変更された) テストファイルだけを CPU コア数の並列度で実行する。
+
+`pyproject.toml` や `conftest.py` など import グラフで追えないファイル
+(`GLOBAL_PATTERNS`) が変わった場合は全テストのキーが変わり、全件実行になる。
+`scripts/` の hook など、どのテストにも対応付けられない変更や、影響を受けるテストが
+1 件も無い変更も安全側に倒して全件実行する。
+
+`python -m agent....` をサブプロセスで起動するテストは import グラフに依存が
+現れないため、`agent` パッケージ全体に依存するものとして扱う。
+"""
+
+from __future__ import annotations
+
+import ast
+import hashlib
+import json
+import os
+import py_compile
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+# agent/ からの相対パターン。import グラフに現れない依存 (設定・静的ファイル)。
+GLOBAL_PATTERNS = ("pyproject.toml", "**/conftest.py", "../webui/**/*")
+CACHE_VERSION = 1
+
+
+@dataclass(slots=True)
+class GateOutcome:
+    path: str
+    ok: bool
+    duration: float
+    cached: bool = False
+    output: str = ""
+
+
+@dataclass(slots=True)
+class GateReport:
+    changed: List[str]
+    selected: List[str]
+    outcomes: List[GateOutcome] = field(default_factory=list)
+    compile_errors: List[str] = field(default_factory=list)
+    lint_ok: Optional[bool] = None
+    full_run: bool = False
+    fallback: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return not self.compile_errors and self.lint_ok is not False and all(o.ok for o in self.outcomes)
+
+
+class DependencyGraph:
+    """`agent` パッケージとテストの import グラフ。"""
+
+    def __init__(self, project: Path) -> None:
+        self._project = project
+        self._modules: Dict[str, Path] = {}
+        self._names: Dict[Path, str] = {}
+        for root, package in ((project / "src", "agent"), (project, "tests")):
+            for path in sorted((root / package).rglob("*.py")):
+                name = _module_name(path.relative_to(root))
+                self._modules[name] = path
+                self._names[path] = name
+        self._imports: Dict[Path, Set[Path]] = {path: self._parse(path) for path in self._modules.values()}
+
+    @property
+    def paths(self) -> List[Path]:
+        return list(self._names)
+
+    @property
+    def test_files(self) -> List[Path]:
+        tests = self._project / "tests"
+        return sorted(p for p in self._modules.values() if p.is_relative_to(tests) and p.name.startswith("test_"))
+
+    def _parse(self, path: Path) -> Set[Path]:
+        try:
+            tree = ast.parse(path.read_text(encoding="utf-8"), filename=str(path))
+        except (SyntaxError, UnicodeDecodeError):
+            return set()
+        package = self._names[path].split(".")
+        if path.name != "__init__.py":
+            package = package[:-1]
+        deps: Set[Path] = set()
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.List, ast.Tuple)) and _spawns_package(node):
+                # サブプロセスで起動したモジュールが何を import するかは追えない
+                deps.update(p for p in self._modules.values() if p.is_relative_to(self._project / "src"))
+            elif isinstance(node, ast.Import):
+                for alias in node.names:
+                    deps.update(self._resolve(alias.name))
+            elif isinstance(node, ast.ImportFrom):
+                if node.level:
+                    base = ".".join(package[: len(package) - node.level + 1])
+                    module = f"{base}.{node.module}" if node.module else base
+                else:
+                    module = node.module or ""
+                deps.update(self._resolve(module))
+                for alias in node.names:
+                    # `from agent.runtime import handoff` のようなサブモジュール import
+                    deps.update(self._resolve(f"{module}.{alias.name}", parents=False))
+        deps.discard(path)
+        return deps
+
+    def _resolve(self, module: str, parents: bool = True) -> Set[Path]:
+        found: Set[Path] = set()
+        parts = module.split(".")
+        # パッケージの __init__ も import 時に実行されるため依存に含める
+        for end in range(1 if parents else len(parts), len(parts) + 1):
+            path = self._modules.get(".".join(parts[:end]))
+            if path is not None:
+                found.add(path)
+        return found
+
+    def closure(self, path: Path) -> Set[Path]:
+        seen = {path}
+        stack = [path]
+        while stack:
+            for dep in self._imports.get(stack.pop(), ()):
+                if dep not in seen:
+                    seen.add(dep)
+                    stack.append(dep)
+        return seen
+
+
+class ImpactGate:
+    """変更の影響を受けるテストファイルだけを並列実行するゲート。"""
+
+    def __init__(self, project: Path, cache_path: Optional[Path] = None, jobs: Optional[int] = None) -> None:
+        self._project = project.resolve()
+        self._cache_path = cache_path or self._project / ".test-gate-cache.json"
+        self._jobs = jobs or os.cpu_count() or 1
+        self._hashes: Dict[Path, str] = {}
+
+    def _hash(self, path: Path) -> str:
+        digest = self._hashes.get(path)
+        if digest is None:
+            digest = hashlib.sha256(path.read_bytes()).hexdigest()
+            self._hashes[path] = digest
+        return digest
+
+    def _global_key(self) -> str:
+        digest = hashlib.sha256(f"{CACHE_VERSION}:{sys.version}".encode())
+        for pattern in GLOBAL_PATTERNS:
+            for path in sorted(self._project.glob(pattern)):
+                if path.is_file():
+                    digest.update(f"{os.path.relpath(path, self._project)}:{self._hash(path)}".encode())
+        return digest.hexdigest()
+
+    def test_key(self, graph: DependencyGraph, test: Path, global_key: str) -> str:
+        digest = hashlib.sha256(global_key.encode())
+        for path in sorted(graph.closure(test)):
+            digest.update(f"{path.relative_to(self._project)}:{self._hash(path)}".encode())
+        return digest.hexdigest()
+
+    def _load_cache(self) -> dict:
+        try:
+            data = json.loads(self._cache_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {"version": CACHE_VERSION, "files": {}, "tests": {}}
+        if data.get("version") != CACHE_VERSION:
+            return {"version": CACHE_VERSION, "files": {}, "tests": {}}
+        return data
+
+    def _save_cache(self, cache: dict) -> None:
+        tmp = self._cache_path.with_name(self._cache_path.name + ".tmp")
+        tmp.write_text(json.dumps(cache, indent=1, sort_keys=True), encoding="utf-8")
+        tmp.replace(self._cache_path)
+
+    def run(
+        self,
+        changed: Optional[Iterable[Path]] = None,
+        full: bool = False,
+        use_cache: bool = True,
+        lint: bool = True,
+    ) -> GateReport:
+        """ゲートを実行する。
+
+        `changed` を渡すとそのファイルに依存するテストだけを対象にする。省略時は前回
+        記録したファイルハッシュとの差分から変更を求める。
+        """
+        graph = DependencyGraph(self._project)
+        cache = self._load_cache() if use_cache else {"version": CACHE_VERSION, "files": {}, "tests": {}}
+        current_files = {str(path.relative_to(self._project)): self._hash(path) for path in _tracked_files(self._project)}
+
+        if changed is None:
+            changed_paths = sorted(
+                name for name, digest in current_files.items() if cache["files"].get(name) != digest
+            )
+        else:
+            changed_paths = sorted(_relative(Path(p), self._project) for p in changed)
+        global_key = self._global_key()
+        full_run = full or cache.get("global") != global_key
+
+        report = GateReport(changed=changed_paths, selected=[], full_run=full_run)
+        changed_set = {(self._project / name).resolve() for name in changed_paths}
+        mapped = {str(path.relative_to(self._project)) for path in graph.paths}
+        unmapped = [name for name in changed_paths if name not in mapped]
+        if not full_run and unmapped:
+            report.fallback = f"changes outside the import graph: {', '.join(unmapped[:5])}"
+        elif not full_run and changed is not None and not any(
+            graph.closure(test) & changed_set for test in graph.test_files
+        ):
+            report.fallback = "no test depends on the changed files"
+        if report.fallback is not None:
+            full_run = report.full_run = True
+        report.compile_errors = _compile(self._project / name for name in changed_paths if name.endswith(".py"))
+        if lint:
+            report.lint_ok = _ruff([self._project / name for name in changed_paths if name.endswith(".py")], self._project)
+
+        pending: List[tuple[Path, str]] = []
+        for test in graph.test_files:
+            name = str(test.relative_to(self._project))
+            key = self.test_key(graph, test, global_key)
+            entry = cache["tests"].get(name)
+            if changed is not None and not full_run and not (graph.closure(test) & changed_set):
+                continue
+            if not full_run and entry and entry.get("key") == key and entry.get("ok"):
+                report.outcomes.append(GateOutcome(name, True, entry.get("duration", 0.0), cached=True))
+                continue
+            pending.append((test, key))
+        report.selected = [str(test.relative_to(self._project)) for test, _ in pending]
+
+        # 前回の所要時間が長いものから投入し、並列実行の偏りを減らす
+        pending.sort(key=lambda item: -cache["tests"].get(str(item[0].relative_to(self._project)), {}).get("duration", 0.0))
+        with ThreadPoolExecutor(max_workers=max(1, min(self._jobs, len(pending) or 1))) as pool:
+            results = list(pool.map(lambda item: self._run_test(item[0]), pending))
+        for (test, key), outcome in zip(pending, results):
+            report.outcomes.append(outcome)
+            cache["tests"][outcome.path] = {"key": key, "ok": outcome.ok, "duration": round(outcome.duration, 3)}
+
+        if report.ok:
+            # 変更検出の基準は全件成功したときだけ進める
+            cache["files"] = current_files
+            cache["global"] = global_key
+        self._save_cache(cache)
+        report.outcomes.sort(key=lambda outcome: outcome.path)
+        return report
+
+    def _run_test(self, test: Path) -> GateOutcome:
+        started = time.monotonic()
+        completed = subprocess.run(
+            [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", str(test.relative_to(self._project))],
+            cwd=self._project,
+            capture_output=True,
+            text=True,
+        )
+        # 終了コード 5 は収集対象のテストが無いだけなので成功扱い
+        ok = completed.returncode in (0, 5)
+        return GateOutcome(
+            str(test.relative_to(self._project)),
+            ok,
+            time.monotonic() - started,
+            output="" if ok else completed.stdout + completed.stderr,
+        )
+
+
+def _module_name(relative: Path) -> str:
+    parts = list(relative.with_suffix("").parts)
+    if parts and parts[-1] == "__init__":
+        parts.pop()
+    return ".".join(parts)
+
+
+def _relative(path: Path, project: Path) -> str:
+    if not path.is_absolute():
+        # リポジトリルートからの相対パス (`agent/src/...`) も受け付ける
+        path = project.parent / path if (project.parent / path).exists() else Path.cwd() / path
+    return os.path.relpath(path.resolve(), project)
+
+
+def _tracked_files(project: Path) -> List[Path]:
+    """変更検出の対象。`scripts/` は hook など適用経路を動かすため Python 以外も含める。"""
+    scripts = [path for path in (project / "scripts").rglob("*") if path.is_file() and "__pycache__" not in path.parts]
+    return sorted([*(project / "src").rglob("*.py"), *(project / "tests").rglob("*.py"), *scripts])
+
+
+def _spawns_package(node: ast.List | ast.Tuple) -> bool:
+    """`[sys.executable, "-m", "agent.runtime.entrypoint"]` のような引数リストか。"""
+    values = [elt.value if isinstance(elt, ast.Constant) else None for elt in node.elts]
+    return any(
+        flag == "-m" and isinstance(module, str) and (module == "agent" or module.startswith("agent."))
+        for flag, module in zip(values, values[1:])
+    )
+
+
+def _compile(paths: Iterable[Path]) -> List[str]:
+    errors = []
+    for path in paths:
+        if not path.exists():
+            continue
+        try:
+            py_compile.compile(str(path), doraise=True)
+        except py_compile.PyCompileError as exc:
+            errors.append(exc.msg)
+    return errors
+
+
+def _ruff(paths: List[Path], project: Path) -> Optional[bool]:
+    existing = [str(path) for path in paths if path.exists()]
+    if not existing or shutil.which("ruff") is None:
+        return None
+    return subprocess.run(["ruff", "check", *existing], cwd=project).returncode == 0
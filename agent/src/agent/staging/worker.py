@@ -11,6 +11,8 @@ from typing import Any
 
 import httpx
 
+from agent.runtime.bundle import build_bundle
+
 
 def build_patch(target: Path, patch_id: str) -> Path:
     timestamp = datetime.now(timezone.utc).isoformat()
@@ -45,18 +47,24 @@ def main() -> None:
     parser.add_argument("--author", default="staging-worker")
     parser.add_argument("--notes", default="auto-generated")
     parser.add_argument("--resume", action="store_true", help="Resume runtime loop after apply")
+    parser.add_argument("--bundle", action="store_true", help="Send the diff as a compressed bundle artifact")
+    parser.add_argument("--test-report", type=Path, help="Test report to include in the bundle")
     args = parser.parse_args()
 
     patch_id = f"auto-{int(datetime.now(timezone.utc).timestamp())}"
     patch_file = build_patch(args.target, patch_id)
     patch_text = patch_file.read_text(encoding="utf-8")
+    artifact = patch_file
+    if args.bundle:
+        artifact = patch_file.with_suffix(".bundle.tar.gz")
+        build_bundle(patch_file, artifact, test_report=args.test_report)
 
     payload: dict[str, Any] = {
         "patch_id": patch_id,
         "summary": f"Auto note {patch_id}",
         "author": args.author,
         "created_at": datetime.now(timezone.utc).isoformat(),
-        "artifact_uri": f"file://{patch_file}",
+        "artifact_uri": f"file://{artifact}",
         "notes": args.notes,
         "diff_preview": patch_text,
     }
@@ -0,0 +1,209 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+
+from agent.runtime.app import RuntimeApp, RuntimeConfig
+from agent.runtime.artifacts import (
+    ArtifactFetchError,
+    ArtifactStore,
+    FetchedArtifact,
+    FileArtifactFetcher,
+    HttpArtifactFetcher,
+)
+from agent.runtime.server import create_app
+
+PAYLOAD = b"diff --git a/x b/x\n" + b"+line\n" * 4096
+
+
+class ArtifactHandler(BaseHTTPRequestHandler):
+    drop_first = False
+    requests: list = []
+    etag = '"v1"'
+
+    def do_GET(self) -> None:  # noqa: N802
+        type(self).requests.append(self.headers.get("Range"))
+        if self.path != "/artifact.diff":
+            self.send_error(404)
+            return
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if range_header and if_range in (None, type(self).etag):
+            start = int(range_header.removeprefix("bytes=").split("-")[0])
+            body = PAYLOAD[start:]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(PAYLOAD) - 1}/{len(PAYLOAD)}")
+        else:
+            body = PAYLOAD
+            self.send_response(200)
+        self.send_header("ETag", type(self).etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if type(self).drop_first:
+            # 最初の応答は途中で切断し、再開を強制する
+            type(self).drop_first = False
+            self.wfile.write(body[: len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        return None
+
+
+@pytest.fixture()
+def artifact_server():
+    ArtifactHandler.requests = []
+    ArtifactHandler.drop_first = False
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ArtifactHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_http_fetch_resumes_and_verifies_checksum(tmp_path, artifact_server):
+    ArtifactHandler.drop_first = True
+    fetcher = HttpArtifactFetcher(backoff_seconds=0)
+    store = ArtifactStore(tmp_path, fetchers={"http": fetcher})
+    expected = hashlib.sha256(PAYLOAD).hexdigest()
+
+    async def run():
+        try:
+            fetched = await store.fetch("p-1", f"{artifact_server}/artifact.diff", expected)
+            with pytest.raises(ArtifactFetchError):
+                await store.fetch("p-2", f"{artifact_server}/artifact.diff", "0" * 64)
+            with pytest.raises(ArtifactFetchError):
+                await store.fetch("p-3", f"{artifact_server}/missing.diff")
+            return fetched
+        finally:
+            await store.aclose()
+
+    fetched = asyncio.run(run())
+    assert fetched.path.read_bytes() == PAYLOAD
+    assert fetched.sha256 == expected
+    assert any(header and header != "bytes=0-" for header in ArtifactHandler.requests)
+    assert not (tmp_path / "p-2.artifact").exists()
+
+
+def test_http_fetch_discards_partial_of_another_object(tmp_path, artifact_server):
+    uri = f"{artifact_server}/artifact.diff"
+    fetcher = HttpArtifactFetcher(backoff_seconds=0)
+    store = ArtifactStore(tmp_path, fetchers={"http": fetcher})
+    stale = b"stale content " * 100
+
+    async def run():
+        try:
+            # 取得元が不明・別 URI の .part は Range を付けずに取り直す
+            (tmp_path / "p-1.artifact.part").write_bytes(stale)
+            await store.fetch("p-1", uri)
+            (tmp_path / "p-2.artifact.part").write_bytes(stale)
+            (tmp_path / "p-2.artifact.part.meta").write_text(f'{{"uri": "{uri}?old", "validator": null}}')
+            await store.fetch("p-2", uri)
+            # 同じ URI でも ETag が変わっていればサーバが全体を返す
+            (tmp_path / "p-3.artifact.part").write_bytes(stale)
+            (tmp_path / "p-3.artifact.part.meta").write_text(f'{{"uri": "{uri}", "validator": "\\"v0\\""}}')
+            await store.fetch("p-3", uri)
+            (tmp_path / "p-4.artifact.part").write_bytes(stale)
+            (tmp_path / "p-4.artifact.part.meta").write_text(f'{{"uri": "{artifact_server}/missing.diff"}}')
+            with pytest.raises(ArtifactFetchError):
+                await store.fetch("p-4", f"{artifact_server}/missing.diff")
+        finally:
+            await store.aclose()
+
+    asyncio.run(run())
+    for patch_id in ("p-1", "p-2", "p-3"):
+        assert (tmp_path / f"{patch_id}.artifact").read_bytes() == PAYLOAD
+    assert ArtifactHandler.requests[:2] == [None, None]
+    assert not list(tmp_path.glob("*.part*"))
+
+
+def test_enqueue_prefetches_remote_artifact(tmp_path, monkeypatch, artifact_server):
+    monkeypatch.setenv("PATCH_STORAGE_DIR", str(tmp_path / "patches"))
+    runtime = RuntimeApp(config=RuntimeConfig.from_env(os.environ))
+
+    with TestClient(create_app(runtime)) as client:
+        client.post("/control/pause")
+        queued = client.post(
+            "/patches",
+            json={
+                "patch_id": "remote-1",
+                "summary": "Remote artifact",
+                "author": "staging",
+                "created_at": "2025-10-16T00:00:00Z",
+                "artifact_uri": f"{artifact_server}/artifact.diff",
+                "artifact_sha256": hashlib.sha256(PAYLOAD).hexdigest(),
+            },
+        )
+        assert queued.status_code == HTTPStatus.ACCEPTED
+
+        deadline = time.monotonic() + 5
+        while runtime.get_patch("remote-1").artifact_local_path is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert runtime.get_patch("remote-1").artifact_local_path is not None
+        requests_before_apply = len(ArtifactHandler.requests)
+
+        applied = client.post("/patches/remote-1/apply")
+        assert applied.json()["status"] == "apply_success"
+        assert len(ArtifactHandler.requests) == requests_before_apply
+
+
+def test_file_fetch_replaces_destination_atomically(tmp_path):
+    source = tmp_path / "source.diff"
+    source.write_bytes(PAYLOAD)
+    store = ArtifactStore(tmp_path, fetchers={"file": FileArtifactFetcher()})
+    destination = store.destination_for("p-1")
+    destination.write_bytes(b"old")
+
+    with destination.open("rb") as previous:
+        fetched = asyncio.run(store.fetch("p-1", source.as_uri()))
+        # 既存ファイルを書き換えず rename で差し替えるので、開いていた側は元の内容のまま
+        assert previous.read() == b"old"
+    assert fetched.path.read_bytes() == PAYLOAD
+    assert fetched.sha256 == hashlib.sha256(PAYLOAD).hexdigest()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["p-1.artifact", "source.diff"]
+
+
+class GatedFetcher:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.release: asyncio.Event
+
+    async def fetch(self, uri: str, destination):
+        self.calls += 1
+        await self.release.wait()
+        destination.write_bytes(PAYLOAD)
+        return FetchedArtifact(destination, hashlib.sha256(PAYLOAD).hexdigest(), len(PAYLOAD))
+
+    async def aclose(self) -> None:
+        return None
+
+
+def test_fetches_of_the_same_patch_share_one_download(tmp_path):
+    fetcher = GatedFetcher()
+    store = ArtifactStore(tmp_path, fetchers={"gated": fetcher})
+
+    async def scenario():
+        fetcher.release = asyncio.Event()
+        assert store.prefetch("p-1", "gated://artifact")
+        waiters = [asyncio.create_task(store.fetch_shared("p-1", "gated://artifact")) for _ in range(2)]
+        await asyncio.sleep(0)
+        # 呼び出し元の 1 つがキャンセルされても共有している取得は続く
+        waiters[0].cancel()
+        fetcher.release.set()
+        fetched = await waiters[1]
+        assert fetched.path.read_bytes() == PAYLOAD
+        assert store.pending_task("p-1") is None
+
+    asyncio.run(scenario())
+    assert fetcher.calls == 1
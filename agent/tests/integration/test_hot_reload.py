@@ -0,0 +1,138 @@
+import asyncio
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import httpx
+import pytest
+import uvicorn
+
+import agent
+from agent.runtime.entrypoint import DrainingServer
+
+SRC_DIR = os.path.dirname(os.path.dirname(agent.__file__))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(predicate, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if predicate():
+                return True
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    return False
+
+
+@pytest.fixture()
+def supervised_runtime(tmp_path):
+    port = free_port()
+    env = dict(os.environ)
+    env.update(
+        {
+            "RUNTIME_HOT_RELOAD": "1",
+            "YAMADA_RUNTIME_ROLE": "writer",
+            "RUNTIME_PORT": str(port),
+            "PATCH_STORAGE_DIR": str(tmp_path / "patches"),
+            "YAMADA_STATE_STORE": str(tmp_path / "state" / "runtime.sqlite3"),
+            "YAMADA_RELOAD_READY_TIMEOUT": "20",
+            "YAMADA_SAMPLER_INTERVAL": "0",
+            "PYTHONPATH": os.pathsep.join(filter(None, [SRC_DIR, os.environ.get("PYTHONPATH")])),
+        }
+    )
+    log = (tmp_path / "supervisor.log").open("w")
+    supervisor = subprocess.Popen(
+        [sys.executable, "-m", "agent.runtime.entrypoint"], env=env, cwd=tmp_path, stderr=log
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        assert wait_for(lambda: httpx.get(f"{base_url}/healthz").status_code == 200)
+        yield base_url
+    finally:
+        supervisor.send_signal(signal.SIGTERM)
+        supervisor.wait(30)
+        log.close()
+
+
+def test_reload_hands_off_socket_without_failed_requests(supervised_runtime, tmp_path):
+    base_url = supervised_runtime
+    generation = lambda: httpx.get(f"{base_url}/status?compact=true").json()["generation"]  # noqa: E731
+    assert generation() == 1
+    httpx.post(f"{base_url}/control/pause")
+
+    failures = []
+    stop = threading.Event()
+
+    def hammer():
+        with httpx.Client(base_url=base_url, timeout=10) as client:
+            while not stop.is_set():
+                try:
+                    if client.get("/healthz").status_code != 200:
+                        failures.append("status")
+                except httpx.HTTPError as exc:
+                    failures.append(repr(exc))
+
+    thread = threading.Thread(target=hammer)
+    thread.start()
+    try:
+        assert httpx.post(f"{base_url}/control/reload").status_code == 202
+        assert wait_for(lambda: generation() == 2)
+        status = httpx.get(f"{base_url}/status?compact=true").json()
+        assert status["paused"] is True
+
+        # 新しい世代が起動できない状態にしてリロードすると、旧世代のまま応答し続ける
+        store = tmp_path / "state"
+        shutil.rmtree(store)
+        store.mkdir()
+        (store / "runtime.sqlite3").mkdir()
+        assert httpx.post(f"{base_url}/control/reload").status_code == 202
+        log = tmp_path / "supervisor.log"
+        assert wait_for(lambda: "generation 3 failed readiness check" in log.read_text())
+        assert generation() == 2
+        # 引き継ぎのため止めていた変更の受け付けを再開している
+        assert wait_for(lambda: httpx.post(f"{base_url}/control/resume").status_code == 202)
+    finally:
+        stop.set()
+        thread.join()
+    assert failures == []
+
+
+def test_failed_readiness_never_accepts_from_shared_socket():
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                await send({"type": f"{message['type']}.complete"})
+                if message["type"] == "lifespan.shutdown":
+                    return
+
+    async def not_ready():
+        return False
+
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(8)
+    client = socket.create_connection(listener.getsockname())
+    try:
+        server = DrainingServer(uvicorn.Config(app, log_config=None, lifespan="on"), ready_check=not_ready)
+        asyncio.run(server.serve(sockets=[listener]))
+        assert not server.started
+        # 接続は backlog に残ったまま (次の世代が受け付けられる)
+        listener.settimeout(1)
+        accepted, _ = listener.accept()
+        accepted.close()
+    finally:
+        client.close()
+        listener.close()
@@ -0,0 +1,124 @@
+from http import HTTPStatus
+import os
+import sys
+import time
+
+import httpx
+from fastapi.testclient import TestClient
+
+from agent.runtime.app import PendingPatch, RuntimeApp, RuntimeConfig
+from agent.runtime.entrypoint import WriterProcess
+from agent.runtime.reader import create_reader_app
+from agent.runtime.server import create_app
+
+
+def test_reader_serves_store_and_forwards_mutations(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATCH_STORAGE_DIR", str(tmp_path / "patches"))
+    monkeypatch.setenv("YAMADA_STATE_STORE", str(tmp_path / "state.sqlite3"))
+    config = RuntimeConfig.from_env(os.environ)
+    runtime = RuntimeApp(config=config)
+    writer_app = create_app(runtime)
+    writer_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=writer_app), base_url="http://writer")
+
+    reader_app = create_reader_app(config, "http://writer", client=writer_client)
+    with TestClient(reader_app) as client:
+        status = client.get("/status")
+        assert status.status_code == HTTPStatus.OK
+        assert status.json()["paused"] is False
+
+        pause = client.post("/control/pause")
+        assert pause.status_code == HTTPStatus.ACCEPTED
+        assert runtime.is_paused()
+        assert client.get("/status").json()["paused"] is True
+        assert client.get("/status", params={"compact": True}).json()["paused"] is True
+
+        artifact_src = tmp_path / "diff.patch"
+        artifact_src.write_text("diff --git a b", encoding="utf-8")
+        queued = client.post(
+            "/patches",
+            json={
+                "patch_id": "patch-1",
+                "summary": "Reader test",
+                "author": "staging",
+                "created_at": "2025-10-16T00:00:00Z",
+                "artifact_uri": artifact_src.as_uri(),
+            },
+        )
+        assert queued.status_code == HTTPStatus.ACCEPTED
+
+        listed = client.get("/patches").json()
+        assert [patch["patch_id"] for patch in listed] == ["patch-1"]
+        assert client.get("/patches/patch-1").json()["summary"] == "Reader test"
+        pending = client.get("/status").json()["pending_patches"]
+        assert [patch["patch_id"] for patch in pending] == ["patch-1"]
+        assert "diff_preview" not in pending[0]
+        assert client.get("/patches/unknown").status_code == HTTPStatus.NOT_FOUND
+
+        applied = client.post("/patches/patch-1/apply")
+        assert applied.json()["status"] == "apply_success"
+        assert client.get("/patches").json() == []
+        assert runtime.state_store.read_member("patches", "patch-1") is None
+        assert client.get("/patches/patch-1").status_code == HTTPStatus.NOT_FOUND
+        assert client.get("/patches/applied").json()[0]["patch_id"] == "patch-1"
+
+        statuses = {entry["status"] for entry in client.get("/patches/audit").json()}
+        assert {"queued", "apply_success"}.issubset(statuses)
+
+
+def test_publish_writes_only_changed_patches(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATCH_STORAGE_DIR", str(tmp_path / "patches"))
+    monkeypatch.setenv("YAMADA_STATE_STORE", str(tmp_path / "state.sqlite3"))
+    runtime = RuntimeApp(config=RuntimeConfig.from_env(os.environ))
+    for index in range(3):
+        runtime.enqueue_patch(make_patch(f"p-{index}"))
+
+    published = []
+    original = runtime.state_store.publish_many
+
+    def record(items, **kwargs):
+        published.append(
+            ([member[1] for member in kwargs.get("members", ())], [member[1] for member in kwargs.get("remove_members", ())])
+        )
+        return original(items, **kwargs)
+
+    monkeypatch.setattr(runtime.state_store, "publish_many", record)
+    runtime.enqueue_patch(make_patch("p-3"))
+    runtime.pop_patch("p-1")
+    runtime.pause()
+    assert published == [(["p-3"], []), ([], ["p-1"]), ([], [])]
+
+    stored = runtime.state_store.read_many((), ("patches", "applied"))
+    assert [patch["patch_id"] for patch in stored["patches"].json()] == ["p-0", "p-2", "p-3"]
+    assert stored["applied"].json() == []
+
+    # 次の世代は前の世代が残した行を消してから全件を書き出す
+    runtime.state_store.publish_many({}, members=[("applied", "stale", 1, b"{}")])
+    restarted = RuntimeApp(config=RuntimeConfig.from_env(os.environ))
+    stored = restarted.state_store.read_many((), ("patches", "applied"))
+    assert sorted(patch["patch_id"] for patch in stored["patches"].json()) == ["p-0", "p-2", "p-3"]
+    assert stored["applied"].json() == []
+
+
+def make_patch(patch_id):
+    return PendingPatch(
+        patch_id=patch_id,
+        summary=patch_id,
+        author="staging",
+        created_at="2025-10-16T00:00:00Z",
+        artifact_uri=f"file:///nonexistent/{patch_id}.diff",
+    )
+
+
+def test_writer_process_is_restarted_after_exit(tmp_path):
+    runs = tmp_path / "runs"
+    command = [sys.executable, "-c", f"open({str(runs)!r}, 'a').write('x')"]
+    writer = WriterProcess(command, dict(os.environ), min_backoff=0.01, max_backoff=0.05)
+    writer.start()
+    try:
+        deadline = time.monotonic() + 10
+        while writer.restarts < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        writer.stop()
+    assert writer.restarts >= 2
+    assert len(runs.read_text()) >= 2
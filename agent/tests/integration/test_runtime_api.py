@@ -1,10 +1,18 @@
+import asyncio
 from http import HTTPStatus
 import os
+import subprocess
+import time
 from pathlib import Path
 
+import pytest
 from fastapi.testclient import TestClient
 
+from agent.runtime import handoff
+
 from agent.runtime.app import PendingPatch, RuntimeApp, RuntimeConfig
+from agent.runtime.bundle import build_bundle
+from agent.runtime.handoff import ReloadInProgressError
 from agent.runtime.server import create_app
 
 
@@ -36,6 +44,12 @@ def test_runtime_api_health_and_status(tmp_path, monkeypatch):
         assert "last_plan" in payload
         assert payload["paused"] is False
 
+        runtime.history.append(time.time(), "manual", total_ms=5.0)
+        history = client.get("/history", params={"buckets": 4}).json()
+        assert sum(bucket["status"].get("manual", 0) for bucket in history["buckets"]) == 1
+        rows = client.get("/history", params={"buckets": 0}).json()["rows"]
+        assert any(row["status"] == "manual" and row["total_ms"] == 5.0 for row in rows)
+
         pause = client.post("/control/pause")
         assert pause.status_code == HTTPStatus.ACCEPTED
         assert runtime.is_paused()
@@ -71,6 +85,18 @@ def test_runtime_api_health_and_status(tmp_path, monkeypatch):
         listed = list_resp.json()
         assert listed[0]["artifact_uri"] == artifact_src.as_uri()
 
+        projected = client.get("/patches", params={"fields": "patch_id,author", "limit": 1})
+        assert projected.status_code == HTTPStatus.OK
+        assert projected.json() == [{"patch_id": "patch-1", "author": "staging"}]
+        assert "x-next-cursor" not in projected.headers
+        assert client.get("/patches", params={"fields": "secret"}).status_code == HTTPStatus.BAD_REQUEST
+        assert client.get("/patches", params={"cursor": "???"}).status_code == HTTPStatus.BAD_REQUEST
+
+        diff_resp = client.get("/patches/patch-1/diff")
+        assert diff_resp.status_code == HTTPStatus.OK
+        assert diff_resp.text == "diff --git a b"
+        assert client.get("/status", params={"compact": True}).json()["pending_count"] == 1
+
         detail_resp = client.get("/patches/patch-1")
         assert detail_resp.status_code == HTTPStatus.OK
         assert detail_resp.json()["notes"] == "unit tests passed"
@@ -85,6 +111,7 @@ def test_runtime_api_health_and_status(tmp_path, monkeypatch):
         applied_list = client.get("/patches/applied")
         assert applied_list.status_code == HTTPStatus.OK
         assert applied_list.json()[0]["artifact_local_path"].endswith("patch-1.artifact")
+        assert client.get("/patches/patch-1/diff").text == "diff --git a b"
 
         audit_resp = client.get("/patches/audit")
         assert audit_resp.status_code == HTTPStatus.OK
@@ -92,6 +119,10 @@ def test_runtime_api_health_and_status(tmp_path, monkeypatch):
         statuses = {entry["status"] for entry in audit_entries}
         assert {"queued", "artifact_copied", "apply_success"}.issubset(statuses)
 
+        newest = client.get("/patches/audit", params={"order": "desc", "limit": 1})
+        assert newest.headers["x-total-count"] == str(len(audit_entries))
+        assert newest.json() == [audit_entries[-1]]
+
         apply_missing = client.post("/patches/patch-1/apply")
         assert apply_missing.status_code == HTTPStatus.NOT_FOUND
 
@@ -177,3 +208,181 @@ def test_patch_apply_failure(tmp_path, monkeypatch):
         assert "rollback_success" in statuses
 
     monkeypatch.delenv("PATCH_APPLY_MODE", raising=False)
+
+
+def test_bundle_artifact_hands_hook_extracted_diff(tmp_path, monkeypatch):
+    runtime, patch_dir, _ = create_runtime(tmp_path, monkeypatch)
+    app = create_app(runtime)
+    diff = tmp_path / "bundle.diff"
+    diff.write_text("--- a/x\n+++ b/x\n@@ -1 +1 @@\n-a\n+b\n", encoding="utf-8")
+    bundle = tmp_path / "bundle.tar.gz"
+    build_bundle(diff, bundle)
+
+    with TestClient(app) as client:
+        client.post("/control/pause")
+        client.post(
+            "/patches",
+            json={
+                "patch_id": "bundle-1",
+                "summary": "Bundled",
+                "author": "staging",
+                "created_at": "2025-10-16T00:00:00Z",
+                "artifact_uri": bundle.as_uri(),
+            },
+        )
+        apply_resp = client.post("/patches/bundle-1/apply")
+        assert apply_resp.json()["status"] == "apply_success"
+        assert apply_resp.json()["artifact_path"].endswith("bundle-1.diff")
+        assert (patch_dir / "bundle-1.diff").read_text(encoding="utf-8") == diff.read_text(encoding="utf-8")
+
+        applied = client.get("/patches/applied").json()[0]
+        assert applied["bundle_manifest"]["files"][0]["path"] == "x"
+
+
+def test_apply_deferred_under_resource_pressure(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATCH_STORAGE_DIR", str(tmp_path / "patches"))
+    monkeypatch.setenv("YAMADA_LOOP_INTERVAL", "0.1")
+    monkeypatch.setenv("YAMADA_THROTTLE_MARGIN", "2")
+    runtime = RuntimeApp(config=RuntimeConfig.from_env(os.environ))
+    artifact_src = tmp_path / "pressure.patch"
+    artifact_src.write_text("diff --git g h", encoding="utf-8")
+
+    with TestClient(create_app(runtime)) as client:
+        client.post("/control/pause")
+        client.post(
+            "/patches",
+            json={
+                "patch_id": "pressure-1",
+                "summary": "Deferred",
+                "author": "staging",
+                "created_at": "2025-10-16T00:00:00Z",
+                "artifact_uri": artifact_src.as_uri(),
+            },
+        )
+        response = client.post("/patches/pressure-1/apply")
+        assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+        assert response.headers["retry-after"] == "30"
+        assert runtime.has_patch("pressure-1")
+
+        statuses = {entry["status"] for entry in client.get("/patches/audit").json()}
+        assert "apply_deferred" in statuses
+        assert "safety_margin" in client.get("/drive").json()
+
+
+def test_rollback_restores_pre_apply_snapshot(tmp_path, monkeypatch):
+    workspace = tmp_path / "workspace"
+    workspace.mkdir()
+    (workspace / "keep.txt").write_text("unrelated\n", encoding="utf-8")
+    (workspace / "app.py").write_text("VALUE = 1\n", encoding="utf-8")
+    hook = tmp_path / "hook.sh"
+    hook.write_text("#!/bin/sh\necho 'VALUE = 2' > app.py\necho new > added.py\n", encoding="utf-8")
+    hook.chmod(0o755)
+    monkeypatch.setenv("PATCH_WORKSPACE", str(workspace))
+    monkeypatch.setenv("PATCH_APPLY_HOOK", str(hook))
+    runtime, patch_dir, _ = create_runtime(tmp_path, monkeypatch)
+    diff = tmp_path / "change.diff"
+    diff.write_text(
+        "--- a/app.py\n+++ b/app.py\n@@ -1 +1 @@\n-VALUE = 1\n+VALUE = 2\n"
+        "--- /dev/null\n+++ b/added.py\n@@ -0,0 +1 @@\n+new\n",
+        encoding="utf-8",
+    )
+
+    with TestClient(create_app(runtime)) as client:
+        client.post("/control/pause")
+        client.post(
+            "/patches",
+            json={
+                "patch_id": "snap-1",
+                "summary": "Snapshot",
+                "author": "staging",
+                "created_at": "2025-10-16T00:00:00Z",
+                "artifact_uri": diff.as_uri(),
+            },
+        )
+        assert client.post("/patches/snap-1/apply").json()["status"] == "apply_success"
+        assert (workspace / "app.py").read_text(encoding="utf-8") == "VALUE = 2\n"
+        assert (patch_dir / "snap-1.snapshot" / "manifest.json").exists()
+
+        rollback = client.post("/patches/snap-1/rollback").json()
+        assert rollback["status"] == "rollback_success"
+        assert rollback["detail"] == "Restored 2 files from pre-apply snapshot"
+        assert (workspace / "app.py").read_text(encoding="utf-8") == "VALUE = 1\n"
+        assert not (workspace / "added.py").exists()
+        assert (workspace / "keep.txt").exists()
+        assert not (patch_dir / "snap-1.snapshot").exists()
+        assert [patch["patch_id"] for patch in client.get("/patches").json()] == ["snap-1"]
+        assert client.get("/patches/applied").json() == []
+
+
+def test_reapply_after_rollback_runs_hook_again(tmp_path, monkeypatch):
+    workspace = tmp_path / "workspace"
+    workspace.mkdir()
+    git = ["git", "-c", "user.name=t", "-c", "user.email=t@example.com"]
+    subprocess.run(["git", "init", "-q"], cwd=workspace, check=True)
+    (workspace / "app.py").write_text("VALUE = 1\n", encoding="utf-8")
+    subprocess.run(git + ["add", "app.py"], cwd=workspace, check=True)
+    subprocess.run(git + ["commit", "-qm", "init"], cwd=workspace, check=True)
+    hook = tmp_path / "hook.sh"
+    hook.write_text("#!/bin/sh\necho 'VALUE = 2' > app.py\n", encoding="utf-8")
+    hook.chmod(0o755)
+    monkeypatch.setenv("PATCH_WORKSPACE", str(workspace))
+    monkeypatch.setenv("PATCH_APPLY_HOOK", str(hook))
+    runtime, _, _ = create_runtime(tmp_path, monkeypatch)
+    diff = tmp_path / "change.diff"
+    diff.write_text("--- a/app.py\n+++ b/app.py\n@@ -1 +1 @@\n-VALUE = 1\n+VALUE = 2\n", encoding="utf-8")
+
+    with TestClient(create_app(runtime)) as client:
+        client.post("/control/pause")
+        client.post(
+            "/patches",
+            json={
+                "patch_id": "re-1",
+                "summary": "Reapply",
+                "author": "staging",
+                "created_at": "2025-10-16T00:00:00Z",
+                "artifact_uri": diff.as_uri(),
+            },
+        )
+        for _ in range(2):
+            applied = client.post("/patches/re-1/apply").json()
+            assert applied["status"] == "apply_success"
+            assert not applied["cached"]
+            assert (workspace / "app.py").read_text(encoding="utf-8") == "VALUE = 2\n"
+
+            rollback = client.post("/patches/re-1/rollback").json()
+            assert rollback["detail"] == "Restored 1 files from pre-apply snapshot"
+            assert (workspace / "app.py").read_text(encoding="utf-8") == "VALUE = 1\n"
+            assert runtime.snapshot()["apply_cache"]["entries"] == 0
+
+
+def test_reload_hands_off_state_after_in_flight_mutations(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATCH_STORAGE_DIR", str(tmp_path / "patches"))
+    handed_off = []
+    monkeypatch.setattr(handoff, "reload_available", lambda: True)
+    monkeypatch.setattr(handoff, "request_reload", handed_off.append)
+    runtime = RuntimeApp(config=RuntimeConfig.from_env(os.environ))
+
+    async def run():
+        async with runtime.mutation():
+            runtime.request_reload()
+            with pytest.raises(ReloadInProgressError):
+                async with runtime.mutation():
+                    pass
+            await asyncio.sleep(0)
+            assert handed_off == []
+            runtime.pause()
+        await runtime._handoff_task
+        runtime.reload_aborted()
+        async with runtime.mutation():
+            pass
+
+    asyncio.run(run())
+    assert [state["paused"] for state in handed_off] == [True]
+
+    with TestClient(create_app(runtime)) as client:
+        assert client.post("/control/reload").status_code == HTTPStatus.ACCEPTED
+        rejected = client.post("/control/resume")
+        assert rejected.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+        assert rejected.headers["retry-after"] == "1"
+        assert client.get("/status", params={"compact": True}).json()["reloading"] is True
+    assert len(handed_off) == 2
@@ -0,0 +1,143 @@
+import os
+import subprocess
+import time
+
+import pytest
+
+from agent.runtime.apply_cache import ApplyCache, ApplyCacheKey, CachedOutcome
+from agent.runtime.patch_executor import PatchExecutor
+
+
+def outcome(ok=True, detail="ok"):
+    return CachedOutcome(ok=ok, detail=detail, command="hook", stdout="", stderr="", created_at=time.time())
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = ApplyCache(tmp_path / "cache.sqlite3", max_entries=2)
+    keys = [ApplyCacheKey(f"sha{i}", "rev", "hook") for i in range(3)]
+    cache.put(keys[0], outcome())
+    cache.put(keys[1], outcome())
+    assert cache.get(keys[0]) is not None
+    cache.put(keys[2], outcome())
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    stats = cache.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"], stats["evictions"]) == (2, 2, 1, 1)
+
+    reopened = ApplyCache(tmp_path / "cache.sqlite3", max_entries=2, ttl_seconds=0.01)
+    time.sleep(0.02)
+    assert reopened.get(keys[2]) is None
+    assert reopened.stats()["evictions"] == 1
+
+
+GIT = ["git", "-c", "user.name=t", "-c", "user.email=t@example.com"]
+
+
+def make_workspace(tmp_path):
+    workspace = tmp_path / "workspace"
+    workspace.mkdir()
+    subprocess.run(["git", "init", "-q"], cwd=workspace, check=True)
+    (workspace / "README").write_text("v1\n")
+    subprocess.run(GIT + ["add", "README"], cwd=workspace, check=True)
+    subprocess.run(GIT + ["commit", "-qm", "v1"], cwd=workspace, check=True)
+    return workspace
+
+
+def test_executor_reuses_result_for_same_artifact_and_revision(tmp_path, monkeypatch):
+    workspace = make_workspace(tmp_path)
+
+    calls = tmp_path / "calls"
+    hook = tmp_path / "hook.sh"
+    hook.write_text(f"#!/bin/sh\necho run >> {calls}\necho validated $1\n")
+    hook.chmod(0o755)
+    monkeypatch.setenv("PATCH_APPLY_HOOK", str(hook))
+    artifact = tmp_path / "a.diff"
+    artifact.write_text("diff --git a b\n")
+
+    executor = PatchExecutor(workspace, cache=ApplyCache(tmp_path / "cache.sqlite3"))
+    first = executor.apply("p-1", artifact)
+    # 別 ID で同じ diff を投入してもキャッシュを使う
+    second = executor.apply("p-2", artifact)
+    assert first.ok and not first.cached
+    assert second.ok and second.cached and second.detail == "validated p-1"
+    assert calls.read_text().count("run") == 1
+
+    executor.apply("p-2", artifact, use_cache=False)
+    (workspace / "README").write_text("v2\n")
+    # 未コミットの変更がある間はキャッシュを使わない
+    assert not executor.apply("p-3", artifact).cached
+    subprocess.run(GIT + ["commit", "-qam", "v2"], cwd=workspace, check=True)
+    assert not executor.apply("p-4", artifact).cached
+    assert calls.read_text().count("run") == 4
+
+
+def test_executor_does_not_cache_hooks_that_change_the_workspace(tmp_path, monkeypatch):
+    workspace = make_workspace(tmp_path)
+    hook = tmp_path / "hook.sh"
+    hook.write_text("#!/bin/sh\necho applied >> README\n")
+    hook.chmod(0o755)
+    monkeypatch.setenv("PATCH_APPLY_HOOK", str(hook))
+    artifact = tmp_path / "a.diff"
+    artifact.write_text("--- a/README\n+++ b/README\n@@ -1 +1,2 @@\n v1\n+applied\n")
+    executor = PatchExecutor(workspace, cache=ApplyCache(tmp_path / "cache.sqlite3"))
+
+    assert executor.apply("p-1", artifact).ok
+    subprocess.run(["git", "checkout", "-q", "README"], cwd=workspace, check=True)
+    again = executor.apply("p-1", artifact)
+    assert not again.cached
+    assert (workspace / "README").read_text() == "v1\napplied\n"
+    assert executor.cache.stats()["entries"] == 0
+
+
+def test_touched_but_unchanged_files_keep_the_cache(tmp_path, monkeypatch):
+    workspace = make_workspace(tmp_path)
+    hook = tmp_path / "hook.sh"
+    hook.write_text("#!/bin/sh\nexit 0\n")
+    hook.chmod(0o755)
+    monkeypatch.setenv("PATCH_APPLY_HOOK", str(hook))
+    artifact = tmp_path / "a.diff"
+    artifact.write_text("diff --git a b\n")
+    executor = PatchExecutor(workspace, cache=ApplyCache(tmp_path / "cache.sqlite3"))
+
+    executor.apply("p-1", artifact)
+    (workspace / "README").write_text("v1\n")
+    os.utime(workspace / "README", (time.time() + 10, time.time() + 10))
+    assert executor.apply("p-2", artifact).cached
+
+
+def test_rollback_invalidates_cached_result_for_artifact(tmp_path, monkeypatch):
+    workspace = make_workspace(tmp_path)
+    hook = tmp_path / "hook.sh"
+    hook.write_text("#!/bin/sh\nexit 0\n")
+    hook.chmod(0o755)
+    monkeypatch.setenv("PATCH_APPLY_HOOK", str(hook))
+    artifact = tmp_path / "a.diff"
+    artifact.write_text("--- a/README\n+++ b/README\n@@ -1 +1 @@\n-v1\n+v2\n")
+    executor = PatchExecutor(workspace, cache=ApplyCache(tmp_path / "cache.sqlite3"))
+
+    executor.apply("p-1", artifact, snapshot_dir=tmp_path / "snap")
+    assert executor.apply("p-1", artifact, snapshot_dir=tmp_path / "snap").cached
+    assert executor.rollback("p-1", tmp_path / "snap", artifact).ok
+    assert executor.cache.stats()["entries"] == 0
+    assert not executor.apply("p-1", artifact).cached
+
+
+def test_failed_apply_discards_snapshot(tmp_path, monkeypatch):
+    workspace = make_workspace(tmp_path)
+    hook = tmp_path / "hook.sh"
+    hook.write_text("#!/bin/sh\necho conflict >&2\nexit 1\n")
+    hook.chmod(0o755)
+    monkeypatch.setenv("PATCH_APPLY_HOOK", str(hook))
+    artifact = tmp_path / "a.diff"
+    artifact.write_text("--- a/README\n+++ b/README\n@@ -1 +1 @@\n-v1\n+v2\n")
+    executor = PatchExecutor(workspace)
+
+    result = executor.apply("p-1", artifact, snapshot_dir=tmp_path / "snap")
+    assert not result.ok and result.snapshot_path is None
+    assert not (tmp_path / "snap").exists()
+
+    monkeypatch.setenv("PATCH_APPLY_HOOK", str(tmp_path / "missing.sh"))
+    with pytest.raises(OSError):
+        executor.apply("p-1", artifact, snapshot_dir=tmp_path / "snap")
+    assert not (tmp_path / "snap").exists()
@@ -0,0 +1,133 @@
+import fcntl
+import io
+import os
+import random
+import sqlite3
+import time
+from pathlib import Path
+
+import pytest
+
+from agent.backup import chunking, repository
+from agent.backup.chunking import MAX_SIZE, MIN_SIZE, iter_chunks
+from agent.backup.repository import Repository
+
+
+def random_bytes(size: int, seed: int) -> bytes:
+    return random.Random(seed).randbytes(size)
+
+
+def test_chunk_boundaries_survive_insertions():
+    data = random_bytes(1024 * 1024, 1)
+    chunks = list(iter_chunks(io.BytesIO(data)))
+    assert b"".join(chunks) == data
+    assert all(MIN_SIZE <= len(chunk) <= MAX_SIZE for chunk in chunks[:-1])
+
+    edited = data[:100_000] + b"inserted" + data[100_000:]
+    edited_chunks = list(iter_chunks(io.BytesIO(edited)))
+    shared = set(chunks) & set(edited_chunks)
+    assert len(shared) >= len(chunks) - 2
+
+
+def test_numpy_boundary_search_matches_python():
+    pytest.importorskip("numpy")
+    rng = random.Random(7)
+    data = random_bytes(4 * chunking._NP_BLOCK, 3)
+    for mask in (chunking._MASK_STRICT, chunking._MASK_LOOSE, (1 << 6) - 1, (1 << 30) - 1):
+        for _ in range(20):
+            begin = rng.randrange(chunking.WINDOW, len(data) - 1)
+            stop = rng.randrange(begin + 1, len(data) + 1)
+            expected = chunking._first_match_py(data, begin, stop, mask)
+            assert chunking._first_match_np(data, begin, stop, mask) == expected
+
+
+def test_snapshot_dedup_verify_and_restore(tmp_path):
+    state = tmp_path / "state"
+    state.mkdir()
+    (state / "big.artifact").write_bytes(random_bytes(512 * 1024, 2))
+    (state / "p-1.json").write_text('{"patch_id": "p-1"}', encoding="utf-8")
+    (state / "audit.log").write_text('{"status": "queued"}\n', encoding="utf-8")
+
+    repo = Repository(tmp_path / "repo")
+    first = repo.create({"patches": state}, snapshot_id="s1")
+    assert first.new_chunks == sum(len(entry.chunks) for entry in first.files)
+
+    with (state / "audit.log").open("a", encoding="utf-8") as fp:
+        fp.write('{"status": "apply_success"}\n')
+    second = repo.create({"patches": state}, snapshot_id="s2")
+    assert second.new_bytes < 1024
+    assert repo.list() == ["s1", "s2"]
+    assert repo.verify("s2").ok
+
+    target = tmp_path / "restore"
+    assert repo.restore("s1", target) == {"restored": 3, "unchanged": 0, "removed": 0}
+    assert (target / "patches" / "audit.log").read_text(encoding="utf-8") == '{"status": "queued"}\n'
+    (target / "patches" / "p-2.json").write_text("{}", encoding="utf-8")
+    (target / "patches" / "old" / "cache.sqlite3-wal").parent.mkdir()
+    (target / "patches" / "old" / "cache.sqlite3-wal").write_bytes(b"stale")
+    assert repo.restore("s1", target) == {"restored": 0, "unchanged": 3, "removed": 2}
+    assert sorted(p.name for p in (target / "patches").iterdir()) == ["audit.log", "big.artifact", "p-1.json"]
+
+    chunk = next((tmp_path / "repo" / "chunks").rglob("*"))
+    while chunk.is_dir():
+        chunk = next(chunk.iterdir())
+    chunk.write_bytes(b"broken")
+    assert not all(repo.verify(snapshot_id).ok for snapshot_id in repo.list())
+
+
+def test_unchanged_files_are_not_reread(tmp_path, monkeypatch):
+    state = tmp_path / "state"
+    state.mkdir()
+    old = time.time() - 60
+    for name in ("a.json", "b.json"):
+        (state / name).write_bytes(random_bytes(64 * 1024, len(name)))
+        os.utime(state / name, (old, old))
+
+    repo = Repository(tmp_path / "repo")
+    first = repo.create({"patches": state}, snapshot_id="s1")
+    (state / "b.json").write_bytes(random_bytes(64 * 1024, 99))
+    os.utime(state / "b.json", (old + 1, old + 1))
+
+    read = []
+    original = repository.iter_chunks
+
+    def record(fp, limit=None):
+        # チャンク分割はロック解放後に、ロック中に取ったコピーから行う
+        with (state / ".snapshot.lock").open("a") as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        read.append(Path(fp.name).parent)
+        return original(fp, limit)
+
+    monkeypatch.setattr(repository, "iter_chunks", record)
+    second = repo.create({"patches": state}, snapshot_id="s2")
+
+    assert second.parent == "s1" and second.reused_files == 1
+    assert read == [tmp_path / "repo" / "tmp"]
+    assert second.files[0].chunks == first.files[0].chunks
+    assert repo.verify("s2").ok
+
+
+def test_live_sqlite_database_is_backed_up_consistently(tmp_path):
+    state = tmp_path / "state"
+    state.mkdir()
+    writer = sqlite3.connect(state / "cache.sqlite3")
+    writer.execute("PRAGMA journal_mode=WAL")
+    writer.execute("CREATE TABLE t (v INTEGER)")
+    writer.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(100)])
+    writer.commit()
+    # 未コミットの書き込みと WAL が残ったままスナップショットを取る
+    writer.execute("INSERT INTO t VALUES (-1)")
+    assert (state / "cache.sqlite3-wal").exists()
+
+    repo = Repository(tmp_path / "repo")
+    snapshot = repo.create({"patches": state}, snapshot_id="s1")
+    writer.rollback()
+    writer.close()
+    assert [entry.path for entry in snapshot.files] == ["patches/cache.sqlite3"]
+
+    target = tmp_path / "restore"
+    repo.restore("s1", target)
+    restored = sqlite3.connect(target / "patches" / "cache.sqlite3")
+    assert restored.execute("PRAGMA integrity_check").fetchone() == ("ok",)
+    assert restored.execute("SELECT count(*), min(v) FROM t").fetchone() == (100, 0)
+    restored.close()
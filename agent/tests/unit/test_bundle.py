@@ -0,0 +1,75 @@
+import tarfile
+
+import pytest
+
+from agent.runtime.bundle import (
+    BundleError,
+    build_bundle,
+    diff_file_stats,
+    extract_diff,
+    ingest_bundle,
+    is_bundle,
+    read_manifest,
+)
+
+DIFF = (
+    "diff --git a/docs/a.md b/docs/a.md\n"
+    "--- a/docs/a.md\n"
+    "+++ b/docs/a.md\n"
+    "@@ -1,2 +1,2 @@\n"
+    " keep\n"
+    "-old\n"
+    "+new\n"
+    "diff --git a/src/b.py b/src/b.py\n"
+    "--- /dev/null\n"
+    "+++ b/src/b.py\n"
+    "@@ -0,0 +1,2 @@\n"
+    "+one\n"
+    "+two\n"
+)
+
+
+def test_diff_file_stats_splits_per_file():
+    stats = diff_file_stats(DIFF.encode("utf-8"))
+    assert [(s.path, s.added, s.removed) for s in stats] == [("docs/a.md", 1, 1), ("src/b.py", 2, 0)]
+    assert stats[0].sha256 != stats[1].sha256
+
+
+def test_bundle_round_trip(tmp_path):
+    diff_path = tmp_path / "change.diff"
+    diff_path.write_text(DIFF, encoding="utf-8")
+    report = tmp_path / "report.json"
+    report.write_text("{}", encoding="utf-8")
+    bundle = tmp_path / "change.bundle.tar.gz"
+
+    manifest = build_bundle(diff_path, bundle, test_report=report)
+    assert is_bundle(bundle) and not is_bundle(diff_path)
+    assert read_manifest(bundle) == manifest
+    assert manifest.test_report == "test_report.json"
+    assert (manifest.added, manifest.removed) == (3, 1)
+
+    ingested, preview = ingest_bundle(bundle, preview_bytes=16)
+    assert ingested == manifest
+    assert preview == DIFF[:16]
+
+    extracted = extract_diff(bundle, tmp_path / "out.diff")
+    assert extracted.read_text(encoding="utf-8") == DIFF
+
+
+def test_ingest_rejects_tampered_diff(tmp_path):
+    diff_path = tmp_path / "change.diff"
+    diff_path.write_text(DIFF, encoding="utf-8")
+    bundle = tmp_path / "change.bundle.tar.gz"
+    manifest = build_bundle(diff_path, bundle)
+
+    tampered = tmp_path / "tampered.tar.gz"
+    diff_path.write_text(DIFF + "+extra\n", encoding="utf-8")
+    with tarfile.open(tampered, "w:gz") as archive:
+        with tarfile.open(bundle, "r:gz") as original:
+            member = original.getmember("manifest.json")
+            archive.addfile(member, original.extractfile(member))
+        archive.add(str(diff_path), arcname="patch.diff")
+
+    assert read_manifest(tampered) == manifest
+    with pytest.raises(BundleError):
+        ingest_bundle(tampered)
@@ -0,0 +1,79 @@
+from agent.staging.gate import DependencyGraph, ImpactGate
+
+
+def make_project(root):
+    (root / "src" / "agent" / "core").mkdir(parents=True)
+    (root / "tests").mkdir()
+    (root / "pyproject.toml").write_text('[tool.pytest.ini_options]\npythonpath = ["src"]\n')
+    (root / "src" / "agent" / "__init__.py").write_text("")
+    (root / "src" / "agent" / "core" / "__init__.py").write_text("")
+    (root / "src" / "agent" / "core" / "math.py").write_text("def add(a, b):\n    return a + b\n")
+    (root / "src" / "agent" / "text.py").write_text("from .core import math\n\nSEP = '-'\n")
+    (root / "tests" / "__init__.py").write_text("")
+    (root / "tests" / "test_math.py").write_text(
+        "from agent.core.math import add\n\n\ndef test_add():\n    assert add(1, 2) == 3\n"
+    )
+    (root / "tests" / "test_text.py").write_text(
+        "from agent import text\n\n\ndef test_sep():\n    assert text.SEP == '-'\n"
+    )
+
+
+def test_graph_follows_relative_and_submodule_imports(tmp_path):
+    make_project(tmp_path)
+    graph = DependencyGraph(tmp_path)
+    math = tmp_path / "src" / "agent" / "core" / "math.py"
+
+    assert math in graph.closure(tmp_path / "tests" / "test_text.py")
+    assert tmp_path / "src" / "agent" / "text.py" not in graph.closure(tmp_path / "tests" / "test_math.py")
+
+
+def test_gate_runs_only_tests_whose_dependencies_changed(tmp_path):
+    make_project(tmp_path)
+    gate = ImpactGate(tmp_path, jobs=2)
+
+    first = gate.run(lint=False)
+    assert first.ok and first.full_run
+    assert first.selected == ["tests/test_math.py", "tests/test_text.py"]
+
+    assert gate.run(lint=False).selected == []
+
+    (tmp_path / "src" / "agent" / "text.py").write_text("from .core import math\n\nSEP = '+'\n")
+    gate = ImpactGate(tmp_path, jobs=2)
+    report = gate.run(lint=False)
+    assert report.changed == ["src/agent/text.py"]
+    assert report.selected == ["tests/test_text.py"]
+    assert not report.ok
+    assert {outcome.path: outcome.cached for outcome in report.outcomes} == {
+        "tests/test_math.py": True,
+        "tests/test_text.py": False,
+    }
+
+
+def test_subprocess_tests_depend_on_whole_package(tmp_path):
+    make_project(tmp_path)
+    (tmp_path / "tests" / "test_spawn.py").write_text(
+        "import subprocess\nimport sys\n\n\ndef test_spawn():\n"
+        "    subprocess.run([sys.executable, '-m', 'agent.text'], check=False)\n"
+    )
+    graph = DependencyGraph(tmp_path)
+
+    assert tmp_path / "src" / "agent" / "core" / "math.py" in graph.closure(tmp_path / "tests" / "test_spawn.py")
+
+
+def test_unmapped_or_unused_changes_fall_back_to_full_run(tmp_path):
+    make_project(tmp_path)
+    (tmp_path / "scripts" / "hooks").mkdir(parents=True)
+    (tmp_path / "scripts" / "hooks" / "apply.sh").write_text("#!/bin/sh\n")
+    (tmp_path / "src" / "agent" / "unused.py").write_text("X = 1\n")
+    gate = ImpactGate(tmp_path, jobs=2)
+    gate.run(lint=False)
+
+    report = ImpactGate(tmp_path, jobs=2).run(changed=[tmp_path / "scripts" / "hooks" / "apply.sh"], lint=False)
+    assert report.full_run and "scripts/hooks/apply.sh" in report.fallback
+    assert len(report.selected) == 2
+
+    report = ImpactGate(tmp_path, jobs=2).run(changed=[tmp_path / "src" / "agent" / "unused.py"], lint=False)
+    assert report.full_run and report.fallback == "no test depends on the changed files"
+
+    (tmp_path / "scripts" / "hooks" / "apply.sh").write_text("#!/bin/sh\nexit 1\n")
+    assert ImpactGate(tmp_path, jobs=2).run(lint=False).full_run
@@ -0,0 +1,77 @@
+from agent.runtime.history import HistoryConfig, HistoryStore
+
+
+def fill(store, count, start=1000.0, step=10.0):
+    for index in range(count):
+        store.append(
+            start + index * step,
+            "noop" if index % 2 else "error",
+            plan_ms=1.0,
+            execute_ms=float(index),
+            total_ms=float(index) + 1,
+            priority=index % 3,
+        )
+
+
+def test_spills_to_segments_and_queries_across_them(tmp_path):
+    store = HistoryStore(tmp_path, HistoryConfig(capacity=4))
+    fill(store, 10)
+
+    assert len(store) == 2
+    assert store.stats()["segments"] == 2
+    rows = store.rows(1000.0, 1090.0)
+    assert [row["timestamp"] for row in rows] == [1000.0 + 10 * i for i in range(10)]
+    assert rows[3]["status"] == "noop" and rows[4]["status"] == "error"
+    assert [row["execute_ms"] for row in store.rows(1025.0, 1055.0)] == [3.0, 4.0, 5.0]
+    assert len(store.rows(0, 2000, limit=3)) == 3
+
+    store.flush()
+    reopened = HistoryStore(tmp_path, HistoryConfig(capacity=4))
+    assert len(reopened.rows(0, 2000)) == 10
+
+
+def test_downsample_reports_min_max_avg_per_bucket(tmp_path):
+    store = HistoryStore(tmp_path, HistoryConfig(capacity=3))
+    fill(store, 10)
+
+    buckets = store.downsample(1000.0, 1100.0, 2)
+    assert [bucket["count"] for bucket in buckets] == [5, 5]
+    first = buckets[0]
+    assert first["execute_ms"] == {"min": 0.0, "max": 4.0, "avg": 2.0}
+    assert first["status"] == {"error": 3, "noop": 2}
+    assert buckets[1]["total_ms"]["max"] == 10.0
+
+
+def test_downsample_matches_per_row_aggregation(tmp_path):
+    store = HistoryStore(tmp_path, HistoryConfig(capacity=7))
+    fill(store, 50, step=3.0)
+
+    start, end, buckets = 1010.0, 1140.0, 9
+    width = (end - start) / buckets
+    expected = {}
+    for row in store.rows(start, end, limit=1000):
+        bucket = min(buckets - 1, int((row["timestamp"] - start) / width))
+        entry = expected.setdefault(bucket, {"count": 0, "status": {}, "values": []})
+        entry["count"] += 1
+        entry["status"][row["status"]] = entry["status"].get(row["status"], 0) + 1
+        entry["values"].append(row["execute_ms"])
+
+    result = store.downsample(start, end, buckets)
+    assert [item["start"] for item in result] == [start + bucket * width for bucket in sorted(expected)]
+    for item, bucket in zip(result, sorted(expected)):
+        entry = expected[bucket]
+        values = entry["values"]
+        assert item["count"] == entry["count"]
+        assert item["status"] == entry["status"]
+        assert item["execute_ms"] == {"min": min(values), "max": max(values), "avg": sum(values) / len(values)}
+
+
+def test_disk_budget_drops_oldest_segments(tmp_path):
+    store = HistoryStore(tmp_path, HistoryConfig(capacity=100, max_disk_bytes=8000))
+    fill(store, 1000)
+
+    stats = store.stats()
+    assert stats["disk_bytes"] <= 8000
+    rows = store.rows(0, 1e9, limit=10000)
+    assert rows[-1]["timestamp"] == 1000.0 + 999 * 10
+    assert rows[0]["timestamp"] > 1000.0
@@ -0,0 +1,66 @@
+import base64
+import json
+
+import pytest
+
+from agent.runtime.app import PendingPatch
+from agent.runtime.patch_index import PatchIndex, PatchQuery
+
+
+def make_patch(index: int, author: str) -> PendingPatch:
+    return PendingPatch(
+        patch_id=f"p-{index:02d}",
+        summary=f"patch {index}",
+        author=author,
+        created_at=f"2025-10-{index + 1:02d}T00:00:00Z",
+        artifact_uri=f"file:///tmp/p-{index:02d}.diff",
+    )
+
+
+@pytest.fixture()
+def index() -> PatchIndex:
+    patches = PatchIndex()
+    for i in (3, 0, 4, 1, 2):
+        patches.add(make_patch(i, "alice" if i % 2 else "bob"))
+    return patches
+
+
+def test_cursor_pagination_walks_all_pages(index):
+    seen = []
+    cursor = None
+    while True:
+        page = index.query(PatchQuery(limit=2, cursor=cursor))
+        seen.extend(patch.patch_id for patch in page.items)
+        if page.next_cursor is None:
+            break
+        cursor = page.next_cursor
+    assert seen == ["p-00", "p-01", "p-02", "p-03", "p-04"]
+
+
+def test_descending_filters_and_removal(index):
+    page = index.query(PatchQuery(sort="patch_id", descending=True, author="bob"))
+    assert [patch.patch_id for patch in page.items] == ["p-04", "p-02", "p-00"]
+
+    ranged = index.query(PatchQuery(created_after="2025-10-02T00:00:00+00:00", created_before="2025-10-04T00:00:00Z"))
+    assert [patch.patch_id for patch in ranged.items] == ["p-01", "p-02"]
+
+    index.pop("p-02")
+    by_author = index.query(PatchQuery(sort="author", author="bob"))
+    assert [patch.patch_id for patch in by_author.items] == ["p-00", "p-04"]
+    assert len(index) == 4
+
+
+def test_cursor_must_match_sort(index):
+    page = index.query(PatchQuery(limit=1))
+    with pytest.raises(ValueError):
+        index.query(PatchQuery(sort="author", cursor=page.next_cursor))
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [["created_at", 5, "p-00"], ["created_at", "2025-10-01", None], ["unknown", "x", "p-00"], {"a": 1, "b": 2, "c": 3}],
+)
+def test_malformed_cursor_is_rejected(index, payload):
+    cursor = base64.urlsafe_b64encode(json.dumps(payload).encode("utf-8")).decode("ascii")
+    with pytest.raises(ValueError):
+        index.query(PatchQuery(cursor=cursor))
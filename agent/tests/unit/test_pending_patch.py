@@ -0,0 +1,56 @@
+import json
+
+from agent.runtime.app import AuditLogIndex, PendingPatch
+
+
+def make_patch() -> PendingPatch:
+    return PendingPatch(
+        patch_id="p-1",
+        summary="概要",
+        author="staging",
+        created_at="2025-10-16T00:00:00Z",
+        artifact_uri="file:///tmp/p-1.diff",
+        diff_preview="diff --git a b",
+    )
+
+
+def test_serialized_forms_are_cached_and_invalidated():
+    patch = make_patch()
+    encoded = patch.to_json()
+    assert patch.to_json() is encoded
+    assert json.loads(encoded)["diff_preview"] == "diff --git a b"
+
+    response = json.loads(patch.to_response_json())
+    assert "diff_preview" not in response
+    assert response["summary"] == "概要"
+
+    patch.artifact_local_path = "/state/p-1.artifact"
+    assert json.loads(patch.to_json())["artifact_local_path"] == "/state/p-1.artifact"
+    assert json.loads(patch.to_response_json())["artifact_local_path"] == "/state/p-1.artifact"
+
+
+def test_to_dict_round_trips():
+    patch = make_patch()
+    assert PendingPatch(**json.loads(patch.to_json())) == patch
+
+
+def test_audit_index_reads_only_requested_lines(tmp_path):
+    path = tmp_path / "audit.log"
+    index = AuditLogIndex(path)
+    assert index.page(0, 10) == ([], 0)
+
+    with path.open("w", encoding="utf-8") as fp:
+        for i in range(5):
+            fp.write(json.dumps({"n": i}) + "\n")
+    assert index.page(1, 2) == ([{"n": 1}, {"n": 2}], 5)
+
+    # 書き込み途中の行は数えない
+    with path.open("a", encoding="utf-8") as fp:
+        fp.write('{"n": 5}\n{"n":')
+    assert index.page(0, 2, newest_first=True) == ([{"n": 5}, {"n": 4}], 6)
+    with path.open("a", encoding="utf-8") as fp:
+        fp.write(" 6}\n")
+    assert index.page(0, None, newest_first=True)[0][0] == {"n": 6}
+
+    path.write_text('{"n": 0}\n', encoding="utf-8")
+    assert index.page() == ([{"n": 0}], 1)
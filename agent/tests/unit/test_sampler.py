@@ -0,0 +1,95 @@
+import math
+
+from agent.drive.sampler import ProcReader, ResourceSampler, RingBuffer, SamplerConfig, safety_margin
+
+
+def write_proc(root, cpu, mem_available, load, net_bytes):
+    (root / "net").mkdir(parents=True, exist_ok=True)
+    (root / "stat").write_text(f"cpu  {cpu[0]} 0 0 {cpu[1]} 0 0 0 0 0 0\ncpu0 0 0 0 0\n")
+    (root / "meminfo").write_text(f"MemTotal:  1000 kB\nMemFree: 10 kB\nMemAvailable: {mem_available} kB\n")
+    (root / "loadavg").write_text(f"{load} 0.00 0.00 1/100 1\n")
+    (root / "net" / "dev").write_text(
+        "Inter-|   Receive\n face |bytes\n"
+        "    lo: 999 0 0 0 0 0 0 0 999 0 0 0 0 0 0 0\n"
+        f"  eth0: {net_bytes} 0 0 0 0 0 0 0 {net_bytes} 0 0 0 0 0 0 0\n"
+    )
+
+
+def test_ring_buffer_wraps():
+    buffer = RingBuffer(3, columns=("value",))
+    for value in range(5):
+        buffer.append({"value": float(value)})
+    assert len(buffer) == 3
+    assert [row["value"] for row in buffer.latest(5)] == [4.0, 3.0, 2.0]
+    assert buffer.column_mean("value", 2) == 3.5
+
+
+def test_reader_and_margin(tmp_path):
+    proc = tmp_path / "proc"
+    power = tmp_path / "sys" / "class" / "power_supply" / "BAT0"
+    power.mkdir(parents=True)
+    (power / "type").write_text("Battery\n")
+    (power / "capacity").write_text("40\n")
+
+    reader = ProcReader(proc_root=proc, sys_root=tmp_path / "sys")
+    sampler = ResourceSampler(SamplerConfig(interval_seconds=1.0, capacity=8, smoothing_samples=1), reader)
+    write_proc(proc, cpu=(100, 100), mem_available=800, load=0.1, net_bytes=1000)
+    first = sampler.sample()
+    assert math.isnan(first["cpu_busy"])
+    assert first["mem_available"] == 0.8
+
+    write_proc(proc, cpu=(190, 110), mem_available=800, load=0.1, net_bytes=3000)
+    second = reader.read(first["timestamp"] + 1)
+    assert second["cpu_busy"] == 0.9
+    assert second["net_bytes_per_second"] == 4000
+    assert second["battery"] == 0.4
+    assert math.isclose(safety_margin(second), 0.1)
+
+    status = sampler.status()
+    assert status["samples"] == 1
+    assert status["overhead_ratio"] is not None
+
+
+def test_interval_widens_when_over_budget(tmp_path):
+    class SlowReader(ProcReader):
+        def read(self, now):
+            import time
+
+            time.sleep(0.01)
+            return {"timestamp": now}
+
+    sampler = ResourceSampler(SamplerConfig(interval_seconds=0.1, max_overhead_ratio=0.01), SlowReader())
+    sampler.sample()
+    assert sampler.interval_seconds > 0.1
+    assert sampler.margin() == 1.0
+
+
+def test_interval_narrows_back_when_samples_are_cheap():
+    class OnceSlowReader(ProcReader):
+        calls = 0
+
+        def read(self, now):
+            import time
+
+            OnceSlowReader.calls += 1
+            if OnceSlowReader.calls == 1:
+                time.sleep(0.01)
+            return {"timestamp": now}
+
+    sampler = ResourceSampler(
+        SamplerConfig(interval_seconds=0.1, capacity=64, max_overhead_ratio=0.01, smoothing_samples=1), OnceSlowReader()
+    )
+    sampler.sample()
+    assert sampler.interval_seconds > 0.1
+    for _ in range(20):
+        sampler.sample()
+    assert sampler.interval_seconds == 0.1
+
+
+def test_margin_ignores_short_spikes():
+    sampler = ResourceSampler(SamplerConfig(pressure_samples=3))
+    for busy in (0.1, 1.0, 1.0):
+        sampler.buffer.append({"cpu_busy": busy})
+    assert math.isclose(sampler.margin(), 0.9)
+    sampler.buffer.append({"cpu_busy": 1.0})
+    assert sampler.margin() == 0.0
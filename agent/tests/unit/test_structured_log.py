@@ -0,0 +1,72 @@
+import io
+import json
+
+from loguru import logger
+
+from agent.runtime.structured_log import JsonLogSink, LogConfig, SampleFilter
+
+
+def read_lines(path):
+    names = [f"{path.name}.2", f"{path.name}.1", path.name]
+    return [
+        json.loads(line)
+        for name in names
+        if path.with_name(name).exists()
+        for line in path.with_name(name).read_text().splitlines()
+    ]
+
+
+def test_sink_writes_json_with_context_and_samples(tmp_path):
+    path = tmp_path / "runtime.jsonl"
+    sink = JsonLogSink(LogConfig(path=path), console=io.StringIO())
+    handler = logger.add(sink, format="{message}", filter=SampleFilter(1.0))
+    try:
+        with logger.contextualize(patch_id="p-1"):
+            logger.info("Apply patch requested: {}", "p-1")
+        for index in range(50):
+            with logger.contextualize(iteration=index + 1):
+                logger.bind(sample="executor.execute").info("Executing plan: {}", index)
+    finally:
+        logger.remove(handler)
+        sink.close()
+
+    lines = read_lines(path)
+    assert lines[0]["message"] == "Apply patch requested: p-1"
+    assert lines[0]["patch_id"] == "p-1"
+    assert lines[0]["level"] == "INFO"
+    sampled = [line for line in lines if line["message"].startswith("Executing plan")]
+    # 1 秒あたり 1 件に間引かれ、ループ全体でも数件しか残らない
+    assert 1 <= len(sampled) <= 3
+    assert sampled[0]["iteration"] == 1
+    assert "sample" not in sampled[0]
+    assert sink.stats()["written"] == 1 + len(sampled)
+
+
+def test_sink_rotates_by_size(tmp_path):
+    path = tmp_path / "runtime.jsonl"
+    sink = JsonLogSink(LogConfig(path=path, max_bytes=1000, backups=2), console=io.StringIO())
+    handler = logger.add(sink, format="{message}")
+    try:
+        for index in range(100):
+            logger.info("line {}", index)
+    finally:
+        logger.remove(handler)
+        sink.close()
+
+    assert path.with_name("runtime.jsonl.2").exists()
+    assert not path.with_name("runtime.jsonl.3").exists()
+    assert all(path.with_name(name).stat().st_size <= 1000 for name in ("runtime.jsonl", "runtime.jsonl.1"))
+    assert read_lines(path)[-1]["message"] == "line 99"
+
+
+def test_sink_drops_instead_of_blocking_when_queue_is_full(tmp_path):
+    console = io.StringIO()
+    sink = JsonLogSink(LogConfig(path=None, queue_size=1), console=console)
+    sink.close()
+    handler = logger.add(sink, format="{message}")
+    try:
+        for _ in range(3):
+            logger.info("after close")
+    finally:
+        logger.remove(handler)
+    assert sink.stats()["dropped"] >= 2
@@ -0,0 +1,78 @@
+import pytest
+
+from agent.runtime.patch_executor import PatchExecutor
+from agent.runtime.workspace_snapshot import SnapshotRestoreError, restore_snapshot, take_snapshot, touched_paths
+
+
+def test_touched_paths_ignores_hunk_lines_and_unsafe_paths(tmp_path):
+    diff = tmp_path / "p.diff"
+    diff.write_text(
+        "diff --git a/docs/a.md b/docs/a.md\n"
+        "--- a/docs/a.md\n+++ b/docs/a.md\n"
+        "@@ -1,2 +1,1 @@\n--- not a header\n keep\n"
+        "diff --git a/img.png b/img.png\nBinary files a/img.png and b/img.png differ\n"
+        "--- a/../etc/passwd\n+++ b/../etc/passwd\n"
+        "diff --git a/old.py b/new.py\nrename from old.py\nrename to new.py\n",
+        encoding="utf-8",
+    )
+    assert touched_paths(diff) == ["docs/a.md", "img.png", "old.py", "new.py"]
+
+
+def test_restore_verifies_before_touching_workspace(tmp_path):
+    workspace = tmp_path / "ws"
+    workspace.mkdir()
+    (workspace / "a.txt").write_text("a1")
+    (workspace / "b.txt").write_text("b1")
+    snapshot = tmp_path / "snap"
+    manifest = take_snapshot("p", workspace, ["a.txt", "b.txt", "c.txt"], snapshot)
+    assert manifest.cloned + manifest.copied == 2
+
+    (workspace / "a.txt").write_text("a2")
+    (workspace / "b.txt").write_text("b2")
+    (workspace / "c.txt").write_text("c2")
+    (snapshot / "files" / "b.txt").write_text("tampered")
+    with pytest.raises(SnapshotRestoreError):
+        restore_snapshot(snapshot)
+    assert (workspace / "a.txt").read_text() == "a2"
+    assert sorted(p.name for p in workspace.iterdir()) == ["a.txt", "b.txt", "c.txt"]
+
+    (snapshot / "files" / "b.txt").write_text("b1")
+    restore_snapshot(snapshot)
+    assert (workspace / "a.txt").read_text() == "a1"
+    assert (workspace / "b.txt").read_text() == "b1"
+    assert not (workspace / "c.txt").exists()
+
+
+def test_rollback_does_not_overwrite_changes_made_after_apply(tmp_path, monkeypatch):
+    workspace = tmp_path / "ws"
+    workspace.mkdir()
+    (workspace / "a.txt").write_text("v1\n")
+    hook = tmp_path / "apply.sh"
+    hook.write_text("#!/bin/sh\necho v2 > a.txt\necho new > b.txt\n")
+    hook.chmod(0o755)
+    monkeypatch.setenv("PATCH_APPLY_HOOK", str(hook))
+    artifact = tmp_path / "p.diff"
+    artifact.write_text("--- a/a.txt\n+++ b/a.txt\n@@ -1 +1 @@\n-v1\n+v2\n--- /dev/null\n+++ b/b.txt\n@@ -0,0 +1 @@\n+new\n")
+    executor = PatchExecutor(workspace)
+    snapshot = tmp_path / "snap"
+    assert executor.apply("p", artifact, snapshot_dir=snapshot).ok
+
+    (workspace / "b.txt").write_text("edited\n")
+    refused = executor.rollback("p", snapshot)
+    assert not refused.ok and "b.txt" in refused.detail
+    assert (workspace / "a.txt").read_text() == "v2\n"
+    assert (workspace / "b.txt").read_text() == "edited\n"
+
+    rollback_hook = tmp_path / "rollback.sh"
+    rollback_hook.write_text("#!/bin/sh\necho v1 > a.txt\n")
+    rollback_hook.chmod(0o755)
+    monkeypatch.setenv("PATCH_ROLLBACK_HOOK", str(rollback_hook))
+    result = executor.rollback("p", snapshot)
+    assert result.ok and result.command == str(rollback_hook) and "conflict" in result.detail
+    assert (workspace / "b.txt").read_text() == "edited\n"
+
+    (workspace / "a.txt").write_text("v2\n")
+    (workspace / "b.txt").write_text("new\n")
+    assert executor.rollback("p", snapshot).command == "snapshot"
+    assert (workspace / "a.txt").read_text() == "v1\n"
+    assert not (workspace / "b.txt").exists()
@@ -1,21 +1,42 @@
 #!/usr/bin/env bash
-# runtime/staging の重要データを tar.gz にまとめるシンプルなスクリプト。
+# runtime の state (PATCH_STORAGE_DIR) と logs を重複排除スナップショットとして保存する。
+# 2 回目以降は変更されたチャンクだけが backups/repo に追加される。
+#   ./host-tools/backup.sh            # スナップショット作成
+#   ./host-tools/backup.sh verify     # 全スナップショットを検証
+#   ./host-tools/backup.sh restore <id> --target <dir>
+# Docker volume を tar.gz で丸ごと保存したい場合は `--docker` を指定する (従来方式)。
 set -euo pipefail
 
 ROOT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"
 BACKUP_DIR="$ROOT_DIR/backups"
-TIMESTAMP="$(date +%Y%m%d_%H%M%S)"
-ARCHIVE="$BACKUP_DIR/yamada6_backup_${TIMESTAMP}.tar.gz"
 
-mkdir -p "$BACKUP_DIR"
+if [[ "${1:-}" == "--docker" ]]; then
+  TIMESTAMP="$(date +%Y%m%d_%H%M%S)"
+  ARCHIVE="$BACKUP_DIR/yamada6_backup_${TIMESTAMP}.tar.gz"
+  mkdir -p "$BACKUP_DIR"
+  docker run --rm \
+    -v yamada6_runtime_state:/data/state:ro \
+    -v yamada6_runtime_logs:/data/logs:ro \
+    -v "$BACKUP_DIR":/backup \
+    alpine:3.19 \
+    sh -c "cd /data && tar -czf /backup/$(basename "$ARCHIVE") state logs"
+  echo "Backup created: $ARCHIVE"
+  exit 0
+fi
 
-# Docker volume のバックアップは `docker run --rm` で取得する必要がある。
-# ここでは runtime_state / runtime_logs のスナップショットを取る。
-docker run --rm \
-  -v yamada6_runtime_state:/data/state:ro \
-  -v yamada6_runtime_logs:/data/logs:ro \
-  -v "$BACKUP_DIR":/backup \
-  alpine:3.19 \
-  sh -c "cd /data && tar -czf /backup/$(basename "$ARCHIVE") state logs"
+if [[ -f "$ROOT_DIR/.patch_env" ]]; then
+  set -a
+  # shellcheck disable=SC1091
+  source "$ROOT_DIR/.patch_env"
+  set +a
+fi
 
-echo "Backup created: $ARCHIVE"
+PYTHON="python3"
+if [[ -x "$ROOT_DIR/agent/.venv/bin/python" ]]; then
+  PYTHON="$ROOT_DIR/agent/.venv/bin/python"
+fi
+
+if [[ $# -eq 0 ]]; then
+  set -- create
+fi
+exec "$PYTHON" "$ROOT_DIR/agent/scripts/backup.py" --repo "$BACKUP_DIR/repo" "$@"
@@ -1,10 +1,17 @@
 const statusEl = document.getElementById('status');
-const pendingTable = document.querySelector('#pending-table tbody');
-const appliedTable = document.querySelector('#applied-table tbody');
-const auditTable = document.querySelector('#audit-table tbody');
 const refreshBtn = document.getElementById('refresh-btn');
 const controlButtons = document.querySelectorAll('.controls button');
 const patchForm = document.getElementById('patch-form');
+const diffPanel = document.getElementById('diff-panel');
+const diffTitle = document.getElementById('diff-title');
+const diffBody = document.getElementById('diff-body');
+
+// 仮想テーブルの行は固定高さ。style.css の .vrow td / .table-viewport と合わせること。
+const ROW_HEIGHT = 36;
+const VIEWPORT_ROWS = 12;
+const OVERSCAN = 6;
+const AUDIT_PAGE_SIZE = 100;
+const PATCH_PAGE_SIZE = 100;
 
 async function fetchJSON(url, options) {
   const res = await fetch(url, options);
@@ -15,88 +22,314 @@ async function fetchJSON(url, options) {
   return res.json();
 }
 
-function renderStatus(payload) {
-  statusEl.innerHTML = `
-    <ul>
-      <li>Loop count: ${payload.loop_count}</li>
-      <li>Paused: ${payload.paused}</li>
-      <li>Interval: ${payload.loop_interval_seconds}s</li>
-      <li>Last plan: ${payload.last_plan ? payload.last_plan.summary : '-'} </li>
-      <li>Pending patches: ${payload.pending_patches.length}</li>
-    </ul>
-  `;
+async function fetchPage(url) {
+  const res = await fetch(url);
+  if (!res.ok) {
+    const text = await res.text();
+    throw new Error(`${res.status} ${res.statusText}\n${text}`);
+  }
+  const total = Number(res.headers.get('X-Total-Count') || 0);
+  return { items: await res.json(), total };
 }
 
-function renderPending(patches) {
-  pendingTable.innerHTML = '';
-  patches.forEach((patch) => {
-    const tr = document.createElement('tr');
-    tr.innerHTML = `
-      <td>${patch.patch_id}</td>
-      <td>${patch.summary}</td>
-      <td>${patch.author}</td>
-      <td>${patch.created_at}</td>
-      <td>
-        <button data-apply="${patch.patch_id}">apply</button>
-        <button data-rollback="${patch.patch_id}">rollback</button>
-        <button data-toggle="${patch.patch_id}">diff</button>
-      </td>
-    `;
-    pendingTable.appendChild(tr);
-
-    if (patch.diff_preview) {
-      const trPreview = document.createElement('tr');
-      trPreview.className = 'diff-row';
-      const td = document.createElement('td');
-      td.colSpan = 5;
-      td.innerHTML = `<pre>${patch.diff_preview.replace(/</g, '&lt;')}</pre>`;
-      trPreview.dataset.diffFor = patch.patch_id;
-      trPreview.hidden = true;
-      trPreview.appendChild(td);
-      pendingTable.appendChild(trPreview);
+/**
+ * `limit` / `cursor` でページングされる一覧。`X-Next-Cursor` があれば続きを持つ。
+ * 再取得時は先頭ページだけを読み直し、続きはスクロールで表示範囲に入ったときに読む。
+ */
+class CursorList {
+  constructor(url, onChange) {
+    this.url = url;
+    this.onChange = onChange;
+    this.items = [];
+    this.nextCursor = null;
+    this.loading = null;
+    this.generation = 0;
+  }
+
+  get total() {
+    // 続きがある間は末尾に読み込み中の行を 1 つ置き、表示されたら次ページを読む
+    return this.items.length + (this.nextCursor ? 1 : 0);
+  }
+
+  async fetchPage(cursor) {
+    const params = new URLSearchParams({ limit: String(PATCH_PAGE_SIZE) });
+    if (cursor) params.set('cursor', cursor);
+    const separator = this.url.includes('?') ? '&' : '?';
+    const res = await fetch(`${this.url}${separator}${params}`);
+    if (!res.ok) {
+      const text = await res.text();
+      throw new Error(`${res.status} ${res.statusText}\n${text}`);
     }
-  });
+    return { items: await res.json(), nextCursor: res.headers.get('X-Next-Cursor') };
+  }
+
+  async reload() {
+    this.generation += 1;
+    const generation = this.generation;
+    const page = await this.fetchPage(null);
+    if (generation !== this.generation) return;
+    this.items = page.items;
+    this.nextCursor = page.nextCursor;
+    this.loading = null;
+    this.onChange(this);
+  }
+
+  loadMore() {
+    if (!this.nextCursor || this.loading) return;
+    const generation = this.generation;
+    this.loading = this.fetchPage(this.nextCursor)
+      .then((page) => {
+        // 途中で reload された場合は古いカーソルの結果を捨てる
+        if (generation !== this.generation) return;
+        this.items = this.items.concat(page.items);
+        this.nextCursor = page.nextCursor;
+        this.onChange(this);
+      })
+      .catch(console.error)
+      .finally(() => {
+        if (generation === this.generation) this.loading = null;
+      });
+  }
+
+  ensureLoaded(end) {
+    if (end >= this.items.length) this.loadMore();
+  }
 }
 
-function renderApplied(patches) {
-  appliedTable.innerHTML = '';
-  patches.forEach((patch) => {
+/**
+ * 表示範囲の行だけを描画するテーブル。
+ * 行は key で DOM を再利用し、セル内容が変わった行だけ更新する。
+ */
+class VirtualTable {
+  constructor(table, { rowKey, cells, onRange }) {
+    this.viewport = table.closest('.table-viewport');
+    this.tbody = table.querySelector('tbody');
+    this.rowKey = rowKey;
+    this.cells = cells;
+    this.onRange = onRange;
+    this.total = 0;
+    this.getRow = () => undefined;
+    this.rows = new Map();
+    this.pending = false;
+
+    this.tbody.textContent = '';
+    this.topSpacer = this.createSpacer();
+    this.bottomSpacer = this.createSpacer();
+    this.tbody.append(this.topSpacer, this.bottomSpacer);
+    this.viewport.addEventListener('scroll', () => this.schedule(), { passive: true });
+  }
+
+  createSpacer() {
     const tr = document.createElement('tr');
-    tr.innerHTML = `
-      <td>${patch.patch_id}</td>
-      <td>${patch.summary}</td>
-      <td>${patch.notes || patch.artifact_local_path || ''}</td>
-    `;
-    appliedTable.appendChild(tr);
-  });
+    tr.className = 'spacer';
+    return tr;
+  }
+
+  setRows(total, getRow) {
+    this.total = total;
+    this.getRow = getRow;
+    this.schedule();
+  }
+
+  schedule() {
+    if (this.pending) return;
+    this.pending = true;
+    requestAnimationFrame(() => {
+      this.pending = false;
+      this.render();
+    });
+  }
+
+  render() {
+    const height = Math.max(this.viewport.clientHeight, ROW_HEIGHT * VIEWPORT_ROWS);
+    const visible = Math.ceil(height / ROW_HEIGHT);
+    const start = Math.max(0, Math.floor(this.viewport.scrollTop / ROW_HEIGHT) - OVERSCAN);
+    const end = Math.min(this.total, start + visible + OVERSCAN * 2);
+
+    this.topSpacer.style.height = `${start * ROW_HEIGHT}px`;
+    this.bottomSpacer.style.height = `${(this.total - end) * ROW_HEIGHT}px`;
+
+    const next = new Map();
+    let previous = this.topSpacer;
+    for (let index = start; index < end; index += 1) {
+      const row = this.getRow(index);
+      const key = row ? this.rowKey(row) : `loading:${index}`;
+      let tr = this.rows.get(key);
+      if (!tr || next.has(key)) {
+        tr = document.createElement('tr');
+        tr.className = 'vrow';
+      }
+      this.updateRow(tr, row);
+      if (previous.nextSibling !== tr) {
+        this.tbody.insertBefore(tr, previous.nextSibling);
+      }
+      previous = tr;
+      next.set(key, tr);
+    }
+    this.rows.forEach((tr, key) => {
+      if (next.get(key) !== tr) tr.remove();
+    });
+    this.rows = next;
+
+    if (this.onRange) this.onRange(start, end);
+  }
+
+  updateRow(tr, row) {
+    const values = row ? this.cells(row) : ['…'];
+    const signature = JSON.stringify(values);
+    if (tr.dataset.signature === signature) return;
+    tr.dataset.signature = signature;
+    tr.textContent = '';
+    values.forEach((value) => {
+      const td = document.createElement('td');
+      if (value && typeof value === 'object' && value.buttons) {
+        value.buttons.forEach(({ label, data }) => {
+          const button = document.createElement('button');
+          button.textContent = label;
+          Object.assign(button.dataset, data);
+          td.appendChild(button);
+        });
+      } else {
+        td.textContent = value ?? '';
+        td.title = value ?? '';
+      }
+      tr.appendChild(td);
+    });
+  }
 }
 
-function renderAudit(entries) {
-  auditTable.innerHTML = '';
-  entries.slice().reverse().forEach((entry) => {
-    const tr = document.createElement('tr');
-    tr.innerHTML = `
-      <td>${entry.timestamp}</td>
-      <td>${entry.patch_id}</td>
-      <td>${entry.status}</td>
-      <td>${entry.detail || ''}</td>
-    `;
-    auditTable.appendChild(tr);
+const pendingView = new VirtualTable(document.getElementById('pending-table'), {
+  rowKey: (patch) => patch.patch_id,
+  cells: (patch) => [
+    patch.patch_id,
+    patch.summary,
+    patch.author,
+    patch.created_at,
+    {
+      buttons: [
+        { label: 'apply', data: { apply: patch.patch_id } },
+        { label: 'rollback', data: { rollback: patch.patch_id } },
+        { label: 'diff', data: { toggle: patch.patch_id } },
+      ],
+    },
+  ],
+  onRange: (start, end) => pendingList.ensureLoaded(end),
+});
+
+const appliedView = new VirtualTable(document.getElementById('applied-table'), {
+  rowKey: (patch) => patch.patch_id,
+  cells: (patch) => [
+    patch.patch_id,
+    patch.summary,
+    patch.notes || patch.artifact_local_path || '',
+    { buttons: [{ label: 'diff', data: { toggle: patch.patch_id } }] },
+  ],
+  onRange: (start, end) => appliedList.ensureLoaded(end),
+});
+
+function bindList(view) {
+  return (list) => view.setRows(list.total, (index) => list.items[index]);
+}
+
+const pendingList = new CursorList('/patches?fields=patch_id,summary,author,created_at', bindList(pendingView));
+const appliedList = new CursorList(
+  '/patches/applied?fields=patch_id,summary,notes,artifact_local_path',
+  bindList(appliedView),
+);
+
+// 監査ログは新しい順にページ単位で取得し、表示範囲に入ったページだけを読み込む
+const auditPages = new Map();
+const auditLoading = new Set();
+let auditTotal = 0;
+
+const auditView = new VirtualTable(document.getElementById('audit-table'), {
+  rowKey: (entry) => `${entry.timestamp}|${entry.patch_id}|${entry.status}`,
+  cells: (entry) => [entry.timestamp, entry.patch_id, entry.status, entry.detail || ''],
+  onRange: (start, end) => {
+    if (end <= start) return;
+    const first = Math.floor(start / AUDIT_PAGE_SIZE);
+    const last = Math.floor((end - 1) / AUDIT_PAGE_SIZE);
+    for (let page = first; page <= last; page += 1) loadAuditPage(page);
+  },
+});
+
+function auditRow(index) {
+  const page = auditPages.get(Math.floor(index / AUDIT_PAGE_SIZE));
+  return page ? page[index % AUDIT_PAGE_SIZE] : undefined;
+}
+
+async function loadAuditPage(page) {
+  if (auditPages.has(page) || auditLoading.has(page)) return;
+  auditLoading.add(page);
+  try {
+    const { items, total } = await fetchPage(
+      `/patches/audit?order=desc&offset=${page * AUDIT_PAGE_SIZE}&limit=${AUDIT_PAGE_SIZE}`,
+    );
+    auditPages.set(page, items);
+    auditTotal = total;
+    auditView.setRows(auditTotal, auditRow);
+  } catch (err) {
+    console.error(err);
+  } finally {
+    auditLoading.delete(page);
+  }
+}
+
+async function refreshAudit() {
+  const { items, total } = await fetchPage(`/patches/audit?order=desc&offset=0&limit=${AUDIT_PAGE_SIZE}`);
+  auditPages.clear();
+  auditPages.set(0, items);
+  auditTotal = total;
+  auditView.setRows(auditTotal, auditRow);
+}
+
+function renderStatus(payload) {
+  const items = [
+    `Loop count: ${payload.loop_count}`,
+    `Paused: ${payload.paused}`,
+    `Interval: ${payload.loop_interval_seconds}s`,
+    `Last plan: ${payload.last_plan ? payload.last_plan.summary : '-'}`,
+    `Pending patches: ${payload.pending_count}`,
+  ];
+  const ul = document.createElement('ul');
+  items.forEach((text) => {
+    const li = document.createElement('li');
+    li.textContent = text;
+    ul.appendChild(li);
   });
+  statusEl.replaceChildren(ul);
+}
+
+let openDiffId = null;
+
+async function toggleDiff(id) {
+  if (openDiffId === id) {
+    openDiffId = null;
+    diffPanel.hidden = true;
+    return;
+  }
+  openDiffId = id;
+  diffTitle.textContent = id;
+  diffBody.textContent = '読み込み中...';
+  diffPanel.hidden = false;
+  try {
+    const res = await fetch(`/patches/${encodeURIComponent(id)}/diff`);
+    const text = await res.text();
+    if (openDiffId === id) diffBody.textContent = res.ok ? text || '(diff なし)' : text;
+  } catch (err) {
+    diffBody.textContent = err.message;
+  }
 }
 
 async function refreshAll() {
   try {
-    const [status, pending, applied, audit] = await Promise.all([
-      fetchJSON('/status'),
-      fetchJSON('/patches'),
-      fetchJSON('/patches/applied'),
-      fetchJSON('/patches/audit'),
+    const [status] = await Promise.all([
+      fetchJSON('/status?compact=true'),
+      pendingList.reload(),
+      appliedList.reload(),
+      refreshAudit(),
     ]);
     renderStatus(status);
-    renderPending(pending);
-    renderApplied(applied);
-    renderAudit(audit);
   } catch (err) {
     console.error(err);
     alert(`取得に失敗しました\n${err.message}`);
@@ -105,6 +338,13 @@ async function refreshAll() {
 
 refreshBtn.addEventListener('click', refreshAll);
 
+document.getElementById('applied-table').addEventListener('click', async (event) => {
+  const target = event.target;
+  if (target instanceof HTMLButtonElement && target.dataset.toggle) {
+    await toggleDiff(target.dataset.toggle);
+  }
+});
+
 controlButtons.forEach((btn) => {
   btn.addEventListener('click', async () => {
     const action = btn.dataset.action;
@@ -117,14 +357,12 @@ controlButtons.forEach((btn) => {
   });
 });
 
-pendingTable.addEventListener('click', async (event) => {
+document.getElementById('pending-table').addEventListener('click', async (event) => {
   const target = event.target;
   if (!(target instanceof HTMLButtonElement)) return;
 
   if (target.dataset.toggle) {
-    const id = target.dataset.toggle;
-    const row = pendingTable.querySelector(`tr[data-diff-for="${id}"]`);
-    if (row) row.hidden = !row.hidden;
+    await toggleDiff(target.dataset.toggle);
     return;
   }
 